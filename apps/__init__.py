@@ -3,22 +3,37 @@ import logging
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
-from flask_socketio import SocketIO
 
 app = Flask(__name__)
 app.config.from_object(os.environ['APP_SETTINGS'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-socketio = SocketIO(app)
+socketio = None
 
 db = SQLAlchemy(app)
 login = LoginManager(app)
 login.login_view = 'login'
 
 
-from apps import models, command
+def get_socketio():
+    ''' SocketIO of the web process, created on first use; CLI commands never need it '''
+    global socketio
+    if socketio is None:
+        from flask_socketio import SocketIO
+        from apps.live import register
+
+        socketio = SocketIO(app)
+        register(socketio)
+    return socketio
+
+
+from apps import models, metrics, live, command, migrate, latest, rollup, arrival, gapfill, export, partition, archive, bench, startup, replay, scheduler
+
+if os.environ.get('FLASK_RUN_FROM_CLI') != 'true':
+    # web process (gunicorn): SocketIO wraps app as before
+    get_socketio()
 
 if __name__ == '__main__':
     gunicorn_logger = logging.getLogger('gunicorn.error')
     app.logger.handlers = gunicorn_logger.handlers
     app.logger.setLevel(gunicorn_logger.level)
-    socketio.run(app)
+    get_socketio().run(app)
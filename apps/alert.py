@@ -0,0 +1,175 @@
+import datetime
+import logging
+import time
+from collections import deque
+
+from apps import db
+from apps.models import Location, Periodik, Tenant
+from apps.delivery import KEEP_RECENT, TelegramQueue
+from apps.ingest import listeners
+
+HUJAN_LEBAT = 10  # mm / jam
+HUJAN_SANGAT_LEBAT = 20  # mm / jam
+RAIN_WINDOW = datetime.timedelta(hours=1)
+WLEV_WINDOW = datetime.timedelta(hours=1)
+WLEV_NAIK = 50  # centi kenaikan TMA dalam WLEV_WINDOW
+CLEAR_RATIO = 0.5  # alert aktif lagi setelah nilai turun di bawah batas * CLEAR_RATIO
+REFRESH = 300  # detik, muat ulang nama lokasi dan batas tenant
+
+RAIN_LEVEL = {1: "Hujan Lebat", 2: "Hujan Sangat Lebat"}
+
+
+class LocationState:
+    ''' sliding window of one location, only what the thresholds need '''
+    __slots__ = ('sn', 'tenant_id', 'rain', 'rain_sum', 'wlev', 'newest',
+                 'samplings', 'rain_level', 'rising')
+
+    def __init__(self, sn, tenant_id):
+        self.sn = sn
+        self.tenant_id = tenant_id
+        self.rain = deque()  # (sampling, rain)
+        self.rain_sum = 0
+        self.wlev = deque()  # (sampling, wlev)
+        self.newest = None
+        self.samplings = set()  # sampling di dalam window, data yang sama tidak dihitung dua kali
+        self.rain_level = 0  # 0 normal, 1 lebat, 2 sangat lebat
+        self.rising = False
+
+    def add(self, sampling, rain, wlev):
+        if self.newest and sampling <= self.newest - max(RAIN_WINDOW, WLEV_WINDOW):
+            return False
+        if sampling in self.samplings:
+            return False
+        self.samplings.add(sampling)
+        self.newest = max(self.newest or sampling, sampling)
+        if rain:
+            self.rain.append((sampling, rain))
+            self.rain_sum += rain
+        if wlev is not None:
+            self.wlev.append((sampling, wlev))
+        while self.rain and self.rain[0][0] <= self.newest - RAIN_WINDOW:
+            self.rain_sum -= self.rain.popleft()[1]
+        while self.wlev and self.wlev[0][0] <= self.newest - WLEV_WINDOW:
+            self.wlev.popleft()
+        if not self.rain:
+            self.rain_sum = 0
+        horizon = self.newest - max(RAIN_WINDOW, WLEV_WINDOW)
+        self.samplings = set(s for s in self.samplings if s > horizon)
+        return True
+
+    def wlev_rise(self):
+        ''' rise of the latest wlev over the lowest wlev in the window '''
+        if len(self.wlev) < 2:
+            return 0
+        last = max(self.wlev)[1]
+        return last - min(w for s, w in self.wlev)
+
+
+class AlertEngine:
+    '''
+    Evaluate heavy rain and rising water level per location as samples are
+    recorded. A location alerts once when it enters a level and is re-armed
+    only after its value drops below threshold * CLEAR_RATIO.
+    '''
+
+    def __init__(self, outbox=None):
+        self.outbox = outbox
+        self.states = {}
+        self.tenants = {}
+        self.locations = {}
+        self.loaded_at = 0
+
+    def load(self, force=False):
+        ''' cache tenant alert chat and threshold, location name '''
+        if not force and time.monotonic() - self.loaded_at < REFRESH:
+            return
+        self.tenants = dict((t.id, t) for t in db.session.query(
+                            Tenant.id, Tenant.nama, Tenant.telegram_alert_id,
+                            Tenant.hujan_lebat, Tenant.hujan_sangat_lebat))
+        self.locations = dict(db.session.query(Location.id, Location.nama))
+        self.loaded_at = time.monotonic()
+
+    def warm_start(self):
+        ''' fill the windows from recent periodik, without sending alerts '''
+        self.load(force=True)
+        since = datetime.datetime.now() - max(RAIN_WINDOW, WLEV_WINDOW)
+        columns = [Periodik.logger_sn, Periodik.location_id, Periodik.tenant_id,
+                   Periodik.sampling, Periodik.rain, Periodik.wlev]
+        query = db.session.query(*columns).filter(
+                            Periodik.sampling > since).order_by(Periodik.sampling)
+        rows = [dict(zip(('logger_sn', 'location_id', 'tenant_id', 'sampling', 'rain', 'wlev'), r))
+                for r in query]
+        self.feed(rows, notify=False)
+        logging.debug(f"Alert warm start : {len(rows)} periodik, {len(self.states)} location")
+
+    def feed(self, rows, notify=True):
+        ''' add newly recorded Periodik rows (dict), send alerts of crossed thresholds '''
+        if notify:
+            self.load()
+            since = datetime.datetime.now() - RAIN_WINDOW
+        touched = {}
+        for row in rows:
+            if notify and row['sampling'] <= since:
+                continue  # data lama (backfill), bukan kejadian sekarang
+            key = row['location_id'] or row['logger_sn']
+            state = self.states.get(key)
+            if not state:
+                state = self.states[key] = LocationState(row['logger_sn'], row['tenant_id'])
+            if state.add(row['sampling'], row.get('rain'), row.get('wlev')):
+                touched[key] = state
+        for key, state in touched.items():
+            for message in self.evaluate(key, state):
+                if notify:
+                    self.send(state, message)
+
+    def evaluate(self, key, state):
+        ''' update alert levels of state, return messages of newly entered levels '''
+        tenant = self.tenants.get(state.tenant_id)
+        lebat = (tenant and tenant.hujan_lebat) or HUJAN_LEBAT
+        sangat_lebat = (tenant and tenant.hujan_sangat_lebat) or HUJAN_SANGAT_LEBAT
+        name = self.locations.get(key) or f"Lokasi {state.sn}"
+        messages = []
+
+        rain = round(state.rain_sum, 2)
+        level = 2 if rain > sangat_lebat else 1 if rain > lebat else 0
+        if level > state.rain_level:
+            messages.append(f"Terjadi {RAIN_LEVEL[level]} di {name} dengan intensitas "
+                            f"{rain} mm dalam {int(RAIN_WINDOW.total_seconds() // 60)} menit terakhir")
+            state.rain_level = level
+        elif state.rain_level == 2 and rain < sangat_lebat * CLEAR_RATIO:
+            state.rain_level = 1 if rain > lebat else 0
+        elif state.rain_level == 1 and rain < lebat * CLEAR_RATIO:
+            state.rain_level = 0
+
+        rise = round(state.wlev_rise(), 2)
+        if not state.rising and rise > WLEV_NAIK:
+            messages.append(f"Kenaikan Muka Air di {name} {rise} cm dalam "
+                            f"{int(WLEV_WINDOW.total_seconds() // 60)} menit terakhir, "
+                            f"TMA {round(max(state.wlev)[1], 2)} cm")
+            state.rising = True
+        elif state.rising and rise < WLEV_NAIK * CLEAR_RATIO:
+            state.rising = False
+        return messages
+
+    def send(self, state, message):
+        tenant = self.tenants.get(state.tenant_id)
+        logging.debug(f"Alert ({state.sn}) : {message}")
+        if not self.outbox or not tenant or not tenant.telegram_alert_id:
+            return
+        header = f"Peringatan, {state.newest.strftime('%d %b %Y %H:%M')}\n"
+        self.outbox.send(tenant.telegram_alert_id, header + message, name=tenant.nama)
+
+    def listener(self, rows):
+        ''' ingest hook, an alert error never breaks recording '''
+        try:
+            self.feed(rows)
+        except Exception as e:
+            logging.debug(f"Alert Error : {e}")
+
+
+def start_engine():
+    ''' AlertEngine warm started from periodik and hooked to the ingest path '''
+    engine = AlertEngine(outbox=TelegramQueue(keep=KEEP_RECENT))
+    engine.warm_start()
+    listeners.append(engine.listener)
+    return engine
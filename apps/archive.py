@@ -0,0 +1,141 @@
+import click
+import datetime
+import glob
+import json
+import os
+from collections import namedtuple
+
+from sqlalchemy import and_, func, or_
+
+from apps import app, db
+from apps.models import Raw
+
+ARCHIVE_DAYS = 30  # Raw lebih lama dari ini dipindah ke arsip
+RAW_PAGE = 5000  # Raw per query iter_raw
+COLUMNS = ('received', 'fingerprint', 'device', 'sampling', 'content')
+
+ArchivedRaw = namedtuple('ArchivedRaw', ['content', 'received'])
+
+
+def archive_dir():
+    return app.config.get('RAW_ARCHIVE_DIR') or os.path.join(os.getcwd(), 'raw_archive')
+
+
+def archive_path(day):
+    return os.path.join(archive_dir(), f"raw-{day:%Y-%m-%d}.npz")
+
+
+def to_columns(rows):
+    ''' return {column: numpy array} of [(received, fingerprint, content)] '''
+    import numpy as np
+
+    return {
+        'received': np.array([r[0] for r in rows], dtype='datetime64[us]'),
+        'fingerprint': np.array([r[1] or '' for r in rows], dtype='U32'),
+        'device': np.array([r[2].get('device') or '' for r in rows], dtype='U'),
+        'sampling': np.array([r[2].get('sampling') or 0 for r in rows], dtype='int64'),
+        'content': np.array([json.dumps(r[2]) for r in rows], dtype='U'),
+    }
+
+
+def read_day(path):
+    ''' return {column: numpy array} of one archive file, pandas.DataFrame(read_day(path)) works too '''
+    import numpy as np
+
+    with np.load(path) as data:
+        return dict((c, data[c]) for c in COLUMNS)
+
+
+def write_day(day, rows):
+    ''' append rows to the archive file of day, written to a temp file then renamed '''
+    import numpy as np
+
+    columns = to_columns(rows)
+    path = archive_path(day)
+    if os.path.exists(path):
+        old = read_day(path)
+        columns = dict((c, np.concatenate([old[c], columns[c]])) for c in COLUMNS)
+    os.makedirs(archive_dir(), exist_ok=True)
+    tmp = path + '.tmp.npz'
+    np.savez_compressed(tmp, **columns)
+    os.replace(tmp, path)
+    return path
+
+
+def archive_raw(days=ARCHIVE_DAYS):
+    '''
+    Move Raw received more than `days` days ago to one compressed npz file
+    per day, deleting each day from the table once its file is written.
+    Return number of Raw archived.
+    '''
+    before = datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=days), datetime.time())
+    first = db.session.query(func.min(Raw.received)).scalar()
+    total = 0
+    day = first and datetime.datetime.combine(first.date(), datetime.time())
+    while day and day < before:
+        day_end = day + datetime.timedelta(days=1)
+        query = db.session.query(Raw.id, Raw.received, Raw.fingerprint, Raw.content).filter(
+                            Raw.received >= day, Raw.received < day_end).order_by(Raw.received)
+        rows = query.all()
+        if rows:
+            write_day(day, [r[1:] for r in rows])
+            ids = [r[0] for r in rows]
+            for i in range(0, len(ids), 1000):
+                db.session.query(Raw).filter(Raw.id.in_(ids[i:i + 1000])).delete(synchronize_session=False)
+            db.session.commit()
+            print(f"{day:%Y-%m-%d} : {len(rows)} raw archived")
+            total += len(rows)
+        day = day_end
+    return total
+
+
+def iter_raw(start, end, page=RAW_PAGE):
+    '''
+    Yield ArchivedRaw(content, received) received between start and end,
+    from the archive files first then from the Raw table, in received order
+    within each source. The table is read in keyset pages on (received, id)
+    fetched whole, no cursor stays open so the caller may commit (even on
+    SQLite) while iterating.
+    '''
+    import numpy as np
+
+    day = datetime.datetime.combine(start.date(), datetime.time())
+    while day <= end:
+        path = archive_path(day)
+        if os.path.exists(path):
+            data = read_day(path)
+            received = data['received'].astype(object)
+            for i in np.argsort(data['received'], kind='stable'):
+                if start <= received[i] <= end:
+                    yield ArchivedRaw(json.loads(data['content'][i]), received[i])
+        day += datetime.timedelta(days=1)
+    after = None
+    while True:
+        query = db.session.query(Raw.id, Raw.content, Raw.received).filter(Raw.received.between(start, end))
+        if after:
+            query = query.filter(or_(Raw.received > after[0],
+                                     and_(Raw.received == after[0], Raw.id > after[1])))
+        rows = query.order_by(Raw.received, Raw.id).limit(page).all()
+        for id, content, received in rows:
+            yield ArchivedRaw(content, received)
+        if len(rows) < page:
+            return
+        after = (rows[-1].received, rows[-1].id)
+
+
+def archived_days():
+    return sorted(os.path.basename(p)[4:14] for p in glob.glob(os.path.join(archive_dir(), 'raw-*.npz'))
+                  if not p.endswith('.tmp.npz'))
+
+
+@app.cli.command()
+@click.argument('command')
+@click.option('-d', '--days', default=ARCHIVE_DAYS, help='Umur Raw yang diarsipkan (hari)')
+def raw_archive(command, days):
+    ''' Archive (move / list) old Raw payloads to compressed npz files '''
+    if command == 'move':
+        total = archive_raw(days)
+        print(f"{total} raw archived to {archive_dir()}")
+    elif command == 'list':
+        for day in archived_days():
+            print(day)
@@ -0,0 +1,117 @@
+import click
+import datetime
+
+from apps import app, db
+from apps.models import Logger, Tenant, PeriodikHourly
+from apps.rollup import DAY
+
+SLOTS = 288  # slot 5 menit per hari
+SLOT = datetime.timedelta(minutes=5)
+SHADES = ' .:-=+*#%@'  # 0% .. 100%
+
+
+def day_start(day, tz="Asia/Jakarta"):
+    ''' naive UTC of 00:00 of day (date) in tz, the way periodik sampling is stored '''
+    import pytz
+
+    start = pytz.timezone(tz).localize(datetime.datetime.combine(day, datetime.time()))
+    return start.astimezone(pytz.utc).replace(tzinfo=None)
+
+
+def arrival_matrix(start, days=1, by='location', tenant_id=None, keys=None):
+    '''
+    Return (keys, bool array [key, day, slot]) of `days` days from start
+    (naive UTC, on the hour) by location_id or logger_sn, out of the slot
+    masks of periodik_hourly: 24 rows per logger and day, no periodik read.
+    Loggers of one location are OR-ed.
+    '''
+    import numpy as np
+
+    column = PeriodikHourly.location_id if by == 'location' else PeriodikHourly.logger_sn
+    query = db.session.query(column, PeriodikHourly.sampling, PeriodikHourly.slots).filter(
+                    PeriodikHourly.sampling > start,
+                    PeriodikHourly.sampling <= start + days * DAY,
+                    column.isnot(None),
+                    PeriodikHourly.slots.isnot(None))
+    if tenant_id:
+        query = query.filter(PeriodikHourly.tenant_id == tenant_id)
+    if keys is not None:
+        query = query.filter(column.in_(keys))
+    rows = query.all()
+
+    keys = sorted(keys if keys is not None else set(r[0] for r in rows))
+    index = dict((k, i) for i, k in enumerate(keys))
+    matrix = np.zeros((len(keys), days, SLOTS), dtype=bool)
+    if not rows:
+        return keys, matrix
+    key_idx = np.array([index[r[0]] for r in rows])
+    # bucket jam h berisi slot jam (h - 1), dihitung dari start
+    hours = ((np.array([r[1] for r in rows], dtype='datetime64[us]') - np.datetime64(start, 'us'))
+             / np.timedelta64(1, 'h')).astype(int) - 1
+    masks = np.array([r[2] for r in rows], dtype=np.int64)
+    bits = (masks[:, None] >> np.arange(12)) & 1  # [row, slot dalam jam]
+    row, slot = np.nonzero(bits)
+    matrix[key_idx[row], hours[row] // 24, (hours[row] % 24) * 12 + slot] = True
+    return keys, matrix
+
+
+def percent(matrix):
+    ''' arrival percent of the last axis (slots) of a bitmap or matrix '''
+    return matrix.mean(axis=-1) * 100
+
+
+def missing_intervals(bitmap, start):
+    ''' [(from, to)] datetimes of every run of empty slots of a day bitmap starting at start '''
+    import numpy as np
+
+    edges = np.diff(np.concatenate(([1], bitmap.astype(int), [1])))
+    return [(start + int(a) * SLOT, start + int(b) * SLOT)
+            for a, b in zip(np.nonzero(edges == -1)[0], np.nonzero(edges == 1)[0])]
+
+
+def format_intervals(intervals, offset=datetime.timedelta(), limit=3):
+    ''' "10:00-11:30, 14:05-14:20 (+2)" with times shifted by offset (UTC to local) '''
+    text = ', '.join(f"{(a + offset):%H:%M}-{(b + offset):%H:%M}" for a, b in intervals[:limit])
+    if len(intervals) > limit:
+        text += f" (+{len(intervals) - limit})"
+    return text
+
+
+@app.cli.command()
+@click.option('-d', '--days', default=7, help='Jumlah hari')
+@click.option('-e', '--end', default='', help='Hari terakhir (YYYY-MM-DD), default kemarin')
+@click.option('-t', '--tenant', default='', help='Slug tenant, default semua tenant')
+@click.option('-l', '--logger', 'sn', default='', help='SN logger, tampilkan jam data kosong per hari')
+def arrival(days, end, tenant, sn):
+    ''' Data arrival (kehadiran) heatmap of N days x every logger, from the hourly slot masks '''
+    end = datetime.datetime.strptime(end, "%Y-%m-%d").date() if end \
+        else datetime.date.today() - datetime.timedelta(days=1)
+    first = end - datetime.timedelta(days=days - 1)
+    ten = Tenant.query.filter_by(slug=tenant).first() if tenant else None
+    if tenant and not ten:
+        print(f"Tenant {tenant} not found")
+        return
+    tz = (ten.timezone if ten else None) or "Asia/Jakarta"
+    start = day_start(first, tz)
+    offset = datetime.datetime.combine(first, datetime.time()) - start
+
+    if sn:
+        keys, matrix = arrival_matrix(start, days, by='logger', keys=[sn])
+        for d in range(days):
+            day = start + d * DAY
+            gaps = missing_intervals(matrix[0, d], day)
+            print(f"{(day + offset):%Y-%m-%d} : {percent(matrix[0, d]):6.2f}%  "
+                  f"{format_intervals(gaps, offset, limit=len(gaps)) or '-'}")
+        return
+
+    # logger tanpa data tetap tampil, 0%
+    loggers = Logger.query.filter_by(tenant_id=ten.id) if ten else Logger.query
+    keys, matrix = arrival_matrix(start, days, by='logger', keys=[l.sn for l in loggers])
+    pct = percent(matrix)  # [logger, day]
+    print(f"{'sn':<10} {''.join(f'{(first + datetime.timedelta(days=d)).day % 10}' for d in range(days))}   rata2")
+    for i, key in enumerate(keys):
+        cells = ''.join(SHADES[min(len(SHADES) - 1, int(p / 100 * (len(SHADES) - 1) + 0.5))] for p in pct[i])
+        print(f"{key:<10} {cells}   {pct[i].mean():6.2f}%")
+    if len(keys):
+        print(f"{'semua':<10} {' ' * days}   {pct.mean():6.2f}%")
+    print(f"\n{first} - {end} ({tz}), '{SHADES[0]}' 0% .. '{SHADES[-1]}' 100%")
@@ -0,0 +1,203 @@
+import click
+import contextlib
+import datetime
+import io
+import json
+import math
+import os
+import random
+import subprocess
+import time
+
+from sqlalchemy import event
+
+from apps import app, db
+from apps.models import Logger, Location, Tenant, Periodik, Raw
+from apps.ingest import record_batch, periodik_row, insert_ignore, after_record, raw_row
+from apps.registry import loggers as registry
+from apps.command import recordperiodic, ch_report, tma_report, count_report, rain_alert
+
+RESULTS = 'bench-results.jsonl'
+INTERVAL = 300  # detik, 5 menit
+INGEST_MESSAGES = 2000
+BATCH = 200
+
+
+class QueryCounter:
+    ''' count statements sent to the database while active '''
+
+    def __init__(self):
+        self.count = 0
+        event.listen(db.engine, 'before_cursor_execute', self.on_execute)
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def safe_database():
+    ''' only run against SQLite or a database whose name says it is throwaway '''
+    url = db.engine.url
+    return url.drivername.startswith('sqlite') or 'bench' in (url.database or '') \
+        or 'test' in (url.database or '')
+
+
+def reset_database():
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    registry.invalidate()
+
+
+def payload(ten, logger, sampling, rng):
+    ''' MQTT payload of logger at sampling (epoch), rain in showers, wlev in slow waves '''
+    raw = {
+        'device': f"{ten.slug}/{logger.sn}/0",
+        'sampling': sampling,
+        'up_since': sampling - 86400,
+        'time_set_at': sampling - 86400,
+        'battery': round(12.6 - rng.random(), 2),
+        'signal_quality': rng.randint(10, 31),
+        'temperature': round(24 + 6 * rng.random(), 1),
+        'humidity': round(60 + 30 * rng.random(), 1),
+        'pressure': 1008,
+    }
+    if logger.tipe == 'arr':
+        raw['tick'] = rng.choice([0] * 20 + [1, 2, 5, 12])
+    else:
+        raw['distance'] = round(600 + 200 * math.sin(sampling / 43200), 1)
+    return raw
+
+
+def generate(tenants, locations, days, rng):
+    '''
+    Create `tenants` tenants with `locations` locations (and one logger each,
+    alternately rain and water level) and `days` days of 5 minute data
+    ending now. Return (tenants, loggers, number of periodik).
+    '''
+    now = datetime.datetime.utcnow()
+    for t in range(tenants):
+        ten = Tenant(nama=f"Bench {t}", slug=f"bench{t}", telegram_alert_id=t + 1, telegram_info_id=t + 1)
+        db.session.add(ten)
+        db.session.flush()
+        for l in range(locations):
+            tipe = '1' if l % 2 == 0 else '2'
+            pos = Location(nama=f"Pos {t}-{l}", tipe=tipe, tenant_id=ten.id)
+            db.session.add(pos)
+            db.session.flush()
+            db.session.add(Logger(sn=f"b{t}-{l}", tipe='arr' if tipe == '1' else 'awlr',
+                                  tenant_id=ten.id, location_id=pos.id, created_at=now))
+    db.session.commit()
+    registry.invalidate()
+
+    ten_list = Tenant.query.all()
+    tenant_of = dict((ten.id, ten) for ten in ten_list)
+    logger_list = Logger.query.all()
+    end = int(time.time()) // INTERVAL * INTERVAL
+    total = 0
+    for day in range(days, 0, -1):
+        start = end - day * 86400
+        rows, raws = [], []
+        for logger in logger_list:
+            info = registry.get(logger.sn)
+            for sampling in range(start, start + 86400, INTERVAL):
+                raw = payload(tenant_of[logger.tenant_id], logger, sampling, rng)
+                row = periodik_row(raw, info)
+                rows.append(row)
+                raws.append(raw_row(raw, row['received']))
+        recorded = insert_ignore(Periodik.__table__, rows, keys=('logger_sn', 'sampling'))
+        insert_ignore(Raw.__table__, raws)
+        after_record(recorded)
+        db.session.commit()
+        total += len(recorded)
+    return ten_list, logger_list, total
+
+
+def timed(counter, func, *args):
+    ''' return (seconds, queries) of func(*args), its output discarded '''
+    db.session.expire_all()
+    before = counter.count
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(*args)
+    return time.perf_counter() - started, counter.count - before
+
+
+def bench_ingest(counter, tenants, loggers, rng, messages=INGEST_MESSAGES):
+    ''' messages/s of recordperiodic (one by one) and record_batch (per BATCH) '''
+    tenant_of = dict((ten.id, ten) for ten in tenants)
+    start = int(time.time()) // INTERVAL * INTERVAL + INTERVAL
+    payloads = [payload(tenant_of[loggers[i % len(loggers)].tenant_id], loggers[i % len(loggers)],
+                        start + (i // len(loggers)) * INTERVAL, rng) for i in range(messages * 2)]
+    single, batch = payloads[:messages], payloads[messages:]
+
+    seconds, queries = timed(counter, lambda: [recordperiodic(raw) for raw in single])
+    result = {'single': {'messages': messages, 'seconds': seconds,
+                         'per_second': messages / seconds, 'queries': queries}}
+    seconds, queries = timed(counter, lambda: [record_batch(batch[i:i + BATCH])
+                                               for i in range(0, messages, BATCH)])
+    result['batch'] = {'messages': messages, 'seconds': seconds,
+                       'per_second': messages / seconds, 'queries': queries}
+    return result
+
+
+def bench_reports(counter, tenants):
+    ''' latency and query count of every report, summed over tenants '''
+    now = datetime.datetime.now()
+    start = (now - datetime.timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    end = start.replace(hour=23, minute=56)
+
+    result = {}
+    for name, func in (('ch_report', lambda ten: ch_report(ten, now)),
+                       ('tma_report', lambda ten: tma_report(ten, now)),
+                       ('count_report', lambda ten: count_report(ten, start, end))):
+        seconds, queries = 0, 0
+        for ten in tenants:
+            s, q = timed(counter, func, ten)
+            seconds += s
+            queries += q
+        result[name] = {'seconds': seconds, 'queries': queries}
+    seconds, queries = timed(counter, rain_alert, now)
+    result['rain_alert'] = {'seconds': seconds, 'queries': queries}
+    return result
+
+
+def version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+@app.cli.command()
+@click.option('-t', '--tenants', default=2, help='Jumlah tenant')
+@click.option('-s', '--sizes', default='10,50', help='Jumlah lokasi per tenant, dipisah koma')
+@click.option('-d', '--days', default=7, help='Hari data periodik')
+@click.option('-o', '--output', default=RESULTS, help='File hasil (JSON per baris)')
+@click.option('--seed', default=1, help='Seed data sintetis')
+def bench(tenants, sizes, days, output, seed):
+    ''' Benchmark ingest and reports on synthetic fleets (drops every table!) '''
+    if not safe_database():
+        print(f"Refusing to run on {db.engine.url!r}, use SQLite or a database named *bench* / *test*")
+        return
+    app.config['TELEGRAM_TRANSPORT'] = 'memory'
+    counter = QueryCounter()
+    for size in [int(s) for s in sizes.split(',')]:
+        rng = random.Random(seed)
+        reset_database()
+        started = time.perf_counter()
+        ten_list, logger_list, total = generate(tenants, size, days, rng)
+        result = {
+            'version': version(),
+            'at': datetime.datetime.utcnow().isoformat(),
+            'dialect': db.engine.dialect.name,
+            'fleet': {'tenants': tenants, 'locations': tenants * size, 'days': days,
+                      'periodik': total, 'generate_seconds': time.perf_counter() - started},
+            'reports': bench_reports(counter, ten_list),
+            'ingest': bench_ingest(counter, ten_list, logger_list, rng),
+        }
+        with open(output, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+        print(json.dumps(result, indent=2))
+    db.session.remove()
+    print(f"Results appended to {os.path.abspath(output)}")
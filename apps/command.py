@@ -1,50 +1,74 @@
 import click
 import logging
-import requests
 import datetime
 import os
 import json
-import daemonocle
-import paho.mqtt.subscribe as subscribe
+import functools
 
-from sqlalchemy import func, or_, desc
-from sqlalchemy.exc import IntegrityError
-from pytz import timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import perf_counter
 
-from telegram import Bot
+from sqlalchemy import func, or_, literal, text, bindparam
+from sqlalchemy.exc import IntegrityError
 
 from apps import app, db
-from apps.models import Logger, Location, Raw, Tenant, Periodik
+from apps.models import Logger, Location, Raw, Tenant, Periodik, PeriodikHourly
+from apps.ingest import IngestBuffer, IngestPool, BATCH_AGE, get_sn, periodik_row, raw_row, record_batch, insert_ignore, after_record, notify_listeners
+from apps.registry import loggers as registry
+from apps.delivery import TelegramQueue
+from apps.alert import start_engine, HUJAN_LEBAT, HUJAN_SANGAT_LEBAT
+from apps.archive import iter_raw
+from apps.spool import Spool, DRAIN_BATCH
+from apps.live import start_publisher
+from apps.metrics import metrics, serve as serve_stats
+from apps.latest import get_latest
+from apps.rollup import hourly_between, rebuild_rollup
+from apps.reportcache import cached_report
+from apps.arrival import arrival_matrix, day_start, format_intervals, missing_intervals, percent as slot_percent
 
 bws_sul2 = ("bwssul2", "limboto1029")
 
 URL = "https://prinus.net/api/sensor"
+FETCH_WORKERS = 8
+FETCH_TIMEOUT = 60  # detik
 MQTT_HOST = "mqtt.bbws-bsolo.net"
 MQTT_PORT = 14983
 MQTT_TOPICS = "sensors"
 MQTT_CLIENT = None
-HUJAN_LEBAT = 10
-HUJAN_SANGAT_LEBAT = 20
+INGEST_BUFFER = None
+ALERT_ENGINE = None
+SPOOL = None
+STOP_TIMEOUT = 120  # detik, waktu menyimpan antrian saat listen stop
 POS_NAME = {
     '1': "Hujan",
     '2': "Duga Air",
     '4': "Klimatologi"
 }
+ISO_FORMAT = "%Y-%m-%dT%H:%M:%S"  # waktu di report_cache
+
+LOG_FILE = '/tmp/pbasemqttsub.log'
+
 
-logging.basicConfig(
-        filename='/tmp/pbasemqttsub.log',
-        level=logging.DEBUG, format='%(asctime)s [%(levelname)s] %(message)s')
+def setup_logging():
+    ''' debug log to LOG_FILE, set up by the commands that run unattended, not on import '''
+    logging.basicConfig(
+            filename=LOG_FILE,
+            level=logging.DEBUG, format='%(asctime)s [%(levelname)s] %(message)s')
 
 
 def utc2local(time, tz="Asia/Jakarta"):
     ''' return with datetime in local(tz) timezone, default=Asia/Jakarta '''
+    from pytz import timezone
+
     time = time.astimezone(timezone(tz))
     return time
 
 
 def local2utc(time):
     ''' return with datetime in utc timezone '''
-    time = time.astimezone(timezone('UTC'))
+    from pytz import utc
+
+    time = time.astimezone(utc)
     return time
 
 
@@ -74,6 +98,7 @@ def prettydate(d):
 @app.cli.command()
 @click.argument('command')
 def telegram(command):
+    setup_logging()
     time = datetime.datetime.now()
     if command == 'test-daily':
         test_daily(time)
@@ -87,23 +112,22 @@ def telegram(command):
         periodik_count_report(time)
     elif command == 'warning':
         print("Sending Alert Message")
-        rain_alert(time)
+        with metrics.timer('report_rain_alert'):
+            rain_alert(time)
+    metrics.dump(f"telegram-{command}")
 
 
-def send_telegram(bot, id, name, message, debug_text):
-    debug_text = f"Sending Telegram to {name}"
-    try:
-        bot.sendMessage(id, text=message, parse_mode='Markdown')
-        logging.debug(f"{debug_text}")
-    except Exception as e:
-        logging.debug(f"{debug_text} Error : {e}")
+def send_telegram(outbox, id, name, message, debug_text):
+    ''' queue message to be delivered in the background by outbox (TelegramQueue) '''
+    outbox.send(id, message, parse_mode='Markdown', name=name)
 
 
-def periodik_report(time):
-    ''' Message Tenants about last 2 hour rain and water level '''
-    bot = Bot(token=app.config['PRINUSBOT_TOKEN'])
+def periodik_report(time, tenants=None):
+    ''' Message Tenants (every tenant if not given) about last 2 hour rain and water level '''
+    outbox = TelegramQueue()
 
-    tenants = Tenant.query.order_by(Tenant.id).all()
+    if tenants is None:
+        tenants = Tenant.query.order_by(Tenant.id).all()
 
     for ten in tenants:
         tz = ten.timezone or "Asia/Jakarta"
@@ -114,39 +138,53 @@ def periodik_report(time):
             continue
 
         # Curah Hujan
-        final_ch, message = ch_report(ten, time)
-        send_telegram(bot, ten.telegram_info_id, ten.nama, final_ch, f"TeleRep-send {ten.nama}")
+        with metrics.timer('report_ch'):
+            final_ch, message = ch_report(ten, time)
+        send_telegram(outbox, ten.telegram_info_id, ten.nama, final_ch, f"TeleRep-send {ten.nama}")
 
         # TMA
-        final_tma, message = tma_report(ten, time)
-        send_telegram(bot, ten.telegram_info_id, ten.nama, final_tma, f"TeleRep-send {ten.nama}")
+        with metrics.timer('report_tma'):
+            final_tma, message = tma_report(ten, time)
+        send_telegram(outbox, ten.telegram_info_id, ten.nama, final_tma, f"TeleRep-send {ten.nama}")
 
+    outbox.close()
     # bot.sendMessage(app.config['TELEGRAM_TEST_ID'], text="Sending 2-Hourly Reports to All Tenants")
 
 
-def ch_report(ten, time):
-    tz = ten.timezone or "Asia/Jakarta"
+def report_hour(ten, time):
+    ''' the hour (tenant local time) a report made at time covers up to '''
     end = datetime.datetime.strptime(f"{time.strftime('%Y-%m-%d')} {time.hour}:00:00", "%Y-%m-%d %H:%M:%S")
-    end = utc2local(end, tz=tz)
-    start = getstarttime(end)
+    return utc2local(end, tz=ten.timezone or "Asia/Jakarta")
 
-    final = f"*Curah Hujan {end.strftime('%d %b %Y')}*\n"
-    final += f"{start.strftime('%H:%M')} - {end.strftime('%H:%M')}\n"
-    message = ""
 
+def ch_report(ten, time):
+    end = report_hour(ten, time)
+    start = getstarttime(end)
     locations = Location.query.filter(
                                 or_(Location.tipe == '1', Location.tipe == '4'),
                                 Location.tenant_id == ten.id).all()
 
+    def build():
+        summary = get_rain_summary(start, end, tenant_id=ten.id)
+        return [{'location_id': location_id, 'rain': res['rain'], 'duration': res['duration'],
+                 'percent': res['percent']} for location_id, res in summary.items()]
+
+    # rollup jam pertama dimulai dari awal jam start
+    result = cached_report(ten.id, 'ch', end, (start.replace(minute=0), end), build)
+    summary = dict((res['location_id'], res) for res in result)
+
+    final = f"*Curah Hujan {end.strftime('%d %b %Y')}*\n"
+    final += f"{start.strftime('%H:%M')} - {end.strftime('%H:%M')}\n"
+    message = ""
     i = 0
     for pos in locations:
-        result = get_periodik_sum(pos, start, end)
-        latest = get_latest_telemetri(pos)
+        res = summary.get(pos.id) or empty_rain_summary()
+        latest = prettydate(pos.latest_sampling) if pos.latest_sampling else "Belum Ada Data"
 
         i += 1
-        rain = f"{round(result['rain'], 2)} mm selama {result['duration']} menit" if result['rain'] > 0 else '-'
+        rain = f"{round(res['rain'], 2)} mm selama {res['duration']} menit" if res['rain'] > 0 else '-'
         message += f"\n{i}. {pos.nama} : {rain}"
-        message += f"\n     {result['percent']}%, data terakhir {latest['latest']}\n"
+        message += f"\n     {res['percent']}%, data terakhir {latest}\n"
 
     if message:
         final += message
@@ -161,15 +199,17 @@ def ch_report(ten, time):
 
 
 def tma_report(ten, time):
+    ''' latest water level per location, one indexed read through Location.latest_id, never cached '''
     locations = Location.query.filter(
                                 Location.tipe == '2',
                                 Location.tenant_id == ten.id).all()
+    latest_periodik = get_latest([pos.id for pos in locations]) if locations else {}
 
     final = f"*TMA*\n"
     message = ""
     i = 0
     for pos in locations:
-        latest = get_latest_telemetri(pos)
+        latest = get_latest_telemetri(pos, latest_periodik.get(pos.id))
 
         i += 1
         if latest['periodik']:
@@ -193,31 +233,47 @@ def tma_report(ten, time):
     return final, message
 
 
-def get_periodik_sum(pos, start, end):
-    periodics = Periodik.query.filter(
-                                Periodik.sampling.between(local2utc(start), local2utc(end)),
-                                Periodik.location_id == pos.id).all()
-    result = {
-        'pos': pos,
-        'rain': 0,
-        'duration': 0,
-        'percent': 0
-    }
-    for period in periodics:
-        result['percent'] += 1
-        if period.rain:
-            result['rain'] += period.rain
-            result['duration'] += 5
+def get_rain_summary(start, end, tenant_id=None):
+    '''
+    return {location_id: summary} of rain total, rainy duration and arrival
+    percent within start - end, in one grouped query over periodik_hourly
+    for every location of tenant_id (or every tenant)
+    '''
+    query = db.session.query(
+                    PeriodikHourly.location_id,
+                    func.sum(PeriodikHourly.rain),
+                    func.sum(PeriodikHourly.rain_minute),
+                    func.sum(PeriodikHourly.samples)).filter(
+                    hourly_between(local2utc(start), local2utc(end)),
+                    PeriodikHourly.location_id.isnot(None))
+    if tenant_id:
+        query = query.join(Location, Location.id == PeriodikHourly.location_id).filter(
+                    Location.tenant_id == tenant_id)
+    result = {}
+    for location_id, rain, duration, count in query.group_by(PeriodikHourly.location_id):
+        result[location_id] = {
+            'rain': rain or 0,
+            'duration': duration or 0,
+            'count': count,
+            'percent': arrival_percent(count, start, end)
+        }
+    return result
 
-    diff = end - start
-    percent = (result['percent']/(diff.seconds/300)) * 100
-    result['percent'] = round(percent, 2)
 
-    return result
+def empty_rain_summary():
+    return {'rain': 0, 'duration': 0, 'count': 0, 'percent': 0}
 
 
-def get_latest_telemetri(pos):
-    latest = Periodik.query.filter(Periodik.location_id == pos.id).order_by(desc(Periodik.sampling)).first()
+def arrival_percent(count, start, end):
+    ''' percent of 5 minutes data arrived within start - end '''
+    diff = end - start
+    percent = (count/(diff.seconds/300)) * 100
+    return round(percent, 2)
+
+
+def get_latest_telemetri(pos, latest=None):
+    if not latest and pos.latest_id:
+        latest = Periodik.query.get(pos.latest_id)
 
     result = {
         'periodik': latest,
@@ -230,11 +286,12 @@ def get_latest_telemetri(pos):
     return result
 
 
-def periodik_count_report(time):
-    ''' Message Tenants about last day periodic counts '''
-    bot = Bot(token=app.config['PRINUSBOT_TOKEN'])
+def periodik_count_report(time, tenants=None):
+    ''' Message Tenants (every tenant if not given) about last day periodic counts '''
+    outbox = TelegramQueue()
 
-    tenants = Tenant.query.order_by(Tenant.id).all()
+    if tenants is None:
+        tenants = Tenant.query.order_by(Tenant.id).all()
 
     for ten in tenants:
         print(f"Calculating for tenant {ten.nama} ({ten.id})")
@@ -244,118 +301,237 @@ def periodik_count_report(time):
         localtime = utc2local(time, tz=tz)
         if localtime.hour != 7:
             continue
-        end = datetime.datetime.strptime(f"{localtime.year}-{localtime.month}-{time.day - 1} 23:56:00", "%Y-%m-%d %H:%M:%S")
-        start = datetime.datetime.strptime(f"{localtime.year}-{localtime.month}-{time.day - 1} 00:00:00", "%Y-%m-%d %H:%M:%S")
-
-        final = '''*%(ten)s*\n*Kehadiran Data*\n%(tgl)s (0:0 - 23:55)
-        ''' % {'ten': ten.nama, 'tgl': start.strftime('%d %b %Y')}
-        message = ""
-
-        locations = Location.query.filter(
-                                    Location.tenant_id == ten.id).all()
-
-        i = 0
-        for pos in locations:
-            print(f"--- Location {pos.nama}")
-            i += 1
-            result = get_periodic_arrival(pos, start, end)
-            message += f"\n{i} {pos.nama} ({result['tipe']}) : {result['percent']}%"
+        start, end = yesterday(localtime)
 
-        if message:
-            final += message
-        else:
+        with metrics.timer('report_count'):
+            final, message = count_report(ten, start, end)
+        if not message:
             final += "\nBelum Ada Lokasi yg tercatat"
 
-        send_telegram(bot, ten.telegram_info_id, ten.nama, final, f"TeleCount-send {ten.nama}")
+        send_telegram(outbox, ten.telegram_info_id, ten.nama, final, f"TeleCount-send {ten.nama}")
         print(f"{localtime} : {final}")
         print()
+    outbox.close()
     # bot.sendMessage(app.config['TELEGRAM_TEST_ID'], text="Sending Daily Count Reports to All Tenants")
 
 
-def get_periodic_arrival(pos, start, end):
-    periodics = Periodik.query.filter(
-                                Periodik.sampling.between(local2utc(start), local2utc(end)),
-                                Periodik.location_id == pos.id).all()
+def yesterday(localtime):
+    ''' (00:00, 23:56) of the day before localtime, across month and year ends '''
+    start = datetime.datetime.combine((localtime - datetime.timedelta(days=1)).date(), datetime.time())
+    return start, start.replace(hour=23, minute=56)
+
+
+def count_report(ten, start, end):
+    ''' return (final, message) of data arrival per location of ten within start - end (day) '''
+    day = day_start(start.date(), ten.timezone or "Asia/Jakarta")
+    offset = start - day
+    locations = Location.query.filter(
+                                Location.tenant_id == ten.id).all()
+
+    def build():
+        arrival = get_arrival_bitmaps(ten, start, locations)
+        result = []
+        for pos in locations:
+            res = get_periodic_arrival(pos, day, arrival.get(pos.id))
+            result.append({'location_id': pos.id, 'percent': res['percent'],
+                           'missing': [(a.strftime(ISO_FORMAT), b.strftime(ISO_FORMAT)) for a, b in res['missing']]})
+        return result
+
+    result = cached_report(ten.id, 'count', day, (day, day + datetime.timedelta(days=1)), build)
+    arrival = dict((res['location_id'], res) for res in result)
+
+    final = '''*%(ten)s*\n*Kehadiran Data*\n%(tgl)s (0:0 - 23:55)
+    ''' % {'ten': ten.nama, 'tgl': start.strftime('%d %b %Y')}
+    message = ""
+    i = 0
+    for pos in locations:
+        print(f"--- Location {pos.nama}")
+        i += 1
+        tipe = POS_NAME[pos.tipe] if pos.tipe else "Lain-lain"
+        res = arrival.get(pos.id) or {'percent': 0, 'missing': []}
+        missing = [(datetime.datetime.strptime(a, ISO_FORMAT), datetime.datetime.strptime(b, ISO_FORMAT))
+                   for a, b in res['missing']]
+        message += f"\n{i} {pos.nama} ({tipe}) : {res['percent']}%"
+        if missing and res['percent']:
+            message += f"\n     kosong {format_intervals(missing, offset)}"
+
+    if message:
+        final += message
+    return final, message
+
+
+def get_arrival_bitmaps(ten, start, locations):
+    ''' return {location_id: 288 slot bitmap} of the day of start (tenant local) from periodik_hourly '''
+    if not locations:
+        return {}
+    day = day_start(start.date(), ten.timezone or "Asia/Jakarta")
+    keys, matrix = arrival_matrix(day, 1, tenant_id=ten.id, keys=[pos.id for pos in locations])
+    return dict((key, matrix[i, 0]) for i, key in enumerate(keys))
+
+
+def get_periodic_arrival(pos, day, bitmap=None):
+    ''' arrival percent and missing (from, to) intervals of pos in the day starting at day (UTC) '''
     tipe = POS_NAME[pos.tipe] if pos.tipe else "Lain-lain"
+    if bitmap is None:
+        return {'pos': pos, 'tipe': tipe, 'percent': 0, 'missing': []}
     result = {
         'pos': pos,
         'tipe': tipe,
-        'percent': 0
+        'percent': round(float(slot_percent(bitmap)), 2),
+        'missing': missing_intervals(bitmap, day)
     }
-    for period in periodics:
-        result['percent'] += 1
-
-    diff = end - start
-    percent = (result['percent']/(diff.seconds/300)) * 100
-    result['percent'] = round(percent, 2)
-
     return result
 
 
-def rain_alert(time):
-    ''' Message Tenants about heavy rain per location '''
-    start = datetime.datetime.strptime(f"{time.strftime('%Y-%m-%d')} {time.hour - 1}:00:00", "%Y-%m-%d %H:%M:%S")
-    end = datetime.datetime.strptime(f"{time.strftime('%Y-%m-%d')} {time.hour - 1}:59:00", "%Y-%m-%d %H:%M:%S")
-
-    bot = Bot(token=app.config['PRINUSBOT_TOKEN'])
-
+def get_heavy_rain(hour, tenant_ids=None):
+    '''
+    return [(tenant, location name, rain)] of locations whose rain in the hour
+    ending at `hour` is above the tenant (or default) HUJAN_LEBAT threshold,
+    in one grouped query over periodik_hourly, of tenant_ids or every tenant
+    '''
+    name = func.coalesce(Location.nama, literal('Lokasi ') + PeriodikHourly.logger_sn)
+    rain = func.sum(PeriodikHourly.rain)
+    query = db.session.query(Tenant, name, rain).select_from(PeriodikHourly).join(
+                    Logger, Logger.sn == PeriodikHourly.logger_sn).join(
+                    Tenant, Tenant.id == Logger.tenant_id).outerjoin(
+                    Location, Location.id == PeriodikHourly.location_id).filter(
+                    PeriodikHourly.sampling == hour,
+                    or_(Logger.tipe.is_(None), Logger.tipe != 'awlr'))
+    if tenant_ids is not None:
+        query = query.filter(Tenant.id.in_(tenant_ids))
+    query = query.group_by(
+                    Tenant.id, name).having(
+                    rain > func.coalesce(Tenant.hujan_lebat, HUJAN_LEBAT)).order_by(
+                    Tenant.id, name)
+    return query.all()
+
+
+def rain_alert(time, tenants=None):
+    ''' Message Tenants (every tenant if not given) about heavy rain per location '''
+    hour = time.replace(minute=0, second=0, microsecond=0)
+
+    outbox = TelegramQueue()
+
+    tenant_ids = None if tenants is None else [ten.id for ten in tenants]
     periodik_result = {}
-    periodics = Periodik.query.filter(Periodik.sampling.between(start, end))
-    for period in periodics:
-        if period.logger.tipe in ['awlr']:
-            continue
-        location_name = period.location.nama if period.location else f"Lokasi {period.logger_sn}"
-        if period.logger.tenant.nama not in periodik_result:
-            periodik_result[period.logger.tenant.nama] = {
+    for ten, location_name, rain in get_heavy_rain(hour, tenant_ids):
+        if ten.nama not in periodik_result:
+            periodik_result[ten.nama] = {
                 'logger': {},
-                'telegram_group': period.periodik_tenant.telegram_alert_group,
-                'telegram_id': period.periodik_tenant.telegram_alert_id
+                'telegram_group': ten.telegram_alert_group,
+                'telegram_id': ten.telegram_alert_id,
+                'sangat_lebat': ten.hujan_sangat_lebat or HUJAN_SANGAT_LEBAT
             }
-        if location_name not in periodik_result[period.logger.tenant.nama]['logger']:
-            periodik_result[period.periodik_tenant.nama]['logger'][location_name] = 0
-        periodik_result[period.periodik_tenant.nama]['logger'][location_name] += round(period.rain or 0, 2)
+        periodik_result[ten.nama]['logger'][location_name] = round(rain, 2)
 
     for ten, info in periodik_result.items():
         print(f"{ten}")
         header = f"Peringatan Hujan, {time.strftime('%d %b %Y')}, pukul {time.hour - 1} sampai {time.hour}\n"
         message = ""
         for loc, rain in info['logger'].items():
-            if rain > HUJAN_SANGAT_LEBAT:
+            if rain > info['sangat_lebat']:
                 message += f"Terjadi Hujan Sangat Lebat di {loc} dengan intensitas {rain} mm\n"
-            elif rain > HUJAN_LEBAT:
+            else:
                 message += f"Terjadi Hujan Lebat di {loc} dengan intensitas {rain} mm\n"
         if info['telegram_id'] and message:
-            try:
-                logging.debug(f"TeleWarn-send to {ten}")
-                final = header + message
-                bot.sendMessage(info['telegram_id'], text=final)
-            except Exception as e:
-                logging.debug(f"TeleWarn-send Error ({ten}) : {e}")
+            logging.debug(f"TeleWarn-send to {ten}")
+            final = header + message
+            outbox.send(info['telegram_id'], final, name=ten)
         print(header)
+    outbox.close()
     # bot.sendMessage(app.config['TELEGRAM_TEST_ID'], text="Sending Alert to All Tenants")
 
 
 @app.cli.command()
 @click.argument('command')
-def listen(command):
-    daemon = daemonocle.Daemon(worker=subscribe_topic,
-                              pidfile='listener.pid')
+@click.option('-b', '--batch-size', default=0, help='Jumlah pesan per batch (0: simpan per pesan)')
+@click.option('-a', '--batch-age', default=BATCH_AGE, help='Umur maksimal batch (detik)')
+@click.option('-w', '--workers', default=0, help='Jumlah proses ingest (0: di proses listener)')
+@click.option('-S', '--spool', default='', help='Direktori spool, pesan ditulis ke disk dulu')
+def listen(command, batch_size, batch_age, workers, spool):
+    import daemonocle
+
+    setup_logging()
+    worker = subscribe_topic
+    if batch_size or workers or spool:
+        worker = functools.partial(subscribe_topic, batch_size=batch_size, batch_age=batch_age,
+                                   workers=workers, spool=spool and os.path.abspath(spool))
+    daemon = daemonocle.Daemon(worker=worker,
+                              shutdown_callback=stop_ingest,
+                              pidfile='listener.pid',
+                              stop_timeout=STOP_TIMEOUT)
     daemon.do_action(command)
 
 
 def on_mqtt_message(client, userdata, msg):
-    data = json.loads(msg.payload.decode('utf-8'))
+    metrics.inc('messages')
+    with metrics.timer('decode'):
+        data = json.loads(msg.payload.decode('utf-8'))
+    metrics.seen(str(data.get('device') or '').split('/')[0])
+    if SPOOL:
+        SPOOL.append(data)
+        return
     # logging.debug(data.get('device'))
     # logging.debug('Message Received')
     # logging.debug(f"Topic : {msg.topic}")
+    if INGEST_BUFFER:
+        INGEST_BUFFER.add(data)
+        return
     result = recordperiodic(data)
     logging.debug(result)
 
 
-def subscribe_topic():
+def stop_ingest(message=None, code=None):
+    if SPOOL:
+        SPOOL.stop()
+    if INGEST_BUFFER:
+        INGEST_BUFFER.stop()
+    if ALERT_ENGINE and ALERT_ENGINE.outbox:
+        ALERT_ENGINE.outbox.close()
+
+
+def start_hooks():
+    ''' ingest listeners of a recording process, return its AlertEngine '''
+    try:
+        start_publisher()
+    except Exception as e:
+        logging.debug(f"Live publisher not started : {e}")
+    return start_engine()
+
+
+def subscribe_topic(batch_size=0, batch_age=BATCH_AGE, workers=0, spool=''):
+    global INGEST_BUFFER, ALERT_ENGINE, SPOOL
     logging.debug('Start listen...')
+    if spool:
+        # spool mencatat sendiri per batch, tanpa buffer / pool
+        SPOOL = Spool(spool, batch=batch_size or DRAIN_BATCH).start()
+        logging.debug(f"Spool : {spool}, backlog {SPOOL.backlog()} bytes")
+        metrics.gauge('spool_backlog_bytes', SPOOL.backlog)
+        workers = batch_size = 0
+    if workers:
+        # tiap proses ingest punya AlertEngine sendiri untuk logger bagiannya
+        INGEST_BUFFER = IngestPool(workers, batch_size=batch_size, batch_age=batch_age,
+                                   on_start=start_hooks).start()
+        logging.debug(f"Ingest pool : {workers} workers, batch {batch_size or 1}")
+        metrics.gauge('ingest_queue', INGEST_BUFFER.depth)
+    else:
+        try:
+            ALERT_ENGINE = start_hooks()
+        except Exception as e:
+            logging.debug(f"Alert engine not started : {e}")
+    if batch_size and not workers:
+        INGEST_BUFFER = IngestBuffer(size=batch_size, age=batch_age).start()
+        logging.debug(f"Buffered ingest : {batch_size} messages / {batch_age} seconds")
+    if not workers:
+        metrics.gauge('ingest_queue', lambda: len(INGEST_BUFFER.items) if INGEST_BUFFER else 0)
+    try:
+        serve_stats()
+    except Exception as e:
+        logging.debug(f"Stats endpoint not started : {e}")
     # MQTT_TOPICS = [ten.slug for ten in Tenant.query.all()]
     logging.debug(f"Topics : {MQTT_TOPICS}")
+    import paho.mqtt.subscribe as subscribe
+
     subscribe.callback(on_mqtt_message, MQTT_TOPICS,
                        hostname=MQTT_HOST, port=MQTT_PORT)
     logging.debug('Subscribed')
@@ -371,6 +547,9 @@ def check_listener():
 
 @app.cli.command()
 def fetch_logger():
+    import requests
+
+    setup_logging()
     res = requests.get(URL, auth=bws_sul2)
 
     if res.status_code == 200:
@@ -387,119 +566,210 @@ def fetch_logger():
         print(res.status_code)
 
 
+FIX_RAIN_TABLE = '''
+    CREATE TEMPORARY TABLE IF NOT EXISTS fix_rain_tick (
+        logger_sn VARCHAR(10), sampling TIMESTAMP, tick FLOAT)'''
+FIX_RAIN_UPDATE = {
+    'postgresql': '''
+        UPDATE periodik p SET rain = CASE WHEN t.tick > 0
+            THEN round((t.tick * coalesce(l.tipp_fac, 0.2))::numeric, 2) END
+        FROM fix_rain_tick t JOIN logger l ON l.sn = t.logger_sn
+        WHERE p.logger_sn = t.logger_sn AND p.sampling = t.sampling''',
+    'sqlite': '''
+        UPDATE periodik SET rain = (
+            SELECT CASE WHEN t.tick > 0 THEN round(t.tick * coalesce(l.tipp_fac, 0.2), 2) END
+            FROM fix_rain_tick t JOIN logger l ON l.sn = t.logger_sn
+            WHERE t.logger_sn = periodik.logger_sn AND t.sampling = periodik.sampling)
+        WHERE EXISTS (
+            SELECT 1 FROM fix_rain_tick t JOIN logger l ON l.sn = t.logger_sn
+            WHERE t.logger_sn = periodik.logger_sn AND t.sampling = periodik.sampling)''',
+}
+FIX_RAIN_INSERT = text(
+    "INSERT INTO fix_rain_tick (logger_sn, sampling, tick) VALUES (:sn, :sampling, :tick)").bindparams(
+    bindparam('sampling', type_=db.DateTime))
+FIX_RAIN_MISSING = text('''
+    SELECT t.logger_sn, t.sampling FROM fix_rain_tick t
+    LEFT JOIN periodik p ON p.logger_sn = t.logger_sn AND p.sampling = t.sampling
+    WHERE p.id IS NULL''').columns(logger_sn=db.String, sampling=db.DateTime)
+FIX_RAIN_CHUNK = 5000
+
+
+def fix_rain_chunk(payloads):
+    '''
+    Recompute periodik rain of payloads from tick x Logger.tipp_fac in one
+    UPDATE, insert periodik the payloads lack. Return (updated, inserted, errors).
+    '''
+    ticks = {}
+    for raw in payloads:
+        try:
+            key = (get_sn(raw), datetime.datetime.fromtimestamp(raw.get('sampling')))
+        except Exception:
+            continue
+        ticks[key] = raw
+    db.session.execute(FIX_RAIN_TABLE)
+    db.session.execute("DELETE FROM fix_rain_tick")
+    if ticks:
+        db.session.execute(FIX_RAIN_INSERT, [{'sn': sn, 'sampling': sampling, 'tick': raw.get('tick')}
+                                             for (sn, sampling), raw in ticks.items()])
+    dialect = db.session.get_bind().dialect.name
+    updated = db.session.execute(FIX_RAIN_UPDATE.get(dialect, FIX_RAIN_UPDATE['sqlite'])).rowcount
+    missing = [ticks[(sn, sampling)] for sn, sampling in db.session.execute(FIX_RAIN_MISSING)
+               if (sn, sampling) in ticks]
+    db.session.execute("DELETE FROM fix_rain_tick")
+    db.session.commit()
+    result = record_batch(missing, is_new=False) if missing else {'recorded': 0, 'errors': []}
+    return updated, result['recorded'], result['errors']
+
+
 @app.cli.command()
-@click.option('-s', '--sampling', default='', help='Awal waktu sampling')
-def fix_rain(sampling):
+@click.option('-s', '--sampling', default='', help='Tanggal awal (YYYY-MM-DD)')
+@click.option('-e', '--end', 'end_date', default='', help='Tanggal akhir (YYYY-MM-DD)')
+def fix_rain(sampling, end_date):
+    ''' Recompute periodik rain from raw tick, insert missing periodik '''
+    setup_logging()
     if not sampling:
         today = datetime.datetime.today()
         tdy_str = today.strftime("%Y-%m-%d")
         start = datetime.datetime.strptime(f"{tdy_str} 00:00:00", "%Y-%m-%d %H:%M:%S")
     else:
         start = datetime.datetime.strptime(f"{sampling} 00:00:00", "%Y-%m-%d %H:%M:%S")
-    end = start + datetime.timedelta(days=1)
-    all_raw = Raw.query.filter(Raw.received.between(start, end)).order_by(Raw.received).all()
-    # print(f"{ins_per.content.get('sampling')} - {ins_per.content.get('device')} : {ins_per.content.get('tick')}")
-    count = 1
-    for ins_per in all_raw:
-        try:
-            sampling = datetime.datetime.fromtimestamp(ins_per.content.get('sampling'))
-            sn = ins_per.content.get('device').split('/')[1]
-            logger = Logger.query.filter_by(sn=sn).first()
-            period = Periodik.query.filter_by(
-                            sampling=sampling,
-                            logger_sn=logger.sn).first()
-            if period:
-                new_rain = round(ins_per.content.get('tick') * (logger.tipp_fac or 0.2), 2) if ins_per.content.get('tick') else None
-                period.rain = new_rain
-                db.session.commit()
-                print(f"(UPDATE {count} {sampling}) {logger.sn} : {new_rain}")
-            else:
-                recordperiodic(ins_per.content)
-                print(f"(INSERT {count} {sampling}) {logger.sn} : {ins_per.content.get('tick')}")
-            count += 1
-        except Exception as e:
-            print(f"Error : {e}")
+    end = datetime.datetime.strptime(f"{end_date} 00:00:00", "%Y-%m-%d %H:%M:%S") if end_date else start
+    end = end + datetime.timedelta(days=1)
+
+    started = perf_counter()
+    total, updated, inserted = 0, 0, 0
+    chunk = []
+    all_raw = iter_raw(start, end)
+    while True:
+        ins_per = next(all_raw, None)
+        if ins_per:
+            chunk.append(ins_per.content)
+        if chunk and (not ins_per or len(chunk) >= FIX_RAIN_CHUNK):
+            n_updated, n_inserted, errors = fix_rain_chunk(chunk)
+            total += len(chunk)
+            updated += n_updated
+            inserted += n_inserted
+            for sn, error in errors:
+                print(f"Error ({sn}) : {error}")
+            elapsed = perf_counter() - started
+            print(f"{total} raw : {updated} updated, {inserted} inserted, {total / elapsed:.0f} raw/s")
+            chunk = []
+        if not ins_per:
+            break
+    # rain updated in place, recount the rollups of the affected days
+    rebuild_rollup((start - datetime.timedelta(days=1)).date(), end.date())
+
+
+def prinus_session(workers=FETCH_WORKERS):
+    ''' keep-alive session to the prinus API, one pooled connection per worker '''
+    import requests
+    import requests.adapters
+
+    session = requests.Session()
+    session.auth = bws_sul2
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch_payloads(session, sn, sampling=''):
+    ''' return list of periodic payloads of logger sn from the prinus API '''
+    sampling_param = ''
+    if sampling:
+        sampling_param = '&sampling=' + sampling
+    res = session.get(URL + '/' + sn + '?robot=1' + sampling_param, timeout=FETCH_TIMEOUT)
+    res.raise_for_status()
+    return res.json()
+
+
+def backfill(sns, sampling='', workers=FETCH_WORKERS):
+    '''
+    Fetch periodic data of every logger in sns with a pool of `workers`
+    threads sharing one session, recording each response with record_batch
+    as soon as it arrives. Return {sn: record_batch result or error message}.
+    '''
+    summary = {}
+    session = prinus_session(workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = dict((pool.submit(fetch_payloads, session, sn, sampling), sn) for sn in sns)
+        for future in as_completed(futures):
+            sn = futures[future]
+            try:
+                summary[sn] = record_batch(future.result())
+            except Exception as e:
+                db.session.rollback()
+                summary[sn] = str(e)
+    session.close()
+    return summary
+
+
+def print_backfill(sn, result):
+    if isinstance(result, str):
+        print(f"!!Fetch Periodic ({sn}) ERROR : {result}")
+        logging.debug(f"!!Fetch Periodic ({sn}) ERROR : {result}")
+        return
+    print(f"Logger {sn} : {result['recorded']} recorded, {result['duplicate']} already exist")
+    for sn_err, error in result['errors']:
+        print(f"ERROR ({sn_err}) : {error}")
 
 
 @app.cli.command()
 @click.argument('sn')
 @click.option('-s', '--sampling', default='', help='Awal waktu sampling')
 def fetch_periodic(sn, sampling):
-    sampling_param = ''
-    if sampling:
-        sampling_param = '&sampling=' + sampling
-    res = requests.get(URL + '/' + sn + '?robot=1' + sampling_param, auth=bws_sul2)
-    data = json.loads(res.text)
-    for d in data:
-        # content = Raw(content=d)
-        # db.session.add(content)
-        try:
-            # db.session.commit()
-            result = recordperiodic(d)
-            print(result)
-        except Exception as e:
-            db.session.rollback()
-            print("ERROR:", e)
-        # print(d.get('sampling'), d.get('temperature'))
+    setup_logging()
+    result = backfill([sn], sampling, workers=1)
+    print_backfill(sn, result[sn])
 
 
 @app.cli.command()
 @click.option('-s', '--sampling', default='', help='Awal waktu sampling')
-def fetch_periodic_today(sampling):
-    devices = Logger.query.all()
+@click.option('-w', '--workers', default=FETCH_WORKERS, help='Jumlah koneksi bersamaan')
+def fetch_periodic_today(sampling, workers):
+    setup_logging()
+    sns = [sn for sn, in db.session.query(Logger.sn)]
     today = datetime.datetime.today()
     if not sampling:
         sampling = today.strftime("%Y/%m/%d")
-    for d in devices:
-        try:
-            print(f"Fetch Periodic for {d.sn}")
-            logging.debug(f"Fetch Periodic for {d.sn}")
-            os.system(f"flask fetch-periodic {d.sn} -s {sampling}")
-        except Exception as e:
-            print(f"!!Fetch Periodic ({d.sn}) ERROR : {e}")
-            logging.debug(f"!!Fetch Periodic ({d.sn}) ERROR : {e}")
+    logging.debug(f"Fetch Periodic for {len(sns)} logger, sampling {sampling}")
+    summary = backfill(sns, sampling, workers=workers)
+    failed = []
+    for sn in sns:
+        print_backfill(sn, summary[sn])
+        if isinstance(summary[sn], str):
+            failed.append(sn)
+    recorded = sum(r['recorded'] for r in summary.values() if not isinstance(r, str))
+    print(f"Fetch Periodic : {len(sns) - len(failed)} logger ok, {len(failed)} failed, {recorded} recorded")
+    logging.debug(f"Fetch Periodic : {len(sns) - len(failed)} logger ok, failed {failed}, {recorded} recorded")
 
 
 def recordperiodic(raw, is_new=True):
-    sn = str(raw.get('device').split('/')[1])
+    sn = get_sn(raw)
     try:
         db.session.rollback()
         db.session.flush()
-        logger = Logger.query.filter_by(sn=sn).first()
+        with metrics.timer('logger_lookup'):
+            logger = registry.get(sn)
         if logger:
             if logger.tenant_id:
-                # check if sampling exist
-                sampling = datetime.datetime.fromtimestamp(raw.get('sampling'))
-                up_since = datetime.datetime.fromtimestamp(raw.get('up_since'))
-                check_periodik = Periodik.query.filter_by(sampling=sampling, logger_sn=logger.sn).first()
-                if check_periodik:
-                    return f"Logger {logger.sn}, Exception : Periodik with sampling {sampling} already exist"
-
-                # insert data
+                # insert data, skipped by the (logger_sn, sampling) constraint if exist
                 try:
-                    new_periodik = Periodik(
-                        logger_sn=sn,
-                        location_id=logger.location_id or None,
-                        tenant_id=logger.tenant_id,
-                        mdpl=raw.get('altitude') or None,
-                        apre=raw.get('pressure') or None,
-                        sq=raw.get('signal_quality') or None,
-                        temp=(raw.get('temperature') + logger.temp_cor) if raw.get('temperature') and logger.temp_cor else raw.get('temperature'),
-                        humi=(raw.get('humidity') + logger.humi_cor) if raw.get('humidity') and logger.humi_cor else raw.get('humidity'),
-                        batt=(raw.get('battery') + logger.batt_cor) if raw.get('battery') and logger.batt_cor else raw.get('battery'),
-                        rain=(raw.get('tick') * (logger.tipp_fac or 0.2)) if raw.get('tick') else None,
-                        wlev=((logger.ting_son or 100) - (raw.get('distance') * 0.1)) if raw.get('distance') else None,
-                        sampling=datetime.datetime.fromtimestamp(raw.get('sampling')),
-                        up_s=datetime.datetime.fromtimestamp(raw.get('up_since')),
-                        ts_a=datetime.datetime.fromtimestamp(raw.get('time_set_at')),
-                    )
+                    row = periodik_row(raw, logger)
+                    sampling = row['sampling']
+                    with metrics.timer('duplicate_check'):
+                        inserted = insert_ignore(Periodik.__table__, [row], keys=('logger_sn', 'sampling'))
+                    if not inserted:
+                        db.session.rollback()
+                        metrics.inc('duplicate')
+                        return f"Logger {logger.sn}, Exception : Periodik with sampling {sampling} already exist"
                     if is_new:
-                        content = Raw(content=raw)
-                        db.session.add(content)
+                        insert_ignore(Raw.__table__, [raw_row(raw, row['received'])])
+                    after_record([row])
 
-                    db.session.add(new_periodik)
-                    # db.session.flush()
-                    db.session.commit()
+                    with metrics.timer('commit'):
+                        db.session.commit()
+                    metrics.inc('recorded')
+                    notify_listeners([row])
                     return f"Logger {logger.sn} data recorded, sampling {sampling}"  # on {logger.location.nama}
                 except Exception as e:
                     db.session.rollback()
@@ -515,12 +785,14 @@ def recordperiodic(raw, is_new=True):
 
 def raw2periodic(raw):
     '''Menyalin data dari Raw ke Periodik'''
-    sn = raw.get('device').split('/')[1]
-    session = db.session
-    session.rollback()
-    device = session.query(Device).filter_by(sn=sn).first()
-    obj = {'device_sn': device.sn, 'lokasi_id': device.lokasi.id if
-           device.lokasi else None}
+    sn = get_sn(raw)
+    db.session.rollback()
+    device = registry.get(sn)
+    if not device:
+        print(f"({sn}), Logger data not found in database.")
+        return
+    obj = {'logger_sn': device.sn, 'location_id': device.location_id,
+           'tenant_id': device.tenant_id}
     if raw.get('tick'):
         rain = (device.tipp_fac or 0.2) * raw.get('tick')
         obj.update({'rain': rain})
@@ -550,17 +822,14 @@ def raw2periodic(raw):
     try:
         d = Periodik(**obj)
         db.session.add(d)
-        device.update_latest()
-        if device.lokasi:
-            device.lokasi.update_latest()
         db.session.commit()
     except IntegrityError:
-        print(obj.get('device_sn'), obj.get('lokasi_id'), obj.get('sampling'))
+        print(obj.get('logger_sn'), obj.get('location_id'), obj.get('sampling'))
         db.session.rollback()
 
 
 def test_daily(time):
-    bot = Bot(token=app.config['PRINUSBOT_TOKEN'])
+    outbox = TelegramQueue()
 
     tenants = Tenant.query.order_by(Tenant.id).all()
 
@@ -570,43 +839,30 @@ def test_daily(time):
         # log.tenant.timezone
         tz = ten.timezone or "Asia/Jakarta"  # "Asia/Jakarta"
         localtime = utc2local(time, tz=tz)
-        end = datetime.datetime.strptime(f"{localtime.year}-{localtime.month}-{time.day - 1} 23:56:00", "%Y-%m-%d %H:%M:%S")
-        start = datetime.datetime.strptime(f"{localtime.year}-{localtime.month}-{time.day - 1} 00:00:00", "%Y-%m-%d %H:%M:%S")
-
-        final = '''*%(ten)s*\n*Kehadiran Data*\n%(tgl)s (0:0 - 23:55)
-        ''' % {'ten': ten.nama, 'tgl': start.strftime('%d %b %Y')}
-        message = ""
+        start, end = yesterday(localtime)
 
-        locations = Location.query.filter(
-                                    Location.tenant_id == ten.id).all()
-
-        i = 0
-        for pos in locations:
-            print(f"--- Location {pos.nama}")
-            i += 1
-            result = get_periodic_arrival(pos, start, end)
-            message += f"\n{i} {pos.nama} ({result['tipe']}) : {result['percent']}%"
+        final, message = count_report(ten, start, end)
 
         if message:
-            final += message
-
-            send_telegram(bot, app.config['TELEGRAM_TEST_ID'], "Test", final, f"Testing Only")
+            send_telegram(outbox, app.config['TELEGRAM_TEST_ID'], "Test", final, f"Testing Only")
             print(f"{localtime} : {final}")
             print()
+    outbox.close()
 
 
 def test_hourly(time):
-    bot = Bot(token=app.config['PRINUSBOT_TOKEN'])
+    outbox = TelegramQueue()
     tenants = Tenant.query.order_by(Tenant.id).all()
 
     for ten in tenants:
         final_ch, message_ch = ch_report(ten, time)
         if message_ch:
-            send_telegram(bot, app.config['TELEGRAM_TEST_ID'], "Hourly Test", final_ch, f"Hourly Test")
+            send_telegram(outbox, app.config['TELEGRAM_TEST_ID'], "Hourly Test", final_ch, f"Hourly Test")
 
         final_tma, message_tma = tma_report(ten, time)
         if message_tma:
-            send_telegram(bot, app.config['TELEGRAM_TEST_ID'], "Hourly Test", final_tma, f"Hourly Test")
+            send_telegram(outbox, app.config['TELEGRAM_TEST_ID'], "Hourly Test", final_tma, f"Hourly Test")
+    outbox.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,236 @@
+import functools
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+from apps import app
+from apps.metrics import metrics
+
+MESSAGE_LIMIT = 4096  # karakter per pesan Telegram
+WORKERS = 4
+PER_SECOND = 25  # pesan per detik, semua chat
+PER_CHAT = 3  # detik antar pesan ke chat yang sama (grup: 20 pesan / menit)
+RETRIES = 3
+BACKOFF = 2  # detik, dikali 2 tiap ulangan
+KEEP_RECENT = 100  # Delivery yang disimpan antrian yang hidup selama proses (alert listener)
+
+Delivery = namedtuple('Delivery', ['chat_id', 'name', 'ok', 'error'])
+
+
+class DeliveryError(Exception):
+    ''' permanent failure, the message is dropped without retry '''
+
+
+class BotTransport:
+    ''' send through the Telegram Bot API '''
+
+    def __init__(self, token):
+        from telegram import Bot
+        from telegram.error import BadRequest, Unauthorized
+
+        self.bot = Bot(token=token)
+        self.permanent = (BadRequest, Unauthorized)
+
+    def send(self, chat_id, text, parse_mode=None):
+        try:
+            self.bot.sendMessage(chat_id, text=text, parse_mode=parse_mode)
+        except self.permanent as e:
+            raise DeliveryError(str(e))
+
+
+class MemoryTransport:
+    ''' keep sent messages in `sent`, for running reports without network '''
+
+    def __init__(self, fail=()):
+        self.sent = []
+        self.fail = set(fail)
+        self.lock = threading.Lock()
+
+    def send(self, chat_id, text, parse_mode=None):
+        if chat_id in self.fail:
+            raise DeliveryError(f"Chat {chat_id} unavailable")
+        with self.lock:
+            self.sent.append((chat_id, text, parse_mode))
+
+
+class LogTransport(MemoryTransport):
+    ''' write messages to the log instead of Telegram '''
+
+    def send(self, chat_id, text, parse_mode=None):
+        super().send(chat_id, text, parse_mode)
+        logging.debug(f"Telegram ({chat_id}) :\n{text}")
+
+
+@functools.lru_cache(maxsize=None)
+def bot_transport(token):
+    ''' one BotTransport (and its HTTP connections) per token for the whole process '''
+    return BotTransport(token)
+
+
+TRANSPORTS = {
+    'bot': lambda: bot_transport(app.config['PRINUSBOT_TOKEN']),
+    'memory': MemoryTransport,
+    'log': LogTransport,
+}
+
+
+def split_message(text, limit=MESSAGE_LIMIT):
+    ''' split text into parts of at most `limit` characters, on line breaks where possible '''
+    parts = []
+    part = ''
+    for line in text.splitlines(keepends=True):
+        while len(line) > limit:
+            if part:
+                parts.append(part)
+                part = ''
+            parts.append(line[:limit])
+            line = line[limit:]
+        if len(part) + len(line) > limit:
+            parts.append(part)
+            part = ''
+        part += line
+    if part or not parts:
+        parts.append(part)
+    return parts
+
+
+class TelegramQueue:
+    '''
+    Deliver messages in the background. Messages to one chat are sent in
+    order, `per_chat` seconds apart, while different chats are served
+    concurrently by `workers` threads under a global `per_second` limit.
+    A failed send is retried `retries` times with exponential backoff.
+    A chat waiting for its next turn or a retry is only a due time in
+    `ready`, it never holds a worker, so dead or slow chats do not delay
+    the others. `keep` bounds the Delivery results kept (most recent), for
+    a queue that lives as long as its process; None keeps all of them for
+    a one-shot report send.
+    '''
+
+    def __init__(self, transport=None, workers=WORKERS, per_second=PER_SECOND,
+                 per_chat=PER_CHAT, retries=RETRIES, backoff=BACKOFF, keep=None):
+        self.transport = transport or TRANSPORTS[app.config.get('TELEGRAM_TRANSPORT') or 'bot']()
+        self.workers = workers
+        self.per_second = per_second
+        self.per_chat = per_chat
+        self.retries = retries
+        self.backoff = backoff
+        self.cond = threading.Condition()
+        self.chats = {}  # chat_id: deque of (text, parse_mode, name, attempt)
+        self.ready = []  # heap (due, seq, chat_id), satu entri per chat yang antriannya belum habis
+        self.seq = itertools.count()
+        self.last_sent = {}  # chat_id: monotonic
+        self.next_send = 0
+        self.results = deque(maxlen=keep)
+        self.sent = 0
+        self.failed = 0
+        self.threads = []
+        self.closing = False
+
+    def send(self, chat_id, text, parse_mode=None, name=None):
+        ''' queue text for chat_id, split to the message size limit '''
+        if not chat_id:
+            logging.debug(f"Sending Telegram to {name} Error : chat id not set")
+            with self.cond:
+                self.record(Delivery(chat_id, name, False, "chat id not set"))
+            return
+        with self.cond:
+            queue = self.chats.get(chat_id)
+            if queue is None:
+                queue = self.chats[chat_id] = deque()
+                self.schedule(chat_id, self.last_sent.get(chat_id, 0) + self.per_chat)
+            for part in split_message(text):
+                queue.append((part, parse_mode, name, 0))
+            if not self.threads:
+                self.threads = [threading.Thread(target=self.run, name=f"telegram-{i}", daemon=True)
+                                for i in range(self.workers)]
+                for thread in self.threads:
+                    thread.start()
+
+    def schedule(self, chat_id, due):
+        ''' make chat_id due at `due` (monotonic), self.cond held '''
+        heapq.heappush(self.ready, (due, next(self.seq), chat_id))
+        self.cond.notify()
+
+    def take(self):
+        ''' wait for the next due chat, return (chat_id, message) or None when closed and empty '''
+        with self.cond:
+            while not (self.ready and self.ready[0][0] <= time.monotonic()):
+                if self.closing and not self.chats:
+                    return None
+                self.cond.wait(self.ready[0][0] - time.monotonic() if self.ready else None)
+            due, seq, chat_id = heapq.heappop(self.ready)
+            return chat_id, self.chats[chat_id].popleft()
+
+    def run(self):
+        while True:
+            taken = self.take()
+            if not taken:
+                return
+            chat_id, (text, parse_mode, name, attempt) = taken
+            delivery, retry_in = self.deliver(chat_id, text, parse_mode, name, attempt)
+            with self.cond:
+                queue = self.chats[chat_id]
+                now = time.monotonic()
+                if retry_in is not None:
+                    queue.appendleft((text, parse_mode, name, attempt + 1))
+                    self.schedule(chat_id, now + retry_in)
+                    continue
+                self.record(delivery)
+                self.last_sent[chat_id] = now
+                if queue:
+                    self.schedule(chat_id, now + self.per_chat)
+                else:
+                    del self.chats[chat_id]
+                    self.cond.notify_all()
+
+    def record(self, delivery):
+        ''' self.cond held '''
+        self.results.append(delivery)
+        if delivery.ok:
+            self.sent += 1
+        else:
+            self.failed += 1
+
+    def deliver(self, chat_id, text, parse_mode, name, attempt=0):
+        ''' one attempt, return (Delivery, None) or (None, seconds until the retry) '''
+        debug_text = f"Sending Telegram to {name or chat_id}"
+        self.wait_global()
+        try:
+            with metrics.timer('telegram_send'):
+                self.transport.send(chat_id, text, parse_mode)
+            logging.debug(debug_text)
+            metrics.inc('telegram_sent')
+            return Delivery(chat_id, name, True, None), None
+        except DeliveryError as e:
+            logging.debug(f"{debug_text} Error : {e}")
+            metrics.inc('telegram_failed')
+            return Delivery(chat_id, name, False, str(e)), None
+        except Exception as e:
+            if attempt < self.retries:
+                delay = getattr(e, 'retry_after', None) or self.backoff * 2 ** attempt
+                logging.debug(f"{debug_text} Error : {e}, retry in {delay} s")
+                return None, delay
+            logging.debug(f"{debug_text} Error : {e}")
+            metrics.inc('telegram_failed')
+            return Delivery(chat_id, name, False, str(e)), None
+
+    def wait_global(self):
+        with self.cond:
+            now = time.monotonic()
+            at = max(now, self.next_send)
+            self.next_send = at + 1 / self.per_second
+        time.sleep(max(0, at - now))
+
+    def close(self):
+        ''' wait until every queued message is delivered or dropped, return the Delivery list (kept ones) '''
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+        logging.debug(f"Telegram : {self.sent} sent, {self.failed} failed")
+        return list(self.results)
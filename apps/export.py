@@ -0,0 +1,181 @@
+import click
+import csv
+import datetime
+import io
+import json
+import sys
+
+from flask import Response, request, stream_with_context
+from sqlalchemy import and_, or_, select
+
+from apps import app, db
+from apps.models import Periodik, Tenant, Users
+
+EXPORT_PAGE = 5000  # baris per query, tiap halaman transaksi sendiri
+FETCH_SIZE = 1000  # baris per fetch dari server-side cursor
+COLUMNS = ('id', 'sampling', 'logger_sn', 'location_id', 'tenant_id', 'rain', 'wlev', 'batt',
+           'temp', 'humi', 'apre', 'mdpl', 'sq', 'up_s', 'ts_a', 'received')
+
+
+def iter_periodik(start, end, tenant_id=None, location_id=None, logger_sn=None, after=None, page=EXPORT_PAGE):
+    '''
+    Yield Periodik rows (tuples of COLUMNS) with start <= sampling < end
+    ordered by (sampling, id). Keyset pagination: every page is one short
+    query `(sampling, id) > last row ... LIMIT page` on its own connection
+    read through a server-side cursor, so memory stays at one fetch and no
+    transaction or lock is held between pages. `after` = (sampling, id)
+    resumes after that row.
+    '''
+    table = Periodik.__table__
+    query = select([table.c[c] for c in COLUMNS]).where(and_(
+                        table.c.sampling >= start, table.c.sampling < end))
+    if tenant_id:
+        query = query.where(table.c.tenant_id == tenant_id)
+    if location_id:
+        query = query.where(table.c.location_id == location_id)
+    if logger_sn:
+        query = query.where(table.c.logger_sn == logger_sn)
+    query = query.order_by(table.c.sampling, table.c.id).limit(page)
+    while True:
+        paged = query
+        if after:
+            paged = query.where(or_(table.c.sampling > after[0],
+                                    and_(table.c.sampling == after[0], table.c.id > after[1])))
+        count = 0
+        with db.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(paged)
+            while True:
+                rows = result.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    yield tuple(row)
+                count += len(rows)
+                after = (rows[-1][1], rows[-1][0])
+        if count < page:
+            return
+
+
+def value(v):
+    return v.isoformat() if isinstance(v, datetime.datetime) else v
+
+
+def as_ndjson(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(COLUMNS, (value(v) for v in row)))) + '\n'
+
+
+def as_csv(rows, chunk=FETCH_SIZE):
+    ''' CSV text with header, written chunk rows at a time '''
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(COLUMNS)
+    n = 0
+    for row in rows:
+        writer.writerow([value(v) for v in row])
+        n += 1
+        if n % chunk == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+FORMATS = {'csv': (as_csv, 'text/csv'), 'ndjson': (as_ndjson, 'application/x-ndjson')}
+
+
+def parse_time(text, default=None):
+    ''' YYYY-MM-DD or ISO datetime '''
+    if not text:
+        return default
+    if len(text) == 10:
+        return datetime.datetime.strptime(text, "%Y-%m-%d")
+    return datetime.datetime.strptime(text[:19], "%Y-%m-%dT%H:%M:%S")
+
+
+def parse_after(text):
+    ''' "<sampling ISO>,<id>" of the last row received, to resume an export '''
+    if not text:
+        return None
+    sampling, id = text.rsplit(',', 1)
+    return parse_time(sampling), int(id)
+
+
+def export_range(start, end):
+    ''' (start, end) datetimes, end defaults to start + 1 day '''
+    start = parse_time(start)
+    end = parse_time(end, start and start + datetime.timedelta(days=1))
+    return start, end
+
+
+def authorized():
+    ''' Users of the request's basic auth, None if missing or wrong '''
+    auth = request.authorization
+    if not auth:
+        return None
+    user = Users.query.filter_by(username=auth.username).first()
+    if user and user.check_password(auth.password):
+        return user
+    return None
+
+
+@app.route('/api/periodik')
+def periodik_export():
+    '''
+    Stream periodik as CSV (default) or NDJSON, HTTP basic auth with a
+    Users account. Query: start, end (YYYY-MM-DD or ISO, end exclusive),
+    tenant (slug), location (id), logger (sn), format, after. A user bound
+    to a tenant only gets that tenant's rows.
+    '''
+    user = authorized()
+    if not user:
+        return Response('Login required\n', 401, {'WWW-Authenticate': 'Basic realm="prinus"'})
+    args = request.args
+    try:
+        start, end = export_range(args.get('start'), args.get('end'))
+        after = parse_after(args.get('after'))
+    except ValueError as e:
+        return Response(f"Invalid parameter : {e}\n", 400)
+    if not start:
+        return Response("Parameter start required\n", 400)
+    tenant_id = user.tenant_id
+    if args.get('tenant'):
+        ten = Tenant.query.filter_by(slug=args['tenant']).first()
+        if not ten:
+            return Response("Tenant not found\n", 404)
+        tenant_id = ten.id
+    if not user.can_view(tenant_id):
+        return Response("Forbidden\n", 403)
+    formatter, mimetype = FORMATS.get(args.get('format', 'csv'), FORMATS['csv'])
+    rows = iter_periodik(start, end, tenant_id=tenant_id, location_id=args.get('location', type=int),
+                         logger_sn=args.get('logger'), after=after)
+    db.session.remove()  # koneksi request dilepas, streaming memakai koneksi sendiri
+    return Response(stream_with_context(formatter(rows)), mimetype=mimetype)
+
+
+@app.cli.command()
+@click.option('-s', '--start', required=True, help='Awal sampling (YYYY-MM-DD)')
+@click.option('-e', '--end', default='', help='Akhir sampling, eksklusif (YYYY-MM-DD), default start + 1 hari')
+@click.option('-t', '--tenant', default='', help='Slug tenant')
+@click.option('-l', '--location', default=0, help='ID lokasi')
+@click.option('-g', '--logger', 'sn', default='', help='SN logger')
+@click.option('-f', '--format', 'fmt', default='csv', type=click.Choice(list(FORMATS)), help='csv / ndjson')
+@click.option('-o', '--output', default='', help='File hasil, default stdout')
+def export(start, end, tenant, location, sn, fmt, output):
+    ''' Stream periodik rows of a time range as CSV or NDJSON '''
+    start, end = export_range(start, end)
+    tenant_id = None
+    if tenant:
+        ten = Tenant.query.filter_by(slug=tenant).first()
+        if not ten:
+            print(f"Tenant {tenant} not found", file=sys.stderr)
+            return
+        tenant_id = ten.id
+    rows = iter_periodik(start, end, tenant_id=tenant_id, location_id=location or None, logger_sn=sn or None)
+    out = open(output, 'w', newline='') if output else sys.stdout
+    try:
+        for text in FORMATS[fmt][0](rows):
+            out.write(text)
+    finally:
+        if output:
+            out.close()
@@ -0,0 +1,205 @@
+import click
+import datetime
+import logging
+import math
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse, parse_qs
+
+from apps import app, db
+from apps.models import Logger, FetchCursor
+from apps.arrival import SLOT, SLOTS, arrival_matrix, missing_intervals
+from apps.rollup import DAY
+from apps.ingest import record_batch
+from apps.command import FETCH_WORKERS, prinus_session, fetch_payloads, setup_logging
+
+SAMPLING_FORMAT = "%Y/%m/%d"  # parameter sampling API prinus, awal data yang dikirim
+FETCH_LAG = datetime.timedelta(minutes=15)  # slot lebih baru dari ini mungkin masih datang lewat MQTT
+MERGE_SLOTS = 6  # celah yang berjarak kurang dari ini diambil sekaligus
+
+Request = namedtuple('Request', ['sn', 'sampling', 'ranges'])
+
+
+def merge_ranges(ranges, slack=MERGE_SLOTS * SLOT):
+    ''' merge sorted (from, to] ranges whose distance is at most slack '''
+    merged = []
+    for a, b in ranges:
+        if merged and a - merged[-1][1] <= slack:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], b))
+        else:
+            merged.append((a, b))
+    return merged
+
+
+def plan_requests(sns, start, days, now, cursors, lag=FETCH_LAG):
+    '''
+    Return ([Request], number of complete loggers) for the slots of `days`
+    days from start that are empty, older than now - lag and newer than
+    the logger's cursor (what the API had last time is not asked again).
+    Ranges are merged, then grouped per API call (SAMPLING_FORMAT of their
+    start), so a logger with gaps in one day costs one call.
+    '''
+    horizon = min(days * SLOTS, int((now - lag - start) / SLOT))
+    if horizon <= 0:
+        return [], len(sns)
+    keys, matrix = arrival_matrix(start, days, by='logger', keys=sns)
+    flat = matrix.reshape(len(keys), -1)
+    planned, complete = [], 0
+    for i, sn in enumerate(keys):
+        first = 0
+        if cursors.get(sn):
+            first = min(horizon, max(0, math.ceil((cursors[sn] - start) / SLOT)))
+        ranges = merge_ranges(missing_intervals(flat[i, first:horizon], start + first * SLOT))
+        if not ranges:
+            complete += 1
+            continue
+        calls = {}
+        for a, b in ranges:
+            # API mengirim data per hari, range dipotong di pergantian hari
+            while a < b:
+                cut = min(b, datetime.datetime.combine(a.date(), datetime.time()) + DAY)
+                calls.setdefault(a.strftime(SAMPLING_FORMAT), []).append((a, cut))
+                a = cut
+        planned += [Request(sn, sampling, r) for sampling, r in calls.items()]
+    return planned, complete
+
+
+def in_ranges(raw, ranges):
+    sampling = datetime.datetime.fromtimestamp(raw.get('sampling') or 0)
+    return any(a < sampling <= b for a, b in ranges)
+
+
+def fetch_gaps(sns, start, days=1, workers=FETCH_WORKERS, session=None, now=None):
+    '''
+    Backfill only the empty slots of sns from the prinus API. Payloads
+    outside the requested ranges are dropped before record_batch, the
+    cursor of each logger moves to the newest sampling the API returned,
+    but not past the start of a request that failed, so it is asked again.
+    Return summary counts.
+    '''
+    now = now or datetime.datetime.now()
+    cursors = dict((c.logger_sn, c.fetched_until) for c in FetchCursor.query.filter(FetchCursor.logger_sn.in_(sns)))
+    planned, complete = plan_requests(sns, start, days, now, cursors)
+    summary = {'loggers': len(sns), 'complete': complete, 'calls': len(planned),
+               'downloaded': 0, 'recorded': 0, 'duplicate': 0, 'failed': []}
+    own_session = session is None
+    session = session or prinus_session(workers)
+    newest = {}
+    held = {}  # sn: awal range request yang gagal, cursor tidak boleh melewatinya
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = dict((pool.submit(fetch_payloads, session, r.sn, r.sampling), r) for r in planned)
+        for future in as_completed(futures):
+            req = futures[future]
+            try:
+                payloads = future.result()
+                summary['downloaded'] += len(payloads)
+                result = record_batch([raw for raw in payloads if in_ranges(raw, req.ranges)])
+                summary['recorded'] += result['recorded']
+                summary['duplicate'] += result['duplicate']
+                for sn, error in result['errors']:
+                    logging.debug(f"Fetch gaps ({sn}) : {error}")
+                if result.get('failed'):
+                    # sebagian tidak tersimpan (database), diambil lagi lain kali
+                    summary['failed'].append(req.sn)
+                    held[req.sn] = min(held.get(req.sn, req.ranges[0][0]), req.ranges[0][0])
+                samplings = [raw['sampling'] for raw in payloads if raw.get('sampling')]
+                if samplings:
+                    newest[req.sn] = max(newest.get(req.sn, 0), max(samplings))
+            except Exception as e:
+                db.session.rollback()
+                summary['failed'].append(req.sn)
+                held[req.sn] = min(held.get(req.sn, req.ranges[0][0]), req.ranges[0][0])
+                logging.debug(f"!!Fetch gaps ({req.sn}) ERROR : {e}")
+    if own_session:
+        session.close()
+
+    fetched_at = datetime.datetime.utcnow()
+    for sn, sampling in newest.items():
+        until = datetime.datetime.fromtimestamp(sampling)
+        if sn in held:
+            until = min(until, held[sn])
+        cursor = FetchCursor.query.get(sn) or FetchCursor(logger_sn=sn)
+        cursor.fetched_until = max(until, cursor.fetched_until or until)
+        cursor.fetched_at = fetched_at
+        db.session.add(cursor)
+    db.session.commit()
+    return summary
+
+
+class LocalResponse:
+
+    def __init__(self, payloads):
+        self.payloads = payloads
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payloads
+
+
+class LocalPrinus:
+    '''
+    Offline stand-in for the prinus API session: serves payloads it was
+    given for URL/<sn>?sampling=..., one day from `sampling` as the API
+    does, and counts calls and payloads served.
+    '''
+
+    def __init__(self, payloads):
+        self.payloads = {}
+        for raw in payloads:
+            sn = raw['device'].split('/')[1]
+            self.payloads.setdefault(sn, []).append(raw)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.served = 0
+
+    def get(self, url, timeout=None):
+        parsed = urlparse(url)
+        sn = parsed.path.rstrip('/').split('/')[-1]
+        sampling = parse_qs(parsed.query).get('sampling', [''])[0]
+        start = datetime.datetime.strptime(sampling, SAMPLING_FORMAT) if sampling \
+            else datetime.datetime.combine(datetime.date.today(), datetime.time())
+        day_end = datetime.datetime.combine(start.date(), datetime.time()) + datetime.timedelta(days=1)
+        result = [raw for raw in self.payloads.get(sn, [])
+                  if start <= datetime.datetime.fromtimestamp(raw['sampling']) < day_end]
+        with self.lock:
+            self.calls += 1
+            self.served += len(result)
+        return LocalResponse(result)
+
+    def close(self):
+        pass
+
+
+@app.cli.command('fetch-gaps')
+@click.option('-s', '--sampling', default='', help='Tanggal awal (YYYY-MM-DD), default hari ini')
+@click.option('-d', '--days', default=1, help='Jumlah hari')
+@click.option('-w', '--workers', default=FETCH_WORKERS, help='Jumlah koneksi bersamaan')
+@click.option('-o', '--offline', default='', help='File payload (JSON per baris / .npz) sebagai API lokal')
+def fetch_gaps_command(sampling, days, workers, offline):
+    ''' Fetch only the missing periodic data (arrival gaps) of every logger from the prinus API '''
+    setup_logging()
+    day = datetime.datetime.strptime(sampling, "%Y-%m-%d").date() if sampling else datetime.date.today()
+    start = datetime.datetime.combine(day, datetime.time())
+    session = None
+    if offline:
+        from apps.bench import safe_database
+        from apps.replay import read_payloads, ensure_loggers
+
+        if not safe_database():
+            print(f"Refusing to fetch offline into {db.engine.url!r}, use SQLite or a database named *bench* / *test*")
+            return
+        db.create_all()
+        payloads = read_payloads(offline)
+        ensure_loggers(payloads)
+        session = LocalPrinus(payloads)
+    sns = [sn for sn, in db.session.query(Logger.sn)]
+    summary = fetch_gaps(sns, start, days, workers=workers, session=session)
+    message = (f"Fetch gaps : {summary['loggers']} logger, {summary['complete']} complete, "
+               f"{summary['calls']} calls, {summary['downloaded']} downloaded, "
+               f"{summary['recorded']} recorded, {summary['duplicate']} already exist, "
+               f"failed {summary['failed']}")
+    print(message)
+    logging.debug(message)
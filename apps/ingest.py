@@ -0,0 +1,346 @@
+import datetime
+import hashlib
+import json
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+import zlib
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import InterfaceError, OperationalError
+
+from apps import app, db
+from apps.models import Raw, Periodik
+from apps.registry import loggers as registry
+from apps.latest import update_latest
+from apps.rollup import update_rollup
+from apps.metrics import metrics
+
+BATCH_SIZE = 200
+BATCH_AGE = 5  # detik
+INSERT_CHUNK = 1000
+DATABASE_ERRORS = (OperationalError, InterfaceError)  # koneksi / server, bukan kesalahan data
+
+listeners = []  # fungsi(rows) dipanggil setelah commit untuk tiap Periodik baru, mis. AlertEngine
+
+
+def get_sn(raw):
+    ''' return logger sn from payload 'device' ("<tenant>/<sn>/...") '''
+    return str(raw.get('device').split('/')[1])
+
+
+def raw_fingerprint(raw):
+    ''' md5 of "device|sampling", of the whole payload if either is missing '''
+    if raw.get('device') and raw.get('sampling') is not None:
+        key = f"{raw['device']}|{raw['sampling']}"
+    else:
+        key = json.dumps(raw, sort_keys=True)
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def raw_row(raw, received):
+    ''' return Raw columns (dict) of payload raw '''
+    return {'content': raw, 'fingerprint': raw_fingerprint(raw), 'received': received}
+
+
+def periodik_row(raw, logger):
+    ''' return Periodik columns (dict) from raw payload and logger correction '''
+    return {
+        'logger_sn': logger.sn,
+        'location_id': logger.location_id or None,
+        'tenant_id': logger.tenant_id,
+        'mdpl': raw.get('altitude') or None,
+        'apre': raw.get('pressure') or None,
+        'sq': raw.get('signal_quality') or None,
+        'temp': (raw.get('temperature') + logger.temp_cor) if raw.get('temperature') and logger.temp_cor else raw.get('temperature'),
+        'humi': (raw.get('humidity') + logger.humi_cor) if raw.get('humidity') and logger.humi_cor else raw.get('humidity'),
+        'batt': (raw.get('battery') + logger.batt_cor) if raw.get('battery') and logger.batt_cor else raw.get('battery'),
+        'rain': (raw.get('tick') * (logger.tipp_fac or 0.2)) if raw.get('tick') else None,
+        'wlev': ((logger.ting_son or 100) - (raw.get('distance') * 0.1)) if raw.get('distance') else None,
+        'sampling': datetime.datetime.fromtimestamp(raw.get('sampling')),
+        'up_s': datetime.datetime.fromtimestamp(raw.get('up_since')),
+        'ts_a': datetime.datetime.fromtimestamp(raw.get('time_set_at')),
+        'received': datetime.datetime.utcnow(),
+    }
+
+
+def record_batch(raws, is_new=True):
+    '''
+    Write a batch of payloads as Raw and Periodik rows in one transaction.
+
+    Return {'recorded': int, 'duplicate': int, 'errors': [(sn, message)],
+    'failed': [index]}, a bad payload only lands in 'errors' and never
+    discards the batch. 'failed' are the indexes in raws not recorded
+    because of the database (connection, commit), they may be retried.
+    '''
+    result = {'recorded': 0, 'duplicate': 0, 'errors': [], 'failed': []}
+    if not raws:
+        return result
+
+    db.session.rollback()
+    parsed = []
+    for i, raw in enumerate(raws):
+        try:
+            parsed.append((i, get_sn(raw), raw))
+        except Exception as e:
+            result['errors'].append((None, f"Invalid payload : {e}"))
+
+    with metrics.timer('logger_lookup'):
+        loggers = registry.get_many(set(sn for i, sn, raw in parsed))
+
+    pending = []
+    for i, sn, raw in parsed:
+        logger = loggers.get(sn)
+        if not logger:
+            result['errors'].append((sn, "Logger data not found in database."))
+            continue
+        if not logger.tenant_id:
+            result['errors'].append((sn, "Logger 'tenant_id' not set."))
+            continue
+        try:
+            pending.append((i, raw, periodik_row(raw, logger)))
+        except Exception as e:
+            result['errors'].append((sn, f"Invalid payload : {e}"))
+
+    if not pending:
+        return result
+
+    try:
+        with metrics.timer('duplicate_check'):
+            recorded = insert_ignore(Periodik.__table__, [row for i, raw, row in pending],
+                                     keys=('logger_sn', 'sampling'))
+        if is_new:
+            content = dict(((row['logger_sn'], row['sampling']), raw) for i, raw, row in pending)
+            insert_ignore(Raw.__table__, [
+                raw_row(content[(row['logger_sn'], row['sampling'])], row['received'])
+                for row in recorded])
+        after_record(recorded)
+        with metrics.timer('commit'):
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logging.debug(f"Bulk insert failed ({e}), retrying {len(pending)} rows one by one")
+        record_rows(pending, result, is_new=is_new)
+        return result
+
+    result['recorded'] += len(recorded)
+    result['duplicate'] += len(pending) - len(recorded)
+    metrics.inc('recorded', len(recorded))
+    metrics.inc('duplicate', len(pending) - len(recorded))
+    notify_listeners(recorded)
+    return result
+
+
+def record_rows(rows, result, is_new=True):
+    ''' fallback for record_batch, isolate each row (index, raw, row) in its own savepoint '''
+    recorded = []
+    for i, raw, row in rows:
+        try:
+            with db.session.begin_nested():
+                if not insert_ignore(Periodik.__table__, [row], keys=('logger_sn', 'sampling')):
+                    result['duplicate'] += 1
+                    continue
+                if is_new:
+                    insert_ignore(Raw.__table__, [raw_row(raw, row['received'])])
+                after_record([row])
+            recorded.append((i, row))
+        except Exception as e:
+            result['errors'].append((row['logger_sn'], f"Exception (while trying to record data) : {e}"))
+            if isinstance(e, DATABASE_ERRORS):
+                result['failed'].append(i)
+    try:
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        result['errors'] += [(row['logger_sn'], f"Exception (while trying to commit) : {e}") for i, row in recorded]
+        result['failed'] = sorted(result['failed'] + [i for i, row in recorded])
+        return
+    result['recorded'] += len(recorded)
+    notify_listeners([row for i, row in recorded])
+
+
+def after_record(rows):
+    ''' update everything derived from Periodik with newly inserted rows (dict), inside the ingest transaction '''
+    update_latest(rows)
+    update_rollup(rows)
+
+
+def notify_listeners(rows):
+    ''' hand committed Periodik rows (dict) to the listeners, never before commit '''
+    if not rows:
+        return
+    for listener in listeners:
+        listener(rows)
+
+
+def insert_ignore(table, rows, keys=None):
+    '''
+    Insert rows into table, skipping rows that violate a unique constraint
+    (ON CONFLICT DO NOTHING on PostgreSQL, INSERT OR IGNORE on SQLite).
+    Return the list of rows actually inserted, `keys` are the columns used
+    to tell which rows were inserted.
+    '''
+    if keys:
+        unique = {}
+        for row in rows:
+            unique.setdefault(tuple(row[k] for k in keys), row)
+        rows = list(unique.values())
+    if not rows:
+        return []
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        if not keys:
+            db.session.execute(pg_insert(table).on_conflict_do_nothing(), rows)
+            return rows
+        inserted = set()
+        for i in range(0, len(rows), INSERT_CHUNK):
+            stmt = pg_insert(table).values(rows[i:i + INSERT_CHUNK]) \
+                .on_conflict_do_nothing() \
+                .returning(*[table.c[k] for k in keys])
+            inserted.update(tuple(r) for r in db.session.execute(stmt))
+        return [row for row in rows if tuple(row[k] for k in keys) in inserted]
+
+    stmt = table.insert()
+    if dialect == 'sqlite':
+        stmt = stmt.prefix_with('OR IGNORE')
+    return [row for row in rows if db.session.execute(stmt, row).rowcount]
+
+
+class IngestBuffer:
+    '''
+    Collect payloads and write them with record_batch, a batch is written
+    when it holds `size` payloads or its oldest payload is `age` seconds old.
+    '''
+
+    def __init__(self, size=BATCH_SIZE, age=BATCH_AGE):
+        self.size = size
+        self.age = age
+        self.items = []
+        self.first_at = None
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def add(self, raw):
+        with self.lock:
+            if not self.items:
+                self.first_at = time.monotonic()
+            self.items.append(raw)
+            full = len(self.items) >= self.size
+        if full:
+            self.flush()
+
+    def take(self):
+        with self.lock:
+            items, self.items = self.items, []
+            self.first_at = None
+        return items
+
+    def flush(self):
+        with self.flush_lock:
+            items = self.take()
+            if not items:
+                return None
+            result = record_batch(items)
+            logging.debug(f"Batch of {len(items)} : {result['recorded']} recorded, "
+                          f"{result['duplicate']} duplicate, {len(result['errors'])} error")
+            for sn, error in result['errors']:
+                logging.debug(f"({sn}), Exception : {error}")
+            return result
+
+    def expired(self):
+        with self.lock:
+            return self.first_at is not None and time.monotonic() - self.first_at >= self.age
+
+    def run(self):
+        with app.app_context():
+            while not self.stopped.wait(min(1, self.age)):
+                if self.expired():
+                    try:
+                        self.flush()
+                    except Exception as e:
+                        logging.debug(f"Batch flush Error : {e}")
+            self.flush()
+            db.session.remove()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='ingest-buffer', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+
+def ingest_worker(messages, batch_size, batch_age, on_start=None):
+    ''' IngestPool process, record payloads from messages until None '''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    db.engine.dispose()  # jangan pakai koneksi warisan proses induk
+    metrics.reset()  # salinan metrics proses induk, /stats menjumlahkan dump worker
+    name = f"worker-{multiprocessing.current_process().name}"
+    dumping = metrics.start_dump(name)
+    with app.app_context():
+        started = None
+        if on_start:
+            try:
+                started = on_start()
+            except Exception as e:
+                logging.debug(f"Ingest worker start Error : {e}")
+        buffer = IngestBuffer(size=batch_size or 1, age=batch_age).start()
+        while True:
+            raw = messages.get()
+            if raw is None:
+                break
+            try:
+                buffer.add(raw)
+            except Exception as e:
+                logging.debug(f"Ingest worker Error : {e}")
+        buffer.stop()
+        if getattr(started, 'outbox', None):
+            started.outbox.close()
+        db.session.remove()
+    dumping.set()
+    metrics.dump(name)
+
+
+class IngestPool:
+    '''
+    Spread payloads over `workers` processes, each with its own queue and
+    database connection. A logger sn always goes to the same worker so its
+    payloads are recorded in order; stop() lets every worker drain its queue.
+    '''
+
+    def __init__(self, workers, batch_size=0, batch_age=BATCH_AGE, on_start=None):
+        self.queues = [multiprocessing.Queue() for i in range(workers)]
+        self.processes = [
+            multiprocessing.Process(target=ingest_worker, name=f"ingest-{i}",
+                                    args=(q, batch_size, batch_age, on_start))
+            for i, q in enumerate(self.queues)]
+
+    def add(self, raw):
+        try:
+            key = get_sn(raw).encode('utf-8')
+        except Exception:
+            key = b''
+        self.queues[zlib.crc32(key) % len(self.queues)].put(raw)
+
+    def depth(self):
+        return sum(q.qsize() for q in self.queues)
+
+    def start(self):
+        db.engine.dispose()
+        for process in self.processes:
+            process.start()
+        return self
+
+    def stop(self):
+        for q in self.queues:
+            q.put(None)
+        for process in self.processes:
+            process.join()
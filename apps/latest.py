@@ -0,0 +1,76 @@
+from sqlalchemy import and_, bindparam, or_, select
+
+from apps import app, db
+from apps.models import Logger, Location, Periodik
+
+
+def latest_statement(table, key, column):
+    ''' UPDATE table SET latest_* WHERE key matches and sampling is newer '''
+    periodik = Periodik.__table__
+    latest_id = select([periodik.c.id]).where(and_(
+                        periodik.c.logger_sn == bindparam('b_sn'),
+                        periodik.c.sampling == bindparam('b_sampling'))).as_scalar()
+    return table.update().where(and_(
+                        table.c[key] == bindparam(column),
+                        or_(table.c.latest_sampling.is_(None),
+                            table.c.latest_sampling < bindparam('b_sampling')))).values(
+                        latest_sampling=bindparam('b_sampling'),
+                        latest_up=bindparam('b_received'),
+                        latest_id=latest_id)
+
+
+def update_latest(rows):
+    '''
+    Move Logger and Location latest_* to the newest of the recorded
+    Periodik rows, only if it is newer than what they already point to.
+    Run inside the ingest transaction.
+    '''
+    newest = {}
+    for row in rows:
+        if row['logger_sn'] not in newest or newest[row['logger_sn']]['sampling'] < row['sampling']:
+            newest[row['logger_sn']] = row
+    if not newest:
+        return
+    params = [{
+        'b_sn': row['logger_sn'],
+        'b_location': row['location_id'],
+        'b_sampling': row['sampling'],
+        'b_received': row['received']} for row in newest.values()]
+    db.session.execute(latest_statement(Logger.__table__, 'sn', 'b_sn'), params)
+    params = [p for p in params if p['b_location']]
+    if params:
+        db.session.execute(latest_statement(Location.__table__, 'id', 'b_location'), params)
+
+
+def rebuild_latest():
+    ''' set every Logger and Location latest_* from periodik history '''
+    db.session.execute('''
+        UPDATE logger SET latest_id = (
+            SELECT p.id FROM periodik p WHERE p.logger_sn = logger.sn
+            ORDER BY p.sampling DESC LIMIT 1)''')
+    db.session.execute('''
+        UPDATE location SET latest_id = (
+            SELECT p.id FROM periodik p WHERE p.location_id = location.id
+            ORDER BY p.sampling DESC LIMIT 1)''')
+    for table in ('logger', 'location'):
+        db.session.execute(f'''
+            UPDATE {table} SET
+                latest_sampling = (SELECT p.sampling FROM periodik p WHERE p.id = {table}.latest_id),
+                latest_up = (SELECT p.received FROM periodik p WHERE p.id = {table}.latest_id)''')
+    db.session.commit()
+
+
+def get_latest(location_ids):
+    ''' return {location_id: Periodik or None} in one indexed read '''
+    query = db.session.query(Location.id, Periodik).outerjoin(
+                    Periodik, Periodik.id == Location.latest_id).filter(
+                    Location.id.in_(location_ids))
+    return dict(query)
+
+
+@app.cli.command('rebuild-latest')
+def rebuild_latest_command():
+    ''' Rebuild Logger and Location latest sampling from periodik '''
+    rebuild_latest()
+    count = Location.query.filter(Location.latest_id.isnot(None)).count()
+    print(f"Latest rebuilt, {count} location with data")
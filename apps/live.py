@@ -0,0 +1,210 @@
+import json
+import logging
+import threading
+import time
+
+from flask import request
+
+from apps import app, get_socketio
+from apps.models import Tenant
+from apps.ingest import listeners
+
+LIVE_WINDOW = 2  # detik, update per lokasi digabung selama ini
+LIVE_CHANNEL = 'prinus-live'
+NAMESPACE = '/live'
+
+
+def compact(row):
+    ''' short form of a recorded Periodik row (dict) '''
+    return {
+        'l': row['location_id'],
+        'sn': row['logger_sn'],
+        't': int(time.mktime(row['sampling'].timetuple())),
+        'r': round(row['rain'] or 0, 2),
+        'w': None if row.get('wlev') is None else round(row['wlev'], 1),
+        'b': row.get('batt'),
+    }
+
+
+def merge(pending, update):
+    ''' fold update into pending (same location), rain adds up, the rest is latest '''
+    rain = pending.get('r', 0) + update.get('r', 0)
+    pending.update(update)
+    if rain:
+        pending['r'] = round(rain, 2)
+    return pending
+
+
+class LivePublisher:
+    '''
+    Ingest side. Coalesce recorded rows per location for `window` seconds
+    and publish, per tenant, only what changed since the last update of
+    each location (plus the rain that fell meanwhile).
+    '''
+
+    def __init__(self, publish, window=LIVE_WINDOW):
+        self.publish = publish
+        self.window = window
+        self.lock = threading.Lock()
+        self.pending = {}  # tenant_id: {location: compact}
+        self.sent = {}  # location: compact
+        self.stopped = threading.Event()
+
+    def on_record(self, rows):
+        with self.lock:
+            for row in rows:
+                if not row.get('tenant_id'):
+                    continue
+                update = compact(row)
+                tenant = self.pending.setdefault(row['tenant_id'], {})
+                key = update['l'] or update['sn']
+                tenant[key] = merge(tenant[key], update) if key in tenant else update
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for tenant_id, locations in pending.items():
+            deltas = []
+            for key, update in locations.items():
+                last = self.sent.get(key, {})
+                delta = dict((k, v) for k, v in update.items()
+                             if k in ('l', 'sn', 't') or (k == 'r' and v) or (k != 'r' and last.get(k) != v))
+                self.sent[key] = dict(update, r=0)
+                deltas.append(delta)
+            try:
+                self.publish(tenant_id, deltas)
+            except Exception as e:
+                logging.debug(f"Live publish Error : {e}")
+
+    def run(self):
+        while not self.stopped.wait(self.window):
+            self.flush()
+
+    def start(self):
+        listeners.append(self.on_record)
+        threading.Thread(target=self.run, name='live', daemon=True).start()
+        return self
+
+
+class LiveRelay:
+    '''
+    Web side. Forward deltas to every client of the tenant room, one
+    message in flight per client: while a client has not acked, new deltas
+    are merged into its pending set, so a slow client skips intermediate
+    values instead of queueing them.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients = {}  # sid: {'tenant': id, 'pending': {}, 'waiting': bool}
+        self.started = False
+
+    def join(self, sid, tenant_id):
+        with self.lock:
+            self.clients[sid] = {'tenant': tenant_id, 'pending': {}, 'waiting': False}
+
+    def leave(self, sid):
+        with self.lock:
+            self.clients.pop(sid, None)
+
+    def dispatch(self, tenant_id, deltas):
+        ready = []
+        with self.lock:
+            for sid, client in self.clients.items():
+                if client['tenant'] != tenant_id:
+                    continue
+                for delta in deltas:
+                    key = delta['l'] or delta['sn']
+                    pending = client['pending']
+                    pending[key] = merge(pending[key], delta) if key in pending else dict(delta)
+                if not client['waiting']:
+                    ready.append(sid)
+        for sid in ready:
+            self.send(sid)
+
+    def send(self, sid):
+        with self.lock:
+            client = self.clients.get(sid)
+            if not client or client['waiting'] or not client['pending']:
+                return
+            payload = list(client['pending'].values())
+            client['pending'] = {}
+            client['waiting'] = True
+        get_socketio().emit('periodik', payload, room=sid, namespace=NAMESPACE,
+                      callback=lambda *args: self.acked(sid))
+
+    def acked(self, sid):
+        with self.lock:
+            client = self.clients.get(sid)
+            if client:
+                client['waiting'] = False
+        self.send(sid)
+
+    def listen(self, url):
+        ''' forward what listener processes publish on LIVE_CHANNEL '''
+        import redis
+
+        pubsub = redis.Redis.from_url(url).pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(LIVE_CHANNEL)
+        for message in pubsub.listen():
+            try:
+                data = json.loads(message['data'])
+                self.dispatch(data['tenant'], data['deltas'])
+            except Exception as e:
+                logging.debug(f"Live relay Error : {e}")
+
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        url = app.config.get('LIVE_REDIS_URL')
+        if url:
+            get_socketio().start_background_task(self.listen, url)
+
+
+relay = LiveRelay()
+
+
+def start_publisher():
+    '''
+    LivePublisher of this ingest process, publishing to redis. The web
+    process holding the SocketIO clients only hears it through
+    LIVE_REDIS_URL, without it there is no live push at all.
+    '''
+    url = app.config.get('LIVE_REDIS_URL')
+    if not url:
+        logging.warning("LIVE_REDIS_URL not set, live push disabled")
+        return None
+    import redis
+
+    client = redis.Redis.from_url(url)
+
+    def publish(tenant_id, deltas):
+        client.publish(LIVE_CHANNEL, json.dumps({'tenant': tenant_id, 'deltas': deltas}))
+    return LivePublisher(publish).start()
+
+
+def live_join(data):
+    ''' logged in client joins the stream of tenant {'tenant': slug} it may view '''
+    from flask_login import current_user
+
+    if not current_user.is_authenticated:
+        return {'error': 'login required'}
+    ten = Tenant.query.filter_by(slug=(data or {}).get('tenant')).first()
+    if not ten:
+        return {'error': 'tenant not found'}
+    if not current_user.can_view(ten.id):
+        return {'error': 'forbidden'}
+    relay.start()
+    relay.join(request.sid, ten.id)
+    return {'tenant': ten.id}
+
+
+def live_disconnect():
+    relay.leave(request.sid)
+
+
+def register(socketio):
+    ''' attach the /live handlers to socketio '''
+    socketio.on_event('join', live_join, namespace=NAMESPACE)
+    socketio.on_event('disconnect', live_disconnect, namespace=NAMESPACE)
@@ -0,0 +1,236 @@
+import click
+import contextlib
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import Flask, Response, jsonify, request
+
+from apps import app
+
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)  # detik
+STATS_PORT = 5055
+STATS_DIR = '/tmp'
+WORKER_DUMP = 5  # detik, snapshot proses IngestPool ke STATS_DIR, digabung di /stats
+
+stats_app = Flask(__name__)  # /stats hanya di port lokal listener (serve), tidak di web publik
+
+
+class Metrics:
+    '''
+    Counters, latency histograms and gauges of this process. Recording is a
+    dict lookup and a few additions under one lock; gauges are callables
+    read only when a snapshot is taken. Worker processes dump theirs to
+    STATS_DIR (start_dump) and /stats adds them to the listener's.
+    '''
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.last_seen = {}
+        self.started = time.time()
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            hist = self.histograms.get(name)
+            if not hist:
+                hist = self.histograms[name] = {'count': 0, 'sum': 0, 'buckets': [0] * (len(self.buckets) + 1)}
+            hist['count'] += 1
+            hist['sum'] += seconds
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    hist['buckets'][i] += 1
+                    break
+            else:
+                hist['buckets'][-1] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        ''' observe the duration of the block as `name`, count `name`_error if it raises '''
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(f"{name}_error")
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def gauge(self, name, func):
+        ''' register func() as the value of gauge `name` '''
+        self.gauges[name] = func
+
+    def seen(self, key):
+        ''' mark a message of key (tenant) received now '''
+        self.last_seen[key] = time.time()
+
+    def snapshot(self):
+        now = time.time()
+        with self.lock:
+            result = {
+                'uptime': now - self.started,
+                'counters': dict(self.counters),
+                'histograms': dict((k, dict(v, buckets=list(v['buckets']))) for k, v in self.histograms.items()),
+                'buckets': list(self.buckets),
+            }
+        gauges = {}
+        for name, func in list(self.gauges.items()):
+            try:
+                gauges[name] = func()
+            except Exception as e:
+                logging.debug(f"Gauge {name} Error : {e}")
+        for key, at in list(self.last_seen.items()):
+            gauges[f"seconds_since_message{{tenant=\"{key}\"}}"] = round(now - at, 1)
+        result['gauges'] = gauges
+        return result
+
+    def reset(self):
+        ''' start from zero, e.g. in a forked worker holding a copy of the parent's metrics '''
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.gauges = {}
+            self.last_seen = {}
+            self.started = time.time()
+
+    def dump(self, name):
+        ''' write snapshot to STATS_DIR/stats-<name>.json, for runs that exit (cron) '''
+        path = os.path.join(app.config.get('STATS_DIR') or STATS_DIR, f"stats-{name}.json")
+        with open(path + '.tmp', 'w') as f:
+            json.dump(dict(self.snapshot(), at=time.time()), f)
+        os.replace(path + '.tmp', path)
+        return path
+
+    def start_dump(self, name, every=WORKER_DUMP):
+        ''' dump(name) every `every` seconds in a daemon thread, return the Event that stops it '''
+        stopped = threading.Event()
+
+        def run():
+            while not stopped.wait(every):
+                try:
+                    self.dump(name)
+                except Exception as e:
+                    logging.debug(f"Stats dump Error : {e}")
+        threading.Thread(target=run, name='stats-dump', daemon=True).start()
+        return stopped
+
+
+metrics = Metrics()
+
+
+def worker_snapshots(since):
+    ''' snapshots dumped by worker processes (stats-worker-*.json) since `since` (epoch) '''
+    result = []
+    for path in sorted(glob.glob(os.path.join(app.config.get('STATS_DIR') or STATS_DIR, 'stats-worker-*.json'))):
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if snapshot.get('at', 0) >= since:
+            result.append(snapshot)
+    return result
+
+
+def merge(snapshot, others):
+    ''' snapshot with the counters and histograms of others added, gauges of snapshot win '''
+    result = dict(snapshot, counters=dict(snapshot['counters']),
+                  histograms=dict((k, dict(v, buckets=list(v['buckets']))) for k, v in snapshot['histograms'].items()),
+                  gauges=dict(snapshot['gauges']))
+    for other in others:
+        for name, value in other['counters'].items():
+            result['counters'][name] = result['counters'].get(name, 0) + value
+        for name, hist in other['histograms'].items():
+            mine = result['histograms'].get(name)
+            if not mine:
+                result['histograms'][name] = dict(hist, buckets=list(hist['buckets']))
+                continue
+            mine['count'] += hist['count']
+            mine['sum'] += hist['sum']
+            mine['buckets'] = [a + b for a, b in zip(mine['buckets'], hist['buckets'])]
+        for name, value in other['gauges'].items():
+            result['gauges'].setdefault(name, value)
+    return result
+
+
+def process_snapshot():
+    ''' this process with the IngestPool workers started after it '''
+    return merge(metrics.snapshot(), worker_snapshots(metrics.started))
+
+
+def prometheus(snapshot):
+    ''' snapshot in Prometheus text format '''
+    lines = []
+    for name, value in sorted(snapshot['counters'].items()):
+        lines.append(f"prinus_{name}_total {value}")
+    for name, value in sorted(snapshot['gauges'].items()):
+        lines.append(f"prinus_{name} {value}")
+    for name, hist in sorted(snapshot['histograms'].items()):
+        total = 0
+        for bound, count in zip(list(snapshot['buckets']) + ['+Inf'], hist['buckets']):
+            total += count
+            lines.append(f"prinus_{name}_seconds_bucket{{le=\"{bound}\"}} {total}")
+        lines.append(f"prinus_{name}_seconds_sum {hist['sum']}")
+        lines.append(f"prinus_{name}_seconds_count {hist['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+@stats_app.route('/stats')
+def stats_endpoint():
+    snapshot = process_snapshot()
+    if request.args.get('format') == 'json':
+        return jsonify(snapshot)
+    return Response(prometheus(snapshot), mimetype='text/plain')
+
+
+def serve(port=None):
+    ''' serve /stats of this process (the listener) on localhost in a daemon thread '''
+    from werkzeug.serving import make_server
+
+    port = port or app.config.get('STATS_PORT') or STATS_PORT
+    server = make_server('127.0.0.1', int(port), stats_app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='stats', daemon=True).start()
+    logging.debug(f"Stats on http://127.0.0.1:{port}/stats")
+    return server
+
+
+def print_snapshot(title, snapshot):
+    print(f"== {title}")
+    for name, value in sorted(snapshot['counters'].items()):
+        print(f"  {name} : {value}")
+    for name, value in sorted(snapshot['gauges'].items()):
+        print(f"  {name} : {value}")
+    for name, hist in sorted(snapshot['histograms'].items()):
+        avg = hist['sum'] / hist['count'] * 1000 if hist['count'] else 0
+        print(f"  {name} : {hist['count']} x, avg {avg:.2f} ms")
+
+
+@app.cli.command()
+@click.option('-p', '--port', default=0, help='Port stats listener')
+def stats(port):
+    ''' Show ingest, report and delivery metrics of the listener and the last cron runs '''
+    import requests
+
+    port = port or app.config.get('STATS_PORT') or STATS_PORT
+    try:
+        res = requests.get(f"http://127.0.0.1:{port}/stats?format=json", timeout=5)
+        print_snapshot("listener", res.json())
+    except Exception as e:
+        print(f"== listener : not reachable ({e})")
+    stats_dir = app.config.get('STATS_DIR') or STATS_DIR
+    for name in sorted(os.listdir(stats_dir)):
+        if name.startswith('stats-') and name.endswith('.json') and not name.startswith('stats-worker-'):
+            with open(os.path.join(stats_dir, name)) as f:
+                snapshot = json.load(f)
+            at = time.strftime('%Y-%m-%d %H:%M', time.localtime(snapshot['at']))
+            print_snapshot(f"{name[6:-5]} ({at})", snapshot)
@@ -0,0 +1,276 @@
+import datetime
+import json
+import click
+
+from sqlalchemy import func, inspect
+
+from apps import app, db
+from apps.models import Periodik
+
+MIGRATIONS = {}
+
+
+def migration(name):
+    ''' register function as `flask migrate <name>` '''
+    def wrapper(run):
+        MIGRATIONS[name] = run
+        return run
+    return wrapper
+
+
+def dialect():
+    return db.engine.dialect.name
+
+
+def has_column(table, name):
+    return name in [c['name'] for c in inspect(db.engine).get_columns(table)]
+
+
+def add_column(table, name, sql_type):
+    if has_column(table, name):
+        print(f"Column {table}.{name} already exist")
+        return
+    db.session.execute(f"ALTER TABLE {table} ADD COLUMN {name} {sql_type}")
+    print(f"Added column {table}.{name}")
+
+
+def has_constraint(table, name):
+    ''' True if table has unique constraint or index `name` '''
+    insp = inspect(db.engine)
+    names = [c['name'] for c in insp.get_unique_constraints(table)]
+    names += [i['name'] for i in insp.get_indexes(table)]
+    return name in names
+
+
+@app.cli.command()
+@click.argument('name', required=False)
+def migrate(name):
+    ''' Run schema migration NAME, list migrations if NAME not given '''
+    if not name or name not in MIGRATIONS:
+        if name:
+            print(f"Unknown migration : {name}")
+        for key, migration in MIGRATIONS.items():
+            print(f"{key} : {migration.__doc__.strip()}")
+        return
+    MIGRATIONS[name]()
+
+
+@migration('periodik-unique')
+def periodik_unique():
+    ''' remove duplicate periodik (logger_sn, sampling), add unique constraint '''
+    if dialect() == 'postgresql':
+        res = db.session.execute('''
+            DELETE FROM periodik a USING periodik b
+            WHERE a.logger_sn = b.logger_sn AND a.sampling = b.sampling AND a.id > b.id''')
+    else:
+        res = db.session.execute('''
+            DELETE FROM periodik WHERE logger_sn IS NOT NULL AND id NOT IN (
+                SELECT min(id) FROM periodik GROUP BY logger_sn, sampling)''')
+    print(f"Removed {res.rowcount} duplicate periodik")
+
+    if has_constraint('periodik', '_logger_sampling'):
+        print("Constraint _logger_sampling already exist")
+    elif dialect() == 'postgresql':
+        db.session.execute('''
+            ALTER TABLE periodik ADD CONSTRAINT _logger_sampling UNIQUE (logger_sn, sampling)''')
+        print("Added constraint _logger_sampling")
+    else:
+        db.session.execute('''
+            CREATE UNIQUE INDEX _logger_sampling ON periodik (logger_sn, sampling)''')
+        print("Added unique index _logger_sampling")
+    db.session.commit()
+
+
+@migration('periodik-location-index')
+def periodik_location_index():
+    ''' add composite periodik (location_id, sampling) index for report queries '''
+    if has_constraint('periodik', 'ix_periodik_location_sampling'):
+        print("Index ix_periodik_location_sampling already exist")
+        return
+    concurrently = 'CONCURRENTLY' if dialect() == 'postgresql' else ''
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(f'''
+            CREATE INDEX {concurrently} ix_periodik_location_sampling
+            ON periodik (location_id, sampling)''')
+    print("Added index ix_periodik_location_sampling")
+
+
+@migration('latest')
+def latest():
+    ''' add logger/location latest_sampling, latest_up, latest_id and fill them from periodik '''
+    from apps.latest import rebuild_latest
+
+    for table in ('logger', 'location'):
+        add_column(table, 'latest_sampling', 'TIMESTAMP')
+        add_column(table, 'latest_up', 'TIMESTAMP')
+        add_column(table, 'latest_id', 'INTEGER')
+    db.session.commit()
+    rebuild_latest()
+    print("Latest rebuilt from periodik")
+
+
+@migration('rollup')
+def rollup():
+    ''' create periodik_hourly and periodik_daily and fill them from periodik '''
+    from apps.models import PeriodikHourly, PeriodikDaily
+    from apps.rollup import rebuild_rollup
+
+    PeriodikHourly.__table__.create(db.engine, checkfirst=True)
+    PeriodikDaily.__table__.create(db.engine, checkfirst=True)
+    print("Created periodik_hourly, periodik_daily")
+    first, last = db.session.query(func.min(Periodik.sampling), func.max(Periodik.sampling)).one()
+    if first:
+        rebuild_rollup((first - datetime.timedelta(minutes=1)).date(), last.date())
+        print("Rollup rebuilt from periodik")
+
+
+@migration('rain-threshold')
+def rain_threshold():
+    ''' add tenant hujan_lebat, hujan_sangat_lebat (rain_alert threshold per tenant) '''
+    add_column('tenant', 'hujan_lebat', 'FLOAT')
+    add_column('tenant', 'hujan_sangat_lebat', 'FLOAT')
+    db.session.commit()
+
+
+@migration('periodik-partition')
+def periodik_partition():
+    ''' move periodik to monthly range partitions with a BRIN sampling index (PostgreSQL, stop the listener first) '''
+    from apps.partition import create_partitions, create_default_partition, is_partitioned, AHEAD
+
+    if dialect() != 'postgresql':
+        print("Partitioning needs PostgreSQL")
+        return
+    if is_partitioned():
+        print("Table periodik already partitioned")
+        return
+
+    # nama index & constraint berlaku per schema, pindahkan dulu ke *_old
+    insp = inspect(db.engine)
+    constraints = [c['name'] for c in insp.get_unique_constraints('periodik')]
+    constraints.append(insp.get_pk_constraint('periodik')['name'])
+    indexes = [i['name'] for i in insp.get_indexes('periodik') if i['name'] not in constraints]
+    foreign_keys = insp.get_foreign_keys('periodik')
+    db.session.execute("ALTER TABLE periodik RENAME TO periodik_old")
+    for name in constraints:
+        db.session.execute(f"ALTER TABLE periodik_old RENAME CONSTRAINT {name} TO {name}_old")
+    for name in indexes:
+        db.session.execute(f"ALTER INDEX {name} RENAME TO {name}_old")
+
+    db.session.execute('''
+        CREATE TABLE periodik (LIKE periodik_old INCLUDING DEFAULTS)
+        PARTITION BY RANGE (sampling)''')
+    db.session.execute("ALTER SEQUENCE periodik_id_seq OWNED BY periodik.id")
+    db.session.execute("ALTER TABLE periodik ALTER COLUMN sampling SET NOT NULL")
+    db.session.execute("ALTER TABLE periodik ADD PRIMARY KEY (id, sampling)")
+    db.session.execute("ALTER TABLE periodik ADD CONSTRAINT _logger_sampling UNIQUE (logger_sn, sampling)")
+    db.session.execute("CREATE INDEX ix_periodik_sampling ON periodik USING brin (sampling)")
+    db.session.execute("CREATE INDEX ix_periodik_location_sampling ON periodik (location_id, sampling)")
+    # LIKE tidak menyalin foreign key (logger, location, tenant)
+    for fk in foreign_keys:
+        db.session.execute(f'''
+            ALTER TABLE periodik ADD CONSTRAINT {fk['name']}
+            FOREIGN KEY ({', '.join(fk['constrained_columns'])})
+            REFERENCES {fk['referred_table']} ({', '.join(fk['referred_columns'])})''')
+    db.session.commit()
+    print(f"Created partitioned periodik, {len(foreign_keys)} foreign keys")
+
+    first, last = db.session.execute("SELECT min(sampling), max(sampling) FROM periodik_old").first()
+    today = datetime.date.today()
+    end = today + datetime.timedelta(days=31 * AHEAD)
+    for name in create_partitions(first or today, max(last.date() if last else today, end)):
+        print(f"Created partition {name}")
+    print(f"Created partition {create_default_partition()}")
+
+    month = first
+    while first and month <= last:
+        month_end = datetime.datetime(month.year, month.month, 1) + datetime.timedelta(days=32)
+        month_end = month_end.replace(day=1)
+        res = db.session.execute('''
+            INSERT INTO periodik SELECT * FROM periodik_old
+            WHERE sampling >= :start AND sampling < :end''', {'start': month, 'end': month_end})
+        db.session.commit()
+        print(f"{month.strftime('%Y-%m')} : {res.rowcount} periodik")
+        month = month_end
+    res = db.session.execute("SELECT count(*) FROM periodik_old WHERE sampling IS NULL").scalar()
+    if res:
+        print(f"{res} periodik without sampling left in periodik_old")
+    print("Done, check the data then DROP TABLE periodik_old")
+
+
+@migration('raw-fingerprint')
+def raw_fingerprint():
+    ''' deduplicate raw on fingerprint md5("device|sampling") instead of a unique index on content '''
+    from apps.ingest import raw_fingerprint
+
+    add_column('raw', 'fingerprint', 'VARCHAR(32)')
+    db.session.commit()
+    if dialect() == 'postgresql':
+        res = db.session.execute('''
+            UPDATE raw SET fingerprint = md5(coalesce(
+                (content->>'device') || '|' || (content->>'sampling'), content::text))
+            WHERE fingerprint IS NULL''')
+        print(f"Fingerprinted {res.rowcount} raw")
+        res = db.session.execute('''
+            DELETE FROM raw a USING raw b
+            WHERE a.fingerprint = b.fingerprint AND a.id > b.id''')
+    else:
+        rows = db.session.execute("SELECT id, content FROM raw WHERE fingerprint IS NULL").fetchall()
+        for id, content in rows:
+            content = json.loads(content) if isinstance(content, str) else content
+            db.session.execute("UPDATE raw SET fingerprint = :f WHERE id = :id",
+                               {'f': raw_fingerprint(content), 'id': id})
+        print(f"Fingerprinted {len(rows)} raw")
+        res = db.session.execute('''
+            DELETE FROM raw WHERE id NOT IN (SELECT min(id) FROM raw GROUP BY fingerprint)''')
+    print(f"Removed {res.rowcount} duplicate raw")
+
+    if dialect() == 'postgresql':
+        for c in inspect(db.engine).get_unique_constraints('raw'):
+            if c['column_names'] == ['content']:
+                db.session.execute(f"ALTER TABLE raw DROP CONSTRAINT {c['name']}")
+                print(f"Dropped constraint {c['name']}")
+    if has_constraint('raw', 'raw_fingerprint_key'):
+        print("Constraint raw_fingerprint_key already exist")
+    else:
+        db.session.execute("CREATE UNIQUE INDEX raw_fingerprint_key ON raw (fingerprint)")
+        print("Added unique index raw_fingerprint_key")
+    db.session.commit()
+
+
+@migration('report-cache')
+def report_cache():
+    ''' create report_cache (telegram report results per tenant and hour / day) '''
+    from apps.models import ReportCache
+
+    ReportCache.__table__.create(db.engine, checkfirst=True)
+    print("Created report_cache")
+
+
+@migration('arrival-slots')
+def arrival_slots():
+    ''' add periodik_hourly / periodik_daily slots (arrival bitmap) and rebuild the rollups '''
+    from apps.rollup import rebuild_rollup
+
+    add_column('periodik_hourly', 'slots', 'INTEGER')
+    add_column('periodik_daily', 'slots', 'INTEGER')
+    db.session.commit()
+    first, last = db.session.query(func.min(Periodik.sampling), func.max(Periodik.sampling)).one()
+    if first:
+        rebuild_rollup((first - datetime.timedelta(minutes=1)).date(), last.date())
+        print("Rollup rebuilt from periodik")
+
+
+@migration('fetch-cursor')
+def fetch_cursor():
+    ''' create fetch_cursor (last sampling fetched from the prinus API per logger) '''
+    from apps.models import FetchCursor
+
+    FetchCursor.__table__.create(db.engine, checkfirst=True)
+    print("Created fetch_cursor")
+
+
+@migration('users-tenant')
+def users_tenant():
+    ''' add users tenant_id (tenant a user may view, NULL: every tenant) '''
+    add_column('users', 'tenant_id', 'INTEGER REFERENCES tenant (id)')
+    db.session.commit()
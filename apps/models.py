@@ -6,6 +6,7 @@ from apps import login
 from apps import db
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
+from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy import desc
 
 
@@ -13,7 +14,8 @@ class Raw(db.Model):
     __tablename__ = 'raw'
 
     id = db.Column(db.Integer, primary_key=True)
-    content = db.Column(JSONB, unique=True)
+    content = db.Column(JSONB().with_variant(db.JSON, 'sqlite'))
+    fingerprint = db.Column(db.String(32), unique=True)  # md5 "device|sampling", lihat raw_fingerprint
     received = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
 
@@ -23,6 +25,7 @@ class Users(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(12), index=True, unique=True, nullable=False)
     password = db.Column(db.String(128))
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenant.id'), nullable=True)  # None: semua tenant
 
     def set_password(self, password):
         self.password = generate_password_hash(password)
@@ -30,6 +33,9 @@ class Users(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password, password)
 
+    def can_view(self, tenant_id):
+        return self.tenant_id is None or self.tenant_id == tenant_id
+
     def __repr__(self):
         return '<User %r>' % self.username
 
@@ -45,6 +51,8 @@ class Tenant(db.Model):
     telegram_info_id = db.Column(db.Integer)
     telegram_info_group = db.Column(db.Text)
     timezone = db.Column(db.String(50))
+    hujan_lebat = db.Column(db.Float)  # mm / jam, batas peringatan hujan lebat
+    hujan_sangat_lebat = db.Column(db.Float)  # mm / jam
 
     locations = relationship('Location', backref='location_tenant')
     loggers = relationship('Logger', backref='logger_tenant')
@@ -56,7 +64,7 @@ class Tenant(db.Model):
 
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    return Users.query.get(int(id))
 
 
 class Logger(db.Model):
@@ -79,9 +87,9 @@ class Logger(db.Model):
 
     created_at = db.Column(db.DateTime)
     modified_at = db.Column(db.DateTime)
-    # latest_sampling = db.Column(db.DateTime)
-    # latest_up = db.Column(db.DateTime)
-    # latest_id = db.Column(db.Integer)
+    latest_sampling = db.Column(db.DateTime)
+    latest_up = db.Column(db.DateTime)  # received
+    latest_id = db.Column(db.Integer)  # periodik.id
 
     def __repr__(self):
         return '<Device {}>'.format(self.sn)
@@ -102,9 +110,9 @@ class Location(db.Model):
 
     created_at = db.Column(db.DateTime)
     modified_at = db.Column(db.DateTime)
-    # latest_sampling = db.Column(db.DateTime)
-    # latest_up = db.Column(db.DateTime)
-    # latest_id = db.Column(db.Integer)
+    latest_sampling = db.Column(db.DateTime)
+    latest_up = db.Column(db.DateTime)  # received
+    latest_id = db.Column(db.Integer)  # periodik.id
 
 
 class Periodik(db.Model):
@@ -130,8 +138,9 @@ class Periodik(db.Model):
     logger = relationship("Logger", back_populates="logger_periodik")
     location = relationship("Location", back_populates="location_periodik")
     # periodik_tenant = relationship("Tenant", back_populates="periodiks")
-    # __table_args__ = (db.UniqueConstraint('device_sn', 'sampling',
-    #                                       name='_device_sampling'),)
+    __table_args__ = (db.UniqueConstraint('logger_sn', 'sampling',
+                                          name='_logger_sampling'),
+                      db.Index('ix_periodik_location_sampling', 'location_id', 'sampling'))
 #
 #     def __repr__(self):
 #         return '<Periodik {} Device {}>'.format(self.sampling, self.device_sn)
@@ -146,3 +155,84 @@ class Periodik(db.Model):
 #                                              sejak).order_by(self.sampling)]
 #         lokasi_hari_hujan = [d.lokasi_id for d in data if (d.rain or 0) > 0]
 #         print(lokasi_hujan)
+
+
+class PeriodikRollup(object):
+    ''' rekap Periodik per logger, 'sampling' = akhir periode (sampling > awal, <= akhir) '''
+    id = db.Column(db.Integer, primary_key=True)
+    sampling = db.Column(db.DateTime, nullable=False)
+    rain = db.Column(db.Float, default=0)  # jumlah hujan dalam mm
+    rain_minute = db.Column(db.Integer, default=0)  # lama hujan dalam menit
+    samples = db.Column(db.Integer, default=0)  # jumlah data
+    wlev_min = db.Column(db.Float)
+    wlev_max = db.Column(db.Float)
+    wlev_last = db.Column(db.Float)
+    wlev_last_at = db.Column(db.DateTime)
+    batt_min = db.Column(db.Float)
+    last_sampling = db.Column(db.DateTime)
+    slots = db.Column(db.Integer, default=0)  # bit i: ada data di slot ke-i (jam: 12 x 5 menit, hari: 24 jam)
+    modified_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    @declared_attr
+    def logger_sn(cls):
+        return db.Column(db.String(8), db.ForeignKey('logger.sn'), nullable=False)
+
+    @declared_attr
+    def location_id(cls):
+        return db.Column(db.Integer, db.ForeignKey('location.id'), nullable=True)
+
+    @declared_attr
+    def tenant_id(cls):
+        return db.Column(db.Integer, db.ForeignKey('tenant.id'), nullable=True)
+
+    @declared_attr
+    def logger(cls):
+        return relationship('Logger')
+
+    @declared_attr
+    def location(cls):
+        return relationship('Location')
+
+    @declared_attr
+    def tenant(cls):
+        return relationship('Tenant')
+
+    @declared_attr
+    def __table_args__(cls):
+        return (db.UniqueConstraint('logger_sn', 'sampling', name=f"_{cls.__tablename__}_logger_sampling"),
+                db.Index(f"ix_{cls.__tablename__}_location_sampling", 'location_id', 'sampling'))
+
+
+class PeriodikHourly(PeriodikRollup, db.Model):
+    __tablename__ = 'periodik_hourly'
+
+
+class PeriodikDaily(PeriodikRollup, db.Model):
+    __tablename__ = 'periodik_daily'
+
+
+class ReportCache(db.Model):
+    ''' hasil laporan telegram per (tenant, jenis, periode), lihat apps.reportcache '''
+    __tablename__ = 'report_cache'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenant.id'), nullable=False)
+    kind = db.Column(db.String(12), nullable=False)  # ch, tma, count
+    bucket = db.Column(db.DateTime, nullable=False)  # jam / hari laporan (UTC)
+    window_start = db.Column(db.DateTime, nullable=False)  # periode data (UTC)
+    window_end = db.Column(db.DateTime, nullable=False)
+    result = db.Column(JSONB().with_variant(db.JSON, 'sqlite'))  # data per lokasi, teks dibuat saat dikirim
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)  # saat result mulai dihitung
+    used_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('tenant_id', 'kind', 'bucket', name='_report_cache_tenant_kind_bucket'),
+                      db.Index('ix_report_cache_tenant_window', 'tenant_id', 'window_end'))
+
+
+class FetchCursor(db.Model):
+    ''' sampling terakhir yang diberikan API prinus per logger, lihat apps.gapfill '''
+    __tablename__ = 'fetch_cursor'
+
+    logger_sn = db.Column(db.String(10), db.ForeignKey('logger.sn'), primary_key=True)
+    fetched_until = db.Column(db.DateTime)
+    fetched_at = db.Column(db.DateTime)
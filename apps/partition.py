@@ -0,0 +1,147 @@
+import click
+import datetime
+
+from apps import app, db
+
+AHEAD = 3  # bulan partisi yang disiapkan ke depan
+DEFAULT_PARTITION = 'periodik_default'  # sampling di luar partisi bulanan, agar batch ingest tidak gagal
+
+
+def month_start(day):
+    return datetime.datetime(day.year, day.month, 1)
+
+
+def next_month(day):
+    return month_start(month_start(day) + datetime.timedelta(days=32))
+
+
+def partition_name(month):
+    return f"periodik_y{month.year}m{month.month:02d}"
+
+
+def is_partitioned():
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return bool(db.session.execute('''
+        SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid
+        WHERE c.relname = 'periodik' ''').scalar())
+
+
+def create_partition(month):
+    '''
+    create the periodik partition of month if it does not exist, return its
+    name. Rows of that month already in the default partition are moved
+    into it, PostgreSQL refuses the partition otherwise.
+    '''
+    name = partition_name(month)
+    if db.engine.has_table(name):
+        return None
+    bounds = {'start': month, 'end': next_month(month)}
+    moved = 0
+    if db.engine.has_table(DEFAULT_PARTITION):
+        db.session.execute(f'''
+            CREATE TEMP TABLE periodik_move ON COMMIT DROP AS
+            SELECT * FROM {DEFAULT_PARTITION} WHERE sampling >= :start AND sampling < :end''', bounds)
+        moved = db.session.execute(f'''
+            DELETE FROM {DEFAULT_PARTITION} WHERE sampling >= :start AND sampling < :end''', bounds).rowcount
+    db.session.execute(f'''
+        CREATE TABLE {name} PARTITION OF periodik
+        FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{next_month(month):%Y-%m-%d}')''')
+    if moved:
+        db.session.execute("INSERT INTO periodik SELECT * FROM periodik_move")
+    db.session.commit()
+    return name
+
+
+def create_default_partition():
+    ''' create the DEFAULT partition of periodik if it does not exist, return its name '''
+    if db.engine.has_table(DEFAULT_PARTITION):
+        return None
+    db.session.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF periodik DEFAULT")
+    db.session.commit()
+    return DEFAULT_PARTITION
+
+
+def has_default_partition():
+    ''' True if periodik has a DEFAULT partition, whatever its name '''
+    return bool(db.session.execute('''
+        SELECT p.partdefid <> 0 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid
+        WHERE c.relname = 'periodik' ''').scalar())
+
+
+def default_rows():
+    return db.session.execute(f"SELECT count(*) FROM {DEFAULT_PARTITION}").scalar()
+
+
+def create_partitions(start, end):
+    ''' create monthly partitions from start to end (date), return names created '''
+    created = []
+    month = month_start(start)
+    while month <= month_start(end):
+        name = create_partition(month)
+        if name:
+            created.append(name)
+        month = next_month(month)
+    return created
+
+
+def ensure_partitions(ahead=AHEAD):
+    ''' partitions of this month and `ahead` months after it '''
+    today = datetime.date.today()
+    end = month_start(today)
+    for i in range(ahead):
+        end = next_month(end)
+    return create_partitions(today, end)
+
+
+def detach_partition(month, archive=False):
+    '''
+    Detach the partition of month from periodik, CONCURRENTLY (PostgreSQL 14+)
+    so inserts and reports are not blocked. PostgreSQL refuses CONCURRENTLY
+    while periodik has a DEFAULT partition, the detach then takes a short
+    ACCESS EXCLUSIVE lock instead. The detached table is kept as is, or
+    renamed to periodik_archive_* with `archive`. Return (name, concurrently).
+    '''
+    name = partition_name(month)
+    version = db.session.execute('SHOW server_version_num').scalar()
+    concurrently = int(version) >= 140000 and not has_default_partition()
+    db.session.commit()
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(f"ALTER TABLE periodik DETACH PARTITION {name} {'CONCURRENTLY' if concurrently else ''}")
+        if archive:
+            conn.execute(f"ALTER TABLE {name} RENAME TO {name.replace('periodik_', 'periodik_archive_')}")
+    return name, concurrently
+
+
+def parse_month(value):
+    return datetime.datetime.strptime(value, "%Y-%m")
+
+
+@app.cli.command()
+@click.argument('command')
+@click.option('-m', '--month', default='', help='Bulan partisi (YYYY-MM)')
+@click.option('-a', '--ahead', default=AHEAD, help='Jumlah bulan ke depan')
+def partition(command, month, ahead):
+    ''' Monthly periodik partitions (create / detach / archive) '''
+    if not is_partitioned():
+        print("Table periodik is not partitioned, run 'flask migrate periodik-partition'")
+        return
+    if command == 'create':
+        if month:
+            created = create_partitions(parse_month(month), parse_month(month))
+        else:
+            created = ensure_partitions(ahead)
+        created += [name for name in [create_default_partition()] if name]
+        for name in created:
+            print(f"Created partition {name}")
+        if not created:
+            print("Partitions already exist")
+        count = default_rows()
+        if count:
+            print(f"{count} periodik in {DEFAULT_PARTITION}, outside the monthly partitions")
+    elif command in ('detach', 'archive'):
+        if not month:
+            print("Partition month (-m YYYY-MM) required")
+            return
+        name, concurrently = detach_partition(parse_month(month), archive=command == 'archive')
+        print(f"Detached partition {name}" + ("" if concurrently else " (not concurrently)"))
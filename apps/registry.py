@@ -0,0 +1,97 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from sqlalchemy import event, func
+
+from apps import db
+from apps.models import Logger
+
+LOGGER_TTL = 300  # detik
+UNKNOWN_TTL = 60  # detik, sn yang tidak ada di database
+CHECK_EVERY = 30  # detik, cek Logger.modified_at
+
+LoggerInfo = namedtuple('LoggerInfo', [
+    'id', 'sn', 'tipe', 'tenant_id', 'location_id', 'temp_cor', 'humi_cor',
+    'batt_cor', 'tipp_fac', 'ting_son', 'modified_at'])
+
+
+def logger_info(logger):
+    return LoggerInfo(*(getattr(logger, f) for f in LoggerInfo._fields))
+
+
+class LoggerRegistry:
+    '''
+    In-memory logger metadata keyed by sn, entries expire after `ttl` seconds.
+    Unknown sn are cached as None for `unknown_ttl` seconds, and the whole
+    registry is dropped when Logger.modified_at / created_at moves.
+    '''
+
+    def __init__(self, ttl=LOGGER_TTL, unknown_ttl=UNKNOWN_TTL, check_every=CHECK_EVERY):
+        self.ttl = ttl
+        self.unknown_ttl = unknown_ttl
+        self.check_every = check_every
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.checked_at = 0
+
+    def get(self, sn):
+        ''' return LoggerInfo or None if sn not found in database '''
+        return self.get_many([sn]).get(sn)
+
+    def get_many(self, sns):
+        ''' return {sn: LoggerInfo or None}, with one query for all misses '''
+        self.check_modified()
+        now = time.monotonic()
+        found = {}
+        missing = set()
+        with self.lock:
+            for sn in sns:
+                entry = self.entries.get(sn)
+                if entry and entry[1] > now:
+                    found[sn] = entry[0]
+                else:
+                    missing.add(sn)
+        if missing:
+            loaded = {l.sn: logger_info(l) for l in Logger.query.filter(Logger.sn.in_(missing))}
+            with self.lock:
+                for sn in missing:
+                    info = loaded.get(sn)
+                    ttl = self.ttl if info else self.unknown_ttl
+                    self.entries[sn] = (info, now + ttl)
+                    found[sn] = info
+        return found
+
+    def invalidate(self, sn=None):
+        with self.lock:
+            if sn is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(sn, None)
+
+    def check_modified(self, force=False):
+        ''' drop every entry if any Logger was created or modified since last check '''
+        now = time.monotonic()
+        if not force and now - self.checked_at < self.check_every:
+            return
+        self.checked_at = now
+        stamp = tuple(db.session.query(
+                                func.max(Logger.modified_at),
+                                func.max(Logger.created_at),
+                                func.count(Logger.id)).one())
+        if self.stamp is not None and stamp != self.stamp:
+            logging.debug("Logger modified, reload logger registry")
+            self.invalidate()
+        self.stamp = stamp
+
+
+loggers = LoggerRegistry()
+
+
+@event.listens_for(Logger, 'after_insert')
+@event.listens_for(Logger, 'after_update')
+@event.listens_for(Logger, 'after_delete')
+def invalidate_logger(mapper, connection, target):
+    loggers.invalidate(target.sn)
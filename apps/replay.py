@@ -0,0 +1,243 @@
+import click
+import datetime
+import json
+import logging
+import queue
+import threading
+import time
+
+from sqlalchemy import event
+
+from apps import app, db
+from apps.models import Logger, Tenant
+from apps.archive import iter_raw, read_day
+from apps.bench import safe_database
+from apps.ingest import IngestBuffer, BATCH_AGE, get_sn, listeners
+from apps.registry import loggers as registry
+from apps import command
+
+REPORT_EVERY = 5  # detik
+
+
+class Message:
+    ''' what paho hands to on_message, plus when it was published '''
+
+    def __init__(self, topic, raw):
+        self.topic = topic
+        self.payload = json.dumps(raw).encode('utf-8')
+        self.published_at = None
+
+
+class LocalBroker:
+    '''
+    In-process stand-in for the MQTT broker: publish() queues messages and
+    one subscriber thread delivers them to callback in order, as paho does.
+    '''
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.messages = queue.Queue()
+        self.thread = None
+
+    def publish(self, message):
+        message.published_at = time.monotonic()
+        self.messages.put(message)
+
+    def run(self):
+        with app.app_context():
+            while True:
+                message = self.messages.get()
+                if message is None:
+                    break
+                try:
+                    self.callback(None, None, message)
+                except Exception as e:
+                    logging.debug(f"Replay message Error : {e}")
+            db.session.remove()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='replay-broker', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.messages.put(None)
+        self.thread.join()
+
+
+class ReplayStats:
+    ''' publish time per (sn, sampling), lag once the periodik row is recorded, DB time '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.lags = []
+        self.published = 0
+        self.db_seconds = 0
+        self.statements = 0
+        self.started = time.monotonic()
+        self.cursor_started = threading.local()
+
+    def on_publish(self, raw, published_at):
+        key = (get_sn(raw), datetime.datetime.fromtimestamp(raw['sampling']))
+        with self.lock:
+            self.pending[key] = published_at
+            self.published += 1
+
+    def on_record(self, rows):
+        now = time.monotonic()
+        with self.lock:
+            for row in rows:
+                published_at = self.pending.pop((row['logger_sn'], row['sampling']), None)
+                if published_at is not None:
+                    self.lags.append(now - published_at)
+
+    def before_execute(self, *args):
+        self.cursor_started.at = time.perf_counter()
+
+    def after_execute(self, *args):
+        at = getattr(self.cursor_started, 'at', None)
+        if at is not None:
+            with self.lock:
+                self.db_seconds += time.perf_counter() - at
+                self.statements += 1
+
+    def summary(self):
+        with self.lock:
+            lags = sorted(self.lags)
+            elapsed = time.monotonic() - self.started
+            recorded = len(lags)
+            return {
+                'published': self.published,
+                'recorded': recorded,
+                'seconds': elapsed,
+                'rows_per_second': recorded / elapsed if elapsed else 0,
+                'lag_p50': percentile(lags, 50),
+                'lag_p95': percentile(lags, 95),
+                'lag_p99': percentile(lags, 99),
+                'lag_max': lags[-1] if lags else None,
+                'db_ms_per_message': self.db_seconds * 1000 / self.published if self.published else 0,
+                'statements': self.statements,
+            }
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def read_payloads(path):
+    ''' payloads of an exported file, JSON per line or a raw archive npz '''
+    if path.endswith('.npz'):
+        return [json.loads(c) for c in read_day(path)['content']]
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def ensure_loggers(payloads):
+    ''' create Tenant (by slug) and Logger (by sn) the payloads refer to but the database lacks '''
+    tenants = dict((t.slug, t) for t in Tenant.query.all())
+    known = set(sn for sn, in db.session.query(Logger.sn))
+    for raw in payloads:
+        slug, sn = raw['device'].split('/')[:2]
+        if sn in known:
+            continue
+        if slug not in tenants:
+            tenants[slug] = Tenant(nama=slug, slug=slug[:12])
+            db.session.add(tenants[slug])
+            db.session.flush()
+        db.session.add(Logger(sn=sn, tenant_id=tenants[slug].id))
+        known.add(sn)
+    db.session.commit()
+    registry.invalidate()
+
+
+def publish_all(broker, stats, payloads, speed):
+    ''' publish payloads paced on their sampling, `speed` times real time (0: no pacing) '''
+    first = payloads[0]['sampling']
+    started = time.monotonic()
+    for raw in payloads:
+        if speed:
+            delay = started + (raw['sampling'] - first) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        message = Message(command.MQTT_TOPICS, raw)
+        broker.publish(message)
+        stats.on_publish(raw, message.published_at)
+
+
+def print_progress(stats):
+    s = stats.summary()
+    lag = ' / '.join('-' if s[k] is None else f"{s[k]:.3f}" for k in ('lag_p50', 'lag_p95', 'lag_p99'))
+    print(f"{s['seconds']:.0f}s : {s['published']} published, {s['recorded']} recorded, "
+          f"{s['rows_per_second']:.1f} rows/s, lag p50/p95/p99 {lag} s, "
+          f"DB {s['db_ms_per_message']:.2f} ms/message")
+
+
+def replay_payloads(payloads, speed=0, batch_size=0, batch_age=BATCH_AGE):
+    ''' push payloads through on_mqtt_message via LocalBroker, return ReplayStats summary '''
+    payloads = sorted((p for p in payloads if p.get('device') and p.get('sampling')),
+                      key=lambda p: p['sampling'])
+    if not payloads:
+        return None
+    ensure_loggers(payloads)
+
+    stats = ReplayStats()
+    event.listen(db.engine, 'before_cursor_execute', stats.before_execute)
+    event.listen(db.engine, 'after_cursor_execute', stats.after_execute)
+    listeners.append(stats.on_record)
+    if batch_size:
+        command.INGEST_BUFFER = IngestBuffer(size=batch_size, age=batch_age).start()
+    broker = LocalBroker(command.on_mqtt_message).start()
+    publisher = threading.Thread(target=publish_all, args=(broker, stats, payloads, speed), daemon=True)
+    try:
+        publisher.start()
+        while publisher.is_alive():
+            publisher.join(REPORT_EVERY)
+            print_progress(stats)
+        while not broker.messages.empty():
+            time.sleep(REPORT_EVERY)
+            print_progress(stats)
+        broker.stop()
+        command.stop_ingest()
+    finally:
+        command.INGEST_BUFFER = None
+        listeners.remove(stats.on_record)
+        event.remove(db.engine, 'before_cursor_execute', stats.before_execute)
+        event.remove(db.engine, 'after_cursor_execute', stats.after_execute)
+    print_progress(stats)
+    return stats.summary()
+
+
+@app.cli.command()
+@click.argument('command_name', metavar='COMMAND')
+@click.option('-f', '--file', 'path', default='', help='File payload (JSON per baris atau arsip .npz)')
+@click.option('-s', '--start', default='', help='Awal received (YYYY-MM-DD)')
+@click.option('-e', '--end', default='', help='Akhir received (YYYY-MM-DD)')
+@click.option('-x', '--speed', default=0.0, help='Kelipatan waktu nyata, 0: secepatnya')
+@click.option('-b', '--batch-size', default=0, help='Replay dengan buffered ingest')
+@click.option('-o', '--output', default='', help='Tambahkan ringkasan (JSON) ke file ini')
+def replay(command_name, path, start, end, speed, batch_size, output):
+    ''' Replay (export / run) historical payloads through the MQTT listener '''
+    if command_name == 'export':
+        start = datetime.datetime.strptime(start, "%Y-%m-%d")
+        end = datetime.datetime.strptime(end, "%Y-%m-%d") + datetime.timedelta(days=1) if end \
+            else start + datetime.timedelta(days=1)
+        count = 0
+        with open(path or 'replay.jsonl', 'w') as f:
+            for raw in iter_raw(start, end):
+                f.write(json.dumps(raw.content) + '\n')
+                count += 1
+        print(f"Exported {count} payloads to {path or 'replay.jsonl'}")
+    elif command_name == 'run':
+        if not safe_database():
+            print(f"Refusing to replay into {db.engine.url!r}, use SQLite or a database named *bench* / *test*")
+            return
+        db.create_all()
+        summary = replay_payloads(read_payloads(path), speed=speed, batch_size=batch_size)
+        if summary and output:
+            summary.update({'file': path, 'speed': speed, 'batch_size': batch_size,
+                            'at': datetime.datetime.utcnow().isoformat()})
+            with open(output, 'a') as f:
+                f.write(json.dumps(summary) + '\n')
@@ -0,0 +1,110 @@
+import datetime
+import logging
+
+from sqlalchemy import event, func, select
+from sqlalchemy.exc import IntegrityError
+
+from apps import db
+from apps.models import Location, PeriodikHourly, ReportCache
+from apps.metrics import metrics
+
+REPORT_CACHE_SIZE = 1000  # entri, yang paling lama tidak dipakai dibuang
+WRITE_MARGIN = datetime.timedelta(seconds=60)  # transaksi ingest yang belum commit saat laporan dihitung
+
+cache_table = False  # True setelah tabel report_cache ditemukan
+
+
+def utc(time):
+    ''' naive UTC of an aware datetime, naive datetime is returned as is '''
+    if time.tzinfo is not None:
+        time = time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return time
+
+
+def has_cache_table():
+    ''' False until `flask migrate report-cache` is run, reports are then always computed '''
+    global cache_table
+    if not cache_table:
+        cache_table = db.engine.has_table(ReportCache.__tablename__)
+    return cache_table
+
+
+def modified_since(entry):
+    '''
+    True if an hourly rollup of the entry's tenant within its window was
+    written after the entry was computed (minus WRITE_MARGIN), i.e. a late
+    sample or a rebuild changed what the report was computed from
+    '''
+    locations = db.session.query(Location.id).filter(Location.tenant_id == entry.tenant_id)
+    modified = db.session.query(func.max(PeriodikHourly.modified_at)).filter(
+                    PeriodikHourly.location_id.in_(locations),
+                    PeriodikHourly.sampling > entry.window_start,
+                    PeriodikHourly.sampling < entry.window_end + datetime.timedelta(hours=1)).scalar()
+    return modified is not None and modified >= entry.created_at - WRITE_MARGIN
+
+
+def cached_report(tenant_id, kind, bucket, window, build):
+    '''
+    Return the aggregate result (JSON) of report `kind` of tenant at
+    `bucket` (report hour / day) from report_cache, or from build(), which
+    is then stored with `window` (start, end), the span of samples it was
+    computed from. Only data is cached, the caller renders the text so
+    relative times are always current. An entry whose hourly rollups were
+    written after it was computed is computed again; ingest itself never
+    touches report_cache.
+    '''
+    if not has_cache_table():
+        return build()
+    bucket = utc(bucket)
+    entry = ReportCache.query.filter_by(tenant_id=tenant_id, kind=kind, bucket=bucket).first()
+    if entry and not modified_since(entry):
+        metrics.inc("report_cache_hit")
+        entry.used_at = datetime.datetime.utcnow()
+        result = entry.result
+        db.session.commit()
+        return result
+
+    metrics.inc("report_cache_miss")
+    computed_at = datetime.datetime.utcnow()
+    result = build()
+    try:
+        if not entry:
+            entry = ReportCache(tenant_id=tenant_id, kind=kind, bucket=bucket)
+            db.session.add(entry)
+        entry.window_start = utc(window[0])
+        entry.window_end = utc(window[1])
+        entry.result = result
+        entry.created_at = computed_at
+        entry.used_at = computed_at
+        db.session.commit()
+        evict()
+    except IntegrityError:
+        # disimpan proses lain pada saat yang sama
+        db.session.rollback()
+    return result
+
+
+def evict(size=REPORT_CACHE_SIZE):
+    ''' keep only the `size` most recently used entries '''
+    keep = select([ReportCache.id]).order_by(ReportCache.used_at.desc()).limit(size).alias('keep')
+    ReportCache.query.filter(~ReportCache.id.in_(select([keep.c.id]))).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def invalidate_window(start, end):
+    ''' drop cached reports of every tenant overlapping start - end, after rebuilding rollups '''
+    if not has_cache_table():
+        return
+    ReportCache.query.filter(ReportCache.window_start <= end,
+                             ReportCache.window_end >= start).delete(synchronize_session=False)
+
+
+@event.listens_for(Location, 'after_insert')
+@event.listens_for(Location, 'after_update')
+@event.listens_for(Location, 'after_delete')
+def invalidate_location(mapper, connection, target):
+    ''' the location list of a tenant is part of every report result '''
+    if target.tenant_id and has_cache_table():
+        table = ReportCache.__table__
+        connection.execute(table.delete().where(table.c.tenant_id == target.tenant_id))
+        logging.debug(f"Location {target.id} changed, report cache of tenant {target.tenant_id} dropped")
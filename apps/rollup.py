@@ -0,0 +1,212 @@
+import click
+import datetime
+import logging
+import math
+
+from sqlalchemy import and_, bindparam, func, text
+
+from apps import app, db
+from apps.models import Location, Periodik, PeriodikHourly, PeriodikDaily
+from apps.reportcache import invalidate_window
+
+HOUR = datetime.timedelta(hours=1)
+DAY = datetime.timedelta(days=1)
+TICK = datetime.timedelta(microseconds=1)
+
+UPSERT = '''
+    INSERT INTO {t} (logger_sn, location_id, tenant_id, sampling, rain, rain_minute,
+                     samples, wlev_min, wlev_max, wlev_last, wlev_last_at, batt_min,
+                     last_sampling, slots, modified_at)
+    VALUES (:logger_sn, :location_id, :tenant_id, :sampling, :rain, :rain_minute,
+            :samples, :wlev_min, :wlev_max, :wlev_last, :wlev_last_at, :batt_min,
+            :last_sampling, :slots, :modified_at)
+    ON CONFLICT (logger_sn, sampling) DO UPDATE SET
+        rain = {t}.rain + excluded.rain,
+        rain_minute = {t}.rain_minute + excluded.rain_minute,
+        samples = {t}.samples + excluded.samples,
+        wlev_min = {least}(coalesce({t}.wlev_min, excluded.wlev_min), coalesce(excluded.wlev_min, {t}.wlev_min)),
+        wlev_max = {greatest}(coalesce({t}.wlev_max, excluded.wlev_max), coalesce(excluded.wlev_max, {t}.wlev_max)),
+        wlev_last = CASE WHEN {t}.wlev_last_at IS NULL OR excluded.wlev_last_at > {t}.wlev_last_at
+                         THEN coalesce(excluded.wlev_last, {t}.wlev_last) ELSE {t}.wlev_last END,
+        wlev_last_at = {greatest}(coalesce({t}.wlev_last_at, excluded.wlev_last_at), coalesce(excluded.wlev_last_at, {t}.wlev_last_at)),
+        batt_min = {least}(coalesce({t}.batt_min, excluded.batt_min), coalesce(excluded.batt_min, {t}.batt_min)),
+        last_sampling = {greatest}({t}.last_sampling, excluded.last_sampling),
+        slots = coalesce({t}.slots, 0) | excluded.slots,
+        location_id = excluded.location_id,
+        tenant_id = excluded.tenant_id,
+        modified_at = excluded.modified_at
+'''
+UPSERT_DATETIMES = ('sampling', 'wlev_last_at', 'last_sampling', 'modified_at')  # bind sebagai DateTime, bukan str
+
+
+def hour_bucket(sampling):
+    ''' end of the hour holding sampling, 07:05 .. 08:00 -> 08:00 '''
+    return (sampling - TICK).replace(minute=0, second=0, microsecond=0) + HOUR
+
+
+def day_bucket(sampling):
+    ''' end of the day holding sampling, 00:05 .. 24:00 -> next day 00:00 '''
+    return (sampling - TICK).replace(hour=0, minute=0, second=0, microsecond=0) + DAY
+
+
+def hour_slot(sampling):
+    ''' 5 minute slot (0 .. 11) of sampling within its hour bucket, slot i = (5i, 5i + 5] '''
+    seconds = (sampling - (hour_bucket(sampling) - HOUR)).total_seconds()
+    return min(11, max(0, math.ceil(seconds / 300) - 1))
+
+
+def day_slot(sampling):
+    ''' hour (0 .. 23) of sampling within its day bucket '''
+    seconds = (sampling - (day_bucket(sampling) - DAY)).total_seconds()
+    return min(23, max(0, math.ceil(seconds / 3600) - 1))
+
+
+def hourly_between(start, end):
+    ''' filter of hourly rollups holding the samples of start <= sampling <= end '''
+    return and_(PeriodikHourly.sampling >= hour_bucket(start),
+                PeriodikHourly.sampling < hour_bucket(end) + HOUR)
+
+
+def aggregate(rows, bucket, slot):
+    ''' return rollup rows of Periodik rows (dict) grouped by logger_sn, bucket(sampling) '''
+    now = datetime.datetime.utcnow()
+    result = {}
+    for row in rows:
+        key = (row['logger_sn'], bucket(row['sampling']))
+        agg = result.get(key)
+        if not agg:
+            agg = result[key] = {
+                'logger_sn': row['logger_sn'],
+                'location_id': row['location_id'],
+                'tenant_id': row['tenant_id'],
+                'sampling': key[1],
+                'rain': 0,
+                'rain_minute': 0,
+                'samples': 0,
+                'wlev_min': None,
+                'wlev_max': None,
+                'wlev_last': None,
+                'wlev_last_at': None,
+                'batt_min': None,
+                'last_sampling': row['sampling'],
+                'slots': 0,
+                'modified_at': now
+            }
+        agg['samples'] += 1
+        agg['slots'] |= 1 << slot(row['sampling'])
+        agg['last_sampling'] = max(agg['last_sampling'], row['sampling'])
+        if row['rain']:
+            agg['rain'] += row['rain']
+            agg['rain_minute'] += 5
+        if row['wlev'] is not None:
+            agg['wlev_min'] = row['wlev'] if agg['wlev_min'] is None else min(agg['wlev_min'], row['wlev'])
+            agg['wlev_max'] = row['wlev'] if agg['wlev_max'] is None else max(agg['wlev_max'], row['wlev'])
+            if agg['wlev_last_at'] is None or row['sampling'] > agg['wlev_last_at']:
+                agg['wlev_last'] = row['wlev']
+                agg['wlev_last_at'] = row['sampling']
+        if row['batt'] is not None:
+            agg['batt_min'] = row['batt'] if agg['batt_min'] is None else min(agg['batt_min'], row['batt'])
+    return list(result.values())
+
+
+def upsert_statement(table):
+    if db.session.get_bind().dialect.name == 'postgresql':
+        least, greatest = 'LEAST', 'GREATEST'
+    else:
+        least, greatest = 'MIN', 'MAX'
+    return text(UPSERT.format(t=table, least=least, greatest=greatest)).bindparams(
+                *[bindparam(name, type_=db.DateTime) for name in UPSERT_DATETIMES])
+
+
+def update_rollup(rows):
+    '''
+    Add newly recorded Periodik rows (dict) to the hourly and daily rollups.
+    Run inside the ingest transaction, only with rows that were actually
+    inserted so nothing is counted twice.
+    '''
+    rows = [row for row in rows if row.get('logger_sn')]
+    if not rows:
+        return
+    for model, bucket, slot in ((PeriodikHourly, hour_bucket, hour_slot), (PeriodikDaily, day_bucket, day_slot)):
+        db.session.execute(upsert_statement(model.__tablename__), aggregate(rows, bucket, slot))
+
+
+def rebuild_rollup(start, end):
+    '''
+    Recompute rollups of every day from start to end (date) out of periodik,
+    one day at a time. Return number of periodik rows read.
+    '''
+    columns = [Periodik.logger_sn, Periodik.location_id, Periodik.tenant_id,
+               Periodik.sampling, Periodik.rain, Periodik.wlev, Periodik.batt]
+    total = 0
+    day = datetime.datetime.combine(start, datetime.time())
+    while day.date() <= end:
+        day_end = day + DAY
+        db.session.query(PeriodikHourly).filter(
+                            PeriodikHourly.sampling > day,
+                            PeriodikHourly.sampling <= day_end).delete(synchronize_session=False)
+        db.session.query(PeriodikDaily).filter(
+                            PeriodikDaily.sampling == day_end).delete(synchronize_session=False)
+        query = db.session.query(*columns).filter(
+                            Periodik.sampling > day,
+                            Periodik.sampling <= day_end)
+        rows = [dict(zip(('logger_sn', 'location_id', 'tenant_id', 'sampling', 'rain', 'wlev', 'batt'), r))
+                for r in query]
+        update_rollup(rows)
+        invalidate_window(day, day_end)
+        db.session.commit()
+        total += len(rows)
+        print(f"{day.strftime('%Y-%m-%d')} : {len(rows)} periodik")
+        day = day_end
+    return total
+
+
+def daily_summary(location_ids, start, end):
+    '''
+    return {location_id: [(day, rain, rain_minute, samples)]} for each day
+    from start to end (date), read from periodik_daily
+    '''
+    start = datetime.datetime.combine(start, datetime.time()) + DAY
+    end = datetime.datetime.combine(end, datetime.time()) + DAY
+    query = db.session.query(
+                    PeriodikDaily.location_id,
+                    PeriodikDaily.sampling,
+                    func.sum(PeriodikDaily.rain),
+                    func.sum(PeriodikDaily.rain_minute),
+                    func.sum(PeriodikDaily.samples)).filter(
+                    PeriodikDaily.location_id.in_(location_ids),
+                    PeriodikDaily.sampling.between(start, end)).group_by(
+                    PeriodikDaily.location_id, PeriodikDaily.sampling).order_by(
+                    PeriodikDaily.sampling)
+    result = {}
+    for location_id, sampling, rain, rain_minute, samples in query:
+        result.setdefault(location_id, []).append(((sampling - DAY).date(), rain, rain_minute, samples))
+    return result
+
+
+def parse_date(value, default=None):
+    if not value:
+        return default
+    return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+
+
+@app.cli.command()
+@click.argument('command')
+@click.option('-s', '--start', default='', help='Tanggal awal (YYYY-MM-DD)')
+@click.option('-e', '--end', default='', help='Tanggal akhir (YYYY-MM-DD)')
+def rollup(command, start, end):
+    ''' Rollup (rebuild / daily) of periodik per hour and per day '''
+    today = datetime.date.today()
+    start = parse_date(start, today)
+    end = parse_date(end, start)
+    if command == 'rebuild':
+        total = rebuild_rollup(start, end)
+        logging.debug(f"Rollup rebuilt {start} - {end} from {total} periodik")
+    elif command == 'daily':
+        locations = Location.query.order_by(Location.tenant_id, Location.id).all()
+        summary = daily_summary([pos.id for pos in locations], start, end)
+        for pos in locations:
+            print(f"{pos.nama}")
+            for day, rain, rain_minute, samples in summary.get(pos.id, []):
+                print(f"  {day} : {round(rain or 0, 2)} mm, {rain_minute} menit, "
+                      f"{round(samples / 288 * 100, 2)}%")
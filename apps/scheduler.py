@@ -0,0 +1,125 @@
+import click
+import datetime
+import logging
+import threading
+
+from apps import app, db
+from apps.models import Tenant
+from apps.metrics import metrics
+from apps.command import periodik_report, periodik_count_report, rain_alert, setup_logging
+
+SCHEDULE = {
+    'periodik': '0 */2 * * *',  # curah hujan & TMA tiap 2 jam (waktu tenant)
+    'count': '0 7 * * *',  # kehadiran data kemarin
+    'warning': '0 * * * *',  # peringatan hujan lebat tiap jam
+}
+JOBS = {
+    'periodik': periodik_report,
+    'count': periodik_count_report,
+    'warning': rain_alert,
+}
+MISFIRE_GRACE = 600  # detik, jadwal yang terlambat lebih dari ini dilewati
+MAX_SLEEP = 60  # detik, tenant & timezone dibaca ulang paling lama tiap ini
+
+
+class Scheduler:
+    '''
+    Run the telegram reports in one warm process instead of a cron spawned
+    `flask telegram` per tick. Every (job, tenant) gets its next run from
+    SCHEDULE in the tenant timezone; due tenants of a job are reported in
+    one call with the scheduled time, so a late run still covers the right
+    window. Runs later than `grace` seconds are counted as missed and
+    skipped, runs ending after the next due time of the job as overrun.
+    The process keeps its database pool and Telegram connection between
+    runs. Schedules start from now, a run due before start is not sent.
+    '''
+
+    def __init__(self, schedule=SCHEDULE, jobs=JOBS, grace=MISFIRE_GRACE):
+        self.schedule = schedule
+        self.jobs = jobs
+        self.grace = grace
+        self.next_run = {}  # (job, tenant_id, tz): aware datetime
+        self.stopped = threading.Event()
+
+    def next_time(self, job, tz, after):
+        ''' next run of job after `after` (aware), in timezone tz '''
+        from croniter import croniter
+        import pytz
+
+        return croniter(self.schedule[job], after.astimezone(pytz.timezone(tz))).get_next(datetime.datetime)
+
+    def due(self, now):
+        ''' return {(job, scheduled time): [Tenant]} due at now (aware), moving their next run '''
+        result = {}
+        next_run = {}
+        for ten in Tenant.query.order_by(Tenant.id):
+            tz = ten.timezone or "Asia/Jakarta"
+            for job in self.schedule:
+                key = (job, ten.id, tz)
+                at = self.next_run.get(key)
+                if at is None or at > now:
+                    next_run[key] = at or self.next_time(job, tz, now)
+                    continue
+                next_run[key] = self.next_time(job, tz, now)
+                late = (now - at).total_seconds()
+                if late > self.grace:
+                    metrics.inc(f"job_{job}_missed")
+                    logging.debug(f"Scheduler : {job} of {ten.nama} at {at} missed, {late:.0f} s late")
+                    continue
+                result.setdefault((job, at.astimezone(datetime.timezone.utc)), []).append(ten)
+        self.next_run = next_run
+        return result
+
+    def run_job(self, job, at, tenants):
+        ''' run job for tenants as if at (aware) in server local time, as `flask telegram` does '''
+        local = at.astimezone().replace(tzinfo=None)
+        logging.debug(f"Scheduler : {job} {local} for {', '.join(ten.nama for ten in tenants)}")
+        try:
+            with metrics.timer(f"job_{job}"):
+                self.jobs[job](local, tenants)
+        except Exception as e:
+            db.session.rollback()
+            logging.debug(f"Scheduler : {job} Error : {e}")
+        finished = datetime.datetime.now(datetime.timezone.utc)
+        tz = tenants[0].timezone or "Asia/Jakarta"
+        if finished > self.next_time(job, tz, at):
+            metrics.inc(f"job_{job}_overrun")
+            logging.debug(f"Scheduler : {job} of {at} overrun, finished {finished}")
+
+    def sleep_time(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        upcoming = [(at - now).total_seconds() for at in self.next_run.values()]
+        return max(1, min(upcoming + [MAX_SLEEP]))
+
+    def run(self):
+        with app.app_context():
+            while not self.stopped.is_set():
+                try:
+                    due = self.due(datetime.datetime.now(datetime.timezone.utc))
+                    for job, at in sorted(due, key=lambda k: (k[1], k[0])):
+                        self.run_job(job, at, due[(job, at)])
+                    if due:
+                        metrics.dump('scheduler')
+                except Exception as e:
+                    db.session.rollback()
+                    logging.debug(f"Scheduler Error : {e}")
+                finally:
+                    db.session.remove()
+                self.stopped.wait(self.sleep_time())
+
+    def stop(self, message=None, code=None):
+        self.stopped.set()
+
+
+@app.cli.command()
+@click.argument('command')
+def scheduler(command):
+    ''' Run telegram reports (periodik, count, warning) from one long running process '''
+    import daemonocle
+
+    setup_logging()
+    worker = Scheduler()
+    daemon = daemonocle.Daemon(worker=worker.run,
+                              shutdown_callback=worker.stop,
+                              pidfile='scheduler.pid')
+    daemon.do_action(command)
@@ -0,0 +1,177 @@
+import glob
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+
+from apps import app, db
+from apps.ingest import record_batch
+
+SEGMENT_SIZE = 64 * 1024 * 1024  # byte per file segmen
+DRAIN_BATCH = 500
+FSYNC_EVERY = 1  # detik
+RETRY_EVERY = 5  # detik, saat database tidak tersedia
+
+
+class Spool:
+    '''
+    Append-only payload log on disk. The listener appends every payload
+    (one JSON line) before it is acknowledged; a drain thread reads the
+    segments through mmap, records them with record_batch and only then
+    moves the checkpoint, up to the last payload before the first one the
+    database failed, so a database outage leaves a backlog instead of
+    lost samples. Recording is insert-or-skip, a batch replayed after a
+    crash between record and checkpoint is harmless.
+    '''
+
+    def __init__(self, path, segment_size=SEGMENT_SIZE, batch=DRAIN_BATCH):
+        self.path = path
+        self.segment_size = segment_size
+        self.batch = batch
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        os.makedirs(path, exist_ok=True)
+        segments = self.segments()
+        self.seq = segments[-1] if segments else 0
+        self.file = open(self.segment_path(self.seq), 'ab')
+        self.synced_at = time.monotonic()
+
+    def segment_path(self, seq):
+        return os.path.join(self.path, f"spool-{seq:012d}.log")
+
+    def segments(self):
+        return sorted(int(os.path.basename(p)[6:18]) for p in glob.glob(os.path.join(self.path, 'spool-*.log')))
+
+    def append(self, raw):
+        line = json.dumps(raw, separators=(',', ':')).encode('utf-8') + b'\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+            now = time.monotonic()
+            if now - self.synced_at >= FSYNC_EVERY:
+                os.fsync(self.file.fileno())
+                self.synced_at = now
+            if self.file.tell() >= self.segment_size:
+                os.fsync(self.file.fileno())
+                self.file.close()
+                self.seq += 1
+                self.file = open(self.segment_path(self.seq), 'ab')
+
+    def read_checkpoint(self):
+        try:
+            with open(os.path.join(self.path, 'checkpoint')) as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (OSError, ValueError):
+            segments = self.segments()
+            return (segments[0] if segments else 0), 0
+
+    def write_checkpoint(self, seq, offset):
+        path = os.path.join(self.path, 'checkpoint')
+        with open(path + '.tmp', 'w') as f:
+            f.write(f"{seq} {offset}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    def read(self, seq, offset):
+        '''
+        return ([payload], [offset after each payload], next offset) of
+        complete lines in segment seq from offset
+        '''
+        path = self.segment_path(seq)
+        if not os.path.exists(path) or os.path.getsize(path) <= offset:
+            return [], [], offset
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            end = offset
+            payloads = []
+            ends = []
+            while len(payloads) < self.batch:
+                nl = m.find(b'\n', end)
+                if nl < 0:
+                    break
+                line = m[end:nl]
+                end = nl + 1
+                try:
+                    payloads.append(json.loads(line))
+                    ends.append(end)
+                except ValueError as e:
+                    logging.debug(f"Spool {seq}:{end} invalid line skipped : {e}")
+        return payloads, ends, end
+
+    def backlog(self):
+        ''' bytes appended but not yet recorded '''
+        seq, offset = self.read_checkpoint()
+        total = 0
+        for s in self.segments():
+            if s >= seq:
+                total += os.path.getsize(self.segment_path(s)) - (offset if s == seq else 0)
+        return total
+
+    def database_ok(self):
+        try:
+            db.session.execute('SELECT 1')
+            db.session.rollback()
+            return True
+        except Exception as e:
+            db.session.rollback()
+            logging.debug(f"Spool : database not available ({e})")
+            return False
+
+    def drain_once(self):
+        ''' record one batch from the checkpoint, return number of payloads drained '''
+        seq, offset = self.read_checkpoint()
+        payloads, ends, end = self.read(seq, offset)
+        if not payloads:
+            with self.lock:
+                current = self.seq
+            if seq < current and end == offset:
+                # segmen selesai dan sudah tidak ditulis, lanjut ke berikutnya
+                os.remove(self.segment_path(seq))
+                self.write_checkpoint(seq + 1, 0)
+            elif end != offset:
+                self.write_checkpoint(seq, end)
+            return 0
+        result = record_batch(payloads)
+        for sn, error in result['errors']:
+            logging.debug(f"({sn}), Exception : {error}")
+        if result['failed']:
+            # sisa batch mulai payload pertama yang gagal diulang setelah database kembali
+            first = result['failed'][0]
+            if first:
+                self.write_checkpoint(seq, ends[first - 1])
+            return first
+        self.write_checkpoint(seq, end)
+        return len(payloads)
+
+    def run(self):
+        with app.app_context():
+            while not self.stopped.is_set():
+                if not self.database_ok():
+                    self.stopped.wait(RETRY_EVERY)
+                    continue
+                try:
+                    if not self.drain_once():
+                        self.stopped.wait(0.5)
+                except Exception as e:
+                    logging.debug(f"Spool drain Error : {e}")
+                    self.stopped.wait(RETRY_EVERY)
+            db.session.remove()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='spool-drain', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        ''' stop draining, what is left stays in the spool for the next start '''
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
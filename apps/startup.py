@@ -0,0 +1,45 @@
+import click
+import os
+import subprocess
+import sys
+import time
+
+from apps import app
+
+
+def import_times(module):
+    ''' return (seconds, [(cumulative us, self us, module)]) of `import module` in a fresh interpreter '''
+    env = dict(os.environ, FLASK_RUN_FROM_CLI='true')
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                          env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    seconds = time.perf_counter() - started
+    if proc.returncode:
+        raise click.ClickException(proc.stderr.strip().splitlines()[-1])
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), int(self_us), name.strip()))
+    return seconds, rows
+
+
+@app.cli.command('startup-profile')
+@click.option('-m', '--module', default='apps', help='Modul yang diimpor')
+@click.option('-n', '--top', default=15, help='Jumlah baris per tabel')
+def startup_profile(module, top):
+    ''' Show import time per package and per apps module, as a `flask` command pays it '''
+    seconds, rows = import_times(module)
+    packages = {}
+    for cumulative, self_us, name in rows:
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+    print(f"import {module} : {seconds * 1000:.0f} ms (interpreter start included)")
+    print("\n== package (self time, ms)")
+    for package, us in sorted(packages.items(), key=lambda p: -p[1])[:top]:
+        print(f"  {package:<30} {us / 1000:8.1f}")
+    print("\n== apps modules (cumulative / self, ms)")
+    own = [r for r in rows if r[2] == 'apps' or r[2].startswith('apps.')]
+    for cumulative, self_us, name in sorted(own, reverse=True)[:top]:
+        print(f"  {name:<30} {cumulative / 1000:8.1f} {self_us / 1000:8.1f}")
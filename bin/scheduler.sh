@@ -0,0 +1,5 @@
+#!/bin/bash
+
+cd /opt/primabase
+source .env
+flask scheduler start
@@ -10,6 +10,10 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ['DATABASE_URL']
     TELEGRAM_TEST_ID = os.environ['TELEGRAM_TEST_ID']
     PRINUSBOT_TOKEN = os.environ['PRINUSBOT_TOKEN']
+    TELEGRAM_TRANSPORT = os.environ.get('TELEGRAM_TRANSPORT', 'bot')  # bot, log, memory
+    STATS_PORT = int(os.environ.get('STATS_PORT', 5055))
+    STATS_DIR = os.environ.get('STATS_DIR', '/tmp')
+    LIVE_REDIS_URL = os.environ.get('LIVE_REDIS_URL')  # listener -> web, update SocketIO
 
 
 class ProductionConfig(Config):
@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+# konfigurasi uji: SQLite di direktori sementara, telegram tidak dikirim
+os.environ.setdefault('APP_SETTINGS', 'config.TestingConfig')
+os.environ.setdefault('SECRET_KEY', 'test')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'prinus.db')}")
+os.environ.setdefault('TELEGRAM_TEST_ID', '1')
+os.environ.setdefault('PRINUSBOT_TOKEN', 'test')
+os.environ.setdefault('TELEGRAM_TRANSPORT', 'memory')
+os.environ['FLASK_RUN_FROM_CLI'] = 'true'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from apps import app, db  # noqa: E402
+
+
+@pytest.fixture
+def database():
+    ''' empty tables in an app context, dropped after the test '''
+    from apps.registry import loggers
+
+    with app.app_context():
+        db.create_all()
+        loggers.invalidate()
+        yield db
+        db.session.remove()
+        db.drop_all()
+        loggers.invalidate()
+
+
+@pytest.fixture
+def fleet(database):
+    ''' tenant 1 (slug ten) with location 1 and logger L1 '''
+    from apps.models import Location, Logger, Tenant
+
+    database.session.add(Tenant(id=1, nama='Tenant', slug='ten'))
+    database.session.add(Location(id=1, nama='Lokasi', tenant_id=1))
+    database.session.add(Logger(sn='L1', tenant_id=1, location_id=1))
+    database.session.commit()
+    return database
+
+
+def payload(sn, sampling, **values):
+    ''' MQTT payload of logger sn at sampling (naive local datetime) '''
+    epoch = int(time.mktime(sampling.timetuple()))
+    raw = {'device': f"ten/{sn}/0", 'sampling': epoch, 'up_since': epoch, 'time_set_at': epoch}
+    raw.update(values)
+    return raw
@@ -0,0 +1,61 @@
+import datetime
+
+from apps.alert import AlertEngine, LocationState
+
+T0 = datetime.datetime(2024, 1, 1, 7)
+MINUTE = datetime.timedelta(minutes=1)
+
+
+def feed(engine, state, samples):
+    ''' add (minute, rain, wlev) samples, return messages of each evaluate '''
+    messages = []
+    for minute, rain, wlev in samples:
+        if state.add(T0 + minute * MINUTE, rain, wlev):
+            messages.append(engine.evaluate('A', state))
+    return messages
+
+
+def test_duplicate_sampling_ignored():
+    state = LocationState('A', 1)
+    assert state.add(T0, 5, None)
+    assert not state.add(T0, 5, None)
+    assert state.rain_sum == 5
+
+
+def test_rain_window_slides():
+    state = LocationState('A', 1)
+    state.add(T0, 5, None)
+    state.add(T0 + 30 * MINUTE, 3, None)
+    state.add(T0 + 61 * MINUTE, 1, None)
+    assert state.rain_sum == 4
+
+
+def test_heavy_rain_alerts_once_until_cleared():
+    engine = AlertEngine()
+    state = LocationState('A', 1)
+    messages = feed(engine, state, [(0, 6, None), (5, 6, None), (10, 1, None)])
+    assert [len(m) for m in messages] == [0, 1, 0]
+    assert state.rain_level == 1
+    # 7 mm dalam window, masih di atas 10 * CLEAR_RATIO
+    assert feed(engine, state, [(61, 0, None)]) == [[]]
+    assert state.rain_level == 1
+    # 1 mm, level kembali normal
+    assert feed(engine, state, [(66, 0, None)]) == [[]]
+    assert state.rain_level == 0
+    messages = feed(engine, state, [(80, 11, None)])
+    assert [len(m) for m in messages] == [1]
+
+
+def test_wlev_rise_alerts_once_until_cleared():
+    engine = AlertEngine()
+    state = LocationState('A', 1)
+    messages = feed(engine, state, [(0, None, 100), (5, None, 160), (10, None, 170)])
+    assert [len(m) for m in messages] == [0, 1, 0]
+    assert state.rising
+    # naik 30 cm dalam window, masih di atas 50 * CLEAR_RATIO
+    assert feed(engine, state, [(61, None, 190)]) == [[]]
+    assert state.rising
+    assert feed(engine, state, [(70, None, 200)]) == [[]]
+    assert not state.rising
+    messages = feed(engine, state, [(80, None, 260)])
+    assert [len(m) for m in messages] == [1]
@@ -0,0 +1,26 @@
+import datetime
+
+import numpy as np
+
+from apps.arrival import SLOT, SLOTS, missing_intervals
+
+START = datetime.datetime(2024, 1, 1)
+
+
+def test_missing_intervals_full_day():
+    assert missing_intervals(np.ones(SLOTS, dtype=bool), START) == []
+
+
+def test_missing_intervals_runs():
+    bitmap = np.ones(SLOTS, dtype=bool)
+    bitmap[:2] = False
+    bitmap[120:132] = False
+    bitmap[-1] = False
+    assert missing_intervals(bitmap, START) == [
+        (START, START + 2 * SLOT),
+        (START + 120 * SLOT, START + 132 * SLOT),
+        (START + (SLOTS - 1) * SLOT, START + SLOTS * SLOT)]
+
+
+def test_missing_intervals_empty_day():
+    assert missing_intervals(np.zeros(SLOTS, dtype=bool), START) == [(START, START + SLOTS * SLOT)]
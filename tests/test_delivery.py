@@ -0,0 +1,40 @@
+from apps.delivery import MemoryTransport, TelegramQueue, split_message
+
+
+def test_short_message_is_one_part():
+    assert split_message("halo\ndunia") == ["halo\ndunia"]
+    assert split_message("") == [""]
+
+
+def test_split_on_line_breaks():
+    text = "aaaa\nbbbb\ncccc\n"
+    parts = split_message(text, limit=10)
+    assert parts == ["aaaa\nbbbb\n", "cccc\n"]
+    assert ''.join(parts) == text
+
+
+def test_long_line_is_cut():
+    text = "x" * 25 + "\nyy"
+    parts = split_message(text, limit=10)
+    assert all(len(p) <= 10 for p in parts)
+    assert ''.join(parts) == text
+
+
+def test_long_lived_queue_keeps_recent_results():
+    transport = MemoryTransport(fail=[3])
+    outbox = TelegramQueue(transport=transport, per_chat=0, per_second=1000, keep=2)
+    for i in range(5):
+        outbox.send(1, f"pesan {i}")
+    outbox.send(3, "gagal")
+    outbox.send(None, "tanpa chat")
+    results = outbox.close()
+    assert len(results) == 2
+    assert (outbox.sent, outbox.failed) == (5, 2)
+    assert [text for chat_id, text, parse_mode in transport.sent] == [f"pesan {i}" for i in range(5)]
+
+
+def test_one_shot_queue_keeps_all_results():
+    outbox = TelegramQueue(transport=MemoryTransport(), per_chat=0, per_second=1000)
+    for i in range(5):
+        outbox.send(i + 1, "laporan")
+    assert [r.chat_id for r in sorted(outbox.close())] == [1, 2, 3, 4, 5]
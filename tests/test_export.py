@@ -0,0 +1,61 @@
+import base64
+import datetime
+import json
+
+from apps import app
+from apps.export import COLUMNS, iter_periodik
+from apps.models import Periodik, Tenant, Users
+
+T0 = datetime.datetime(2024, 1, 1, 7, 5)
+MINUTE = datetime.timedelta(minutes=5)
+
+
+def test_iter_periodik_keyset_pages(database):
+    for i in range(7):
+        for sn in ('A', 'B'):
+            database.session.add(Periodik(logger_sn=sn, sampling=T0 + i * MINUTE, rain=i))
+    database.session.add(Periodik(logger_sn='A', sampling=T0 + 7 * MINUTE))  # di luar range
+    database.session.commit()
+    expected = [(r.id, r.sampling) for r in Periodik.query.filter(Periodik.sampling < T0 + 7 * MINUTE)
+                .order_by(Periodik.sampling, Periodik.id)]
+
+    # halaman 3 baris, sampling yang sama terpotong di antara dua halaman
+    rows = list(iter_periodik(T0, T0 + 7 * MINUTE, page=3))
+    assert [(r[0], r[1]) for r in rows] == expected
+    assert len(rows[0]) == len(COLUMNS)
+
+    after = (rows[4][1], rows[4][0])
+    assert [r[0] for r in iter_periodik(T0, T0 + 7 * MINUTE, after=after, page=3)] == [r[0] for r in expected[5:]]
+    assert [r[0] for r in iter_periodik(T0, T0 + 7 * MINUTE, logger_sn='B', page=2)] == \
+        [r.id for r in Periodik.query.filter_by(logger_sn='B').order_by(Periodik.sampling)]
+    assert list(iter_periodik(T0, T0 + 7 * MINUTE, page=14)) == rows
+
+
+def basic_auth(username, password='rahasia'):
+    token = base64.b64encode(f"{username}:{password}".encode()).decode()
+    return {'Authorization': f"Basic {token}"}
+
+
+def test_export_limited_to_user_tenant(database):
+    for id, slug in ((1, 'satu'), (2, 'dua')):
+        database.session.add(Tenant(id=id, nama=slug, slug=slug))
+        database.session.add(Periodik(logger_sn=f"L{id}", tenant_id=id, sampling=T0, rain=id))
+    for username, tenant_id in (('admin', None), ('satu', 1)):
+        user = Users(username=username, tenant_id=tenant_id)
+        user.set_password('rahasia')
+        database.session.add(user)
+    database.session.commit()
+    client = app.test_client()
+
+    def export(username, query='', password='rahasia'):
+        res = client.get(f"/api/periodik?start=2024-01-01&format=ndjson{query}", headers=basic_auth(username, password))
+        return res.status_code, [json.loads(line)['tenant_id'] for line in res.get_data(as_text=True).splitlines()
+                                 if res.status_code == 200]
+
+    assert export('admin') == (200, [1, 2])
+    assert export('admin', '&tenant=dua') == (200, [2])
+    # user satu tenant hanya mendapat data tenantnya
+    assert export('satu') == (200, [1])
+    assert export('satu', '&tenant=satu') == (200, [1])
+    assert export('satu', '&tenant=dua')[0] == 403
+    assert export('satu', password='salah')[0] == 401
@@ -0,0 +1,36 @@
+import datetime
+import functools
+
+from apps import app, command
+from apps.archive import iter_raw
+from apps.ingest import insert_ignore, raw_row, record_batch
+from apps.models import Logger, Periodik, PeriodikHourly, Raw
+from conftest import payload
+
+T0 = datetime.datetime(2024, 1, 1, 7, 5)
+MINUTE = datetime.timedelta(minutes=5)
+RECEIVED = datetime.datetime(2024, 1, 1, 10)
+
+
+def test_fix_rain_recomputes_and_inserts(fleet, monkeypatch, tmp_path):
+    raws = [payload('L1', T0 + i * MINUTE, tick=tick) for i, tick in enumerate((1, 0, 3, 2, 5))]
+    # periodik tercatat dengan tipp_fac bawaan (0.2), yang terakhir hilang
+    record_batch(raws[:-1], is_new=False)
+    insert_ignore(Raw.__table__, [raw_row(raw, RECEIVED) for raw in raws])
+    Logger.query.filter_by(sn='L1').one().tipp_fac = 0.5
+    fleet.session.commit()
+
+    monkeypatch.setattr(command, 'setup_logging', lambda: None)
+    monkeypatch.setitem(app.config, 'RAW_ARCHIVE_DIR', str(tmp_path))
+    # halaman Raw lebih kecil dari chunk, commit di antara halaman
+    monkeypatch.setattr(command, 'iter_raw', functools.partial(iter_raw, page=2))
+    monkeypatch.setattr(command, 'FIX_RAIN_CHUNK', 3)
+    result = app.test_cli_runner().invoke(args=['fix-rain', '-s', '2024-01-01'])
+    assert result.exit_code == 0, result.output
+    assert "5 raw : 4 updated, 1 inserted" in result.output
+
+    fleet.session.expire_all()
+    assert [p.rain for p in Periodik.query.order_by(Periodik.sampling)] == [0.5, None, 1.5, 1.0, 2.5]
+    # rollup dihitung ulang dari rain yang baru
+    hourly = PeriodikHourly.query.one()
+    assert (hourly.rain, hourly.samples) == (5.5, 5)
@@ -0,0 +1,104 @@
+import datetime
+import time
+
+from apps.arrival import SLOT
+from apps.gapfill import LocalPrinus, Request, fetch_gaps, merge_ranges, plan_requests
+from apps.migrate import MIGRATIONS
+from apps.models import FetchCursor, Location, Logger, Periodik, PeriodikHourly, Tenant
+from apps.rollup import DAY
+
+START = datetime.datetime(2024, 1, 1)
+HOUR = datetime.timedelta(hours=1)
+FULL = 0xfff  # 12 slot 5 menit
+
+
+def at(hour, minute=0):
+    return START + hour * HOUR + datetime.timedelta(minutes=minute)
+
+
+def test_merge_ranges():
+    assert merge_ranges([]) == []
+    ranges = [(at(1), at(2)), (at(2, 20), at(3)), (at(5), at(6)), (at(5, 30), at(5, 40))]
+    assert merge_ranges(ranges, slack=6 * SLOT) == [(at(1), at(3)), (at(5), at(6))]
+    assert merge_ranges(ranges, slack=SLOT) == [(at(1), at(2)), (at(2, 20), at(3)), (at(5), at(6))]
+
+
+def hourly(database, sn, days, empty=()):
+    ''' rollup per jam sn, semua slot terisi kecuali jam di `empty` '''
+    for hour in range(days * 24):
+        database.session.add(PeriodikHourly(logger_sn=sn, sampling=START + (hour + 1) * HOUR,
+                                            slots=0 if hour in empty else FULL))
+    database.session.commit()
+
+
+def test_plan_requests(database):
+    hourly(database, 'A', 2, empty=(10, 11, 23, 24))
+    hourly(database, 'B', 2)
+    now = START + datetime.timedelta(days=3)
+    planned, complete = plan_requests(['A', 'B'], START, 2, now, {})
+    # celah 23:00 - 01:00 dipotong di pergantian hari, satu request per hari
+    assert planned == [Request('A', '2024/01/01', [(at(10), at(12)), (at(23), at(24))]),
+                       Request('A', '2024/01/02', [(at(24), at(25))])]
+    assert complete == 1
+
+
+def test_plan_requests_cursor_and_lag(database):
+    hourly(database, 'A', 1, empty=(10, 20))
+    now = START + datetime.timedelta(days=2)
+    # data sebelum cursor sudah diminta, tidak diminta lagi
+    planned, complete = plan_requests(['A'], START, 1, now, {'A': at(12)})
+    assert planned == [Request('A', '2024/01/01', [(at(20), at(21))])]
+    # slot yang lebih baru dari now - lag masih bisa datang lewat MQTT
+    planned, complete = plan_requests(['A'], START, 1, at(20, 10), {})
+    assert planned == [Request('A', '2024/01/01', [(at(10), at(11))])]
+    assert plan_requests(['A'], START, 1, START, {}) == ([], 1)
+
+
+class FlakyPrinus(LocalPrinus):
+    ''' LocalPrinus failing every call for one day '''
+
+    def __init__(self, payloads, fail):
+        super().__init__(payloads)
+        self.fail = fail
+
+    def get(self, url, timeout=None):
+        if self.fail and f"sampling={self.fail}" in url:
+            raise IOError("503 Service Unavailable")
+        return super().get(url, timeout=timeout)
+
+
+def fleet(database, first, days):
+    ''' logger G1 with a payload every 5 minutes for `days` days from first '''
+    database.session.add(Tenant(id=1, nama='Tenant', slug='ten'))
+    database.session.add(Location(id=1, nama='Lokasi', tenant_id=1))
+    database.session.add(Logger(sn='G1', tenant_id=1, location_id=1))
+    database.session.commit()
+    epoch = int(time.mktime(first.timetuple()))
+    return [{'device': 'ten/G1/0', 'sampling': epoch + i * 300, 'up_since': epoch, 'time_set_at': epoch, 'tick': 1}
+            for i in range(1, days * 288 + 1)]
+
+
+def test_fetch_gaps_failed_day_is_asked_again(database):
+    first = datetime.datetime(2026, 10, 1)
+    payloads = fleet(database, first, 3)
+    now = first + datetime.timedelta(days=4)
+    day_one = Periodik.query.filter(Periodik.sampling > first, Periodik.sampling < first + DAY)
+
+    summary = fetch_gaps(['G1'], first, days=3, workers=2, session=FlakyPrinus(payloads, '2026/10/01'), now=now)
+    assert summary['failed'] == ['G1']
+    assert day_one.count() == 0
+    # cursor berhenti di awal hari yang gagal
+    assert FetchCursor.query.get('G1').fetched_until <= first
+
+    session = FlakyPrinus(payloads, None)
+    summary = fetch_gaps(['G1'], first, days=3, workers=2, session=session, now=now)
+    assert summary['failed'] == []
+    assert day_one.count() == 287
+    assert FetchCursor.query.get('G1').fetched_until > first + 2 * DAY
+
+
+def test_fetch_cursor_migration(database):
+    FetchCursor.__table__.drop(database.engine)
+    MIGRATIONS['fetch-cursor']()
+    assert FetchCursor.query.count() == 0
+    MIGRATIONS['fetch-cursor']()  # tabel sudah ada
@@ -0,0 +1,114 @@
+import datetime
+import zlib
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from apps import ingest
+from apps.ingest import IngestPool, get_sn, insert_ignore, listeners, record_batch
+from apps.models import Logger, Periodik, Raw
+from conftest import payload
+
+T0 = datetime.datetime(2024, 1, 1, 7, 5)
+MINUTE = datetime.timedelta(minutes=5)
+
+
+def row(sn, i):
+    return {'logger_sn': sn, 'sampling': T0 + i * MINUTE, 'rain': 0.2}
+
+
+def test_insert_ignore_dedupes(database):
+    table = Periodik.__table__
+    keys = ('logger_sn', 'sampling')
+    inserted = insert_ignore(table, [row('A', 0), row('A', 1), row('A', 0)], keys=keys)
+    assert [(r['logger_sn'], r['sampling']) for r in inserted] == [('A', T0), ('A', T0 + MINUTE)]
+    database.session.commit()
+
+    # yang sudah ada di tabel tidak dimasukkan lagi, baris lain tetap masuk
+    inserted = insert_ignore(table, [row('A', 1), row('B', 1), row('A', 2)], keys=keys)
+    assert [(r['logger_sn'], r['sampling']) for r in inserted] == [('B', T0 + MINUTE), ('A', T0 + 2 * MINUTE)]
+    database.session.commit()
+    assert Periodik.query.count() == 4
+    assert insert_ignore(table, [], keys=keys) == []
+
+
+def test_ingest_pool_partitions_by_logger():
+    pool = IngestPool(3)
+    sns = ('A1', 'B2', 'C3', 'D4', 'E5')
+    try:
+        for i in range(4):
+            for sn in sns:
+                pool.add({'device': f"tenant/{sn}/1", 'sampling': i})
+        pool.add({'sampling': 9})  # tanpa device ke queue kunci kosong
+        received = {}
+        for index, queue in enumerate(pool.queues):
+            size = queue.qsize()
+            for n in range(size):
+                raw = queue.get(timeout=5)
+                key = get_sn(raw) if raw.get('device') else ''
+                received.setdefault(key, []).append((index, raw['sampling']))
+        # satu logger selalu di worker yang sama, urutannya tetap
+        for sn in sns:
+            index = zlib.crc32(sn.encode('utf-8')) % 3
+            assert received[sn] == [(index, i) for i in range(4)]
+        assert received[''] == [(zlib.crc32(b'') % 3, 9)]
+    finally:
+        for queue in pool.queues:
+            queue.close()
+
+
+@pytest.fixture
+def notified():
+    ''' rows handed to the ingest listeners '''
+    rows = []
+    listeners.append(rows.extend)
+    yield rows
+    listeners.remove(rows.extend)
+
+
+def test_record_batch_isolates_bad_payloads(fleet, notified):
+    fleet.session.add(Logger(sn='NT'))
+    fleet.session.commit()
+    raws = [payload('L1', T0, tick=1), payload('L1', T0 + MINUTE), payload('L1', T0, tick=1),
+            payload('XX', T0), {'sampling': 1}, payload('NT', T0)]
+    result = record_batch(raws)
+    assert (result['recorded'], result['duplicate'], result['failed']) == (2, 1, [])
+    assert sorted(str(sn) for sn, error in result['errors']) == ['NT', 'None', 'XX']
+    assert Periodik.query.count() == 2 and Raw.query.count() == 2
+    assert [row['sampling'] for row in notified] == [T0, T0 + MINUTE]
+
+    result = record_batch(raws[:2])
+    assert (result['recorded'], result['duplicate']) == (0, 2)
+    assert len(notified) == 2
+
+
+def test_record_batch_falls_back_to_savepoints(fleet, notified, monkeypatch):
+    update_rollup = ingest.update_rollup
+
+    def failing_rollup(rows):
+        if any(row['temp'] == 99 for row in rows):
+            raise ValueError("rollup rusak")
+        update_rollup(rows)
+    monkeypatch.setattr(ingest, 'update_rollup', failing_rollup)
+
+    raws = [payload('L1', T0), payload('L1', T0 + MINUTE, temperature=99), payload('L1', T0 + 2 * MINUTE)]
+    result = record_batch(raws)
+    # hanya baris yang rusak yang hilang, bukan seluruh batch
+    assert (result['recorded'], result['failed']) == (2, [])
+    assert result['errors'][0][0] == 'L1' and 'rollup rusak' in result['errors'][0][1]
+    assert sorted(p.sampling for p in Periodik.query) == [T0, T0 + 2 * MINUTE]
+    assert [row['sampling'] for row in notified] == [T0, T0 + 2 * MINUTE]
+
+
+def test_record_batch_reports_database_failures(fleet, monkeypatch):
+    update_rollup = ingest.update_rollup
+
+    def failing_rollup(rows):
+        if any(row['temp'] == 99 for row in rows):
+            raise OperationalError('UPDATE', {}, Exception('database is locked'))
+        update_rollup(rows)
+    monkeypatch.setattr(ingest, 'update_rollup', failing_rollup)
+
+    result = record_batch([payload('L1', T0), payload('L1', T0 + MINUTE, temperature=99)])
+    # index payload yang boleh dikirim ulang
+    assert (result['recorded'], result['failed']) == (1, [1])
@@ -0,0 +1,43 @@
+import datetime
+
+from apps.ingest import record_batch
+from apps.latest import get_latest, rebuild_latest
+from apps.models import Location, Logger, Periodik
+from conftest import payload
+
+T0 = datetime.datetime(2024, 1, 1, 7, 5)
+MINUTE = datetime.timedelta(minutes=5)
+
+
+def pointers():
+    logger = Logger.query.filter_by(sn='L1').one()
+    location = Location.query.get(1)
+    return (logger.latest_sampling, logger.latest_id), (location.latest_sampling, location.latest_id)
+
+
+def test_latest_moves_forward_only(fleet):
+    record_batch([payload('L1', T0), payload('L1', T0 + MINUTE)])
+    newest = Periodik.query.filter_by(sampling=T0 + MINUTE).one()
+    assert pointers() == ((newest.sampling, newest.id), (newest.sampling, newest.id))
+
+    # data lama yang datang belakangan tidak memundurkan latest
+    record_batch([payload('L1', T0 - MINUTE)])
+    assert pointers()[0] == (newest.sampling, newest.id)
+    assert get_latest([1]) == {1: newest}
+
+    record_batch([payload('L1', T0 + 2 * MINUTE)])
+    assert pointers()[1][0] == T0 + 2 * MINUTE
+
+
+def test_location_without_data(fleet):
+    assert get_latest([1]) == {1: None}
+
+
+def test_rebuild_latest(fleet):
+    record_batch([payload('L1', T0), payload('L1', T0 + MINUTE)])
+    expected = pointers()
+    fleet.session.execute("UPDATE logger SET latest_sampling = NULL, latest_id = NULL")
+    fleet.session.execute("UPDATE location SET latest_sampling = NULL, latest_id = NULL")
+    fleet.session.commit()
+    rebuild_latest()
+    assert pointers() == expected
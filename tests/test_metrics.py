@@ -0,0 +1,30 @@
+import json
+
+from apps import app
+from apps.metrics import Metrics, merge, metrics, stats_app
+
+
+def test_stats_not_on_public_app():
+    assert app.test_client().get('/stats').status_code == 404
+
+
+def test_stats_on_listener_app(monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'STATS_DIR', str(tmp_path))
+    metrics.inc('test_stats_request')
+    res = stats_app.test_client().get('/stats?format=json')
+    assert res.status_code == 200
+    assert json.loads(res.get_data(as_text=True))['counters']['test_stats_request'] >= 1
+    assert 'prinus_test_stats_request' in stats_app.test_client().get('/stats').get_data(as_text=True)
+
+
+def test_merge_worker_snapshots():
+    listener, worker = Metrics(), Metrics()
+    listener.inc('recorded', 2)
+    listener.observe('commit', 0.002)
+    worker.inc('recorded', 3)
+    worker.inc('duplicate')
+    worker.observe('commit', 0.2)
+    merged = merge(listener.snapshot(), [worker.snapshot()])
+    assert merged['counters'] == {'recorded': 5, 'duplicate': 1}
+    assert merged['histograms']['commit']['count'] == 2
+    assert listener.snapshot()['counters'] == {'recorded': 2}
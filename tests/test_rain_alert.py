@@ -0,0 +1,43 @@
+import datetime
+
+from apps import command
+from apps.command import get_heavy_rain, rain_alert
+from apps.delivery import MemoryTransport, TelegramQueue
+from apps.models import Location, Logger, PeriodikHourly, Tenant
+
+HOUR = datetime.datetime(2024, 1, 1, 8)
+
+
+def setup_tenants(database):
+    ''' tenant 1 with its own thresholds (5 / 8 mm), tenant 2 with the defaults (10 / 20 mm) '''
+    database.session.add(Tenant(id=1, nama='Satu', slug='satu', telegram_alert_id=101,
+                                hujan_lebat=5, hujan_sangat_lebat=8))
+    database.session.add(Tenant(id=2, nama='Dua', slug='dua', telegram_alert_id=102))
+    for id, tenant_id, tipe, rain in ((1, 1, 'arr', 9), (2, 1, 'arr', 6), (3, 1, 'awlr', 30),
+                                      (4, 2, 'arr', 9), (5, 2, 'arr', 25)):
+        sn = f"L{id}"
+        database.session.add(Location(id=id, nama=f"Lokasi {id}", tenant_id=tenant_id))
+        database.session.add(Logger(sn=sn, tenant_id=tenant_id, location_id=id, tipe=tipe))
+        database.session.add(PeriodikHourly(logger_sn=sn, location_id=id, tenant_id=tenant_id,
+                                            sampling=HOUR, rain=rain))
+    database.session.commit()
+
+
+def test_heavy_rain_per_tenant_threshold(database):
+    setup_tenants(database)
+    found = [(ten.id, name, rain) for ten, name, rain in get_heavy_rain(HOUR)]
+    # 9 mm lebat untuk tenant 1, tidak untuk tenant 2; logger awlr diabaikan
+    assert found == [(1, 'Lokasi 1', 9), (1, 'Lokasi 2', 6), (2, 'Lokasi 5', 25)]
+    assert [ten.id for ten, name, rain in get_heavy_rain(HOUR, [2])] == [2]
+    assert get_heavy_rain(HOUR + datetime.timedelta(hours=1)) == []
+
+
+def test_rain_alert_messages(database, monkeypatch):
+    setup_tenants(database)
+    transport = MemoryTransport()
+    monkeypatch.setattr(command, 'TelegramQueue', lambda: TelegramQueue(transport=transport, per_chat=0))
+    rain_alert(HOUR + datetime.timedelta(minutes=10))
+    sent = dict((chat_id, text) for chat_id, text, parse_mode in transport.sent)
+    assert "Hujan Sangat Lebat di Lokasi 1 dengan intensitas 9" in sent[101]
+    assert "Hujan Lebat di Lokasi 2 dengan intensitas 6" in sent[101]
+    assert "Hujan Sangat Lebat di Lokasi 5" in sent[102] and "Lokasi 4" not in sent[102]
@@ -0,0 +1,79 @@
+import datetime
+
+import pytest
+from sqlalchemy import event
+
+from apps import registry
+from apps.models import Logger
+from apps.registry import LoggerRegistry
+
+
+class Clock:
+    ''' time.monotonic() of the registry, moved by the test '''
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(registry, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def lookups(fleet):
+    ''' number of Logger lookups by sn sent to the database '''
+    count = []
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        if 'logger.sn IN' in statement:
+            count.append(statement)
+    event.listen(fleet.engine, 'before_cursor_execute', on_execute)
+    yield count
+    event.remove(fleet.engine, 'before_cursor_execute', on_execute)
+
+
+def test_known_logger_cached_until_ttl(fleet, clock, lookups):
+    loggers = LoggerRegistry(ttl=300, unknown_ttl=60, check_every=30)
+    assert loggers.get('L1').tenant_id == 1
+    clock.now += 299
+    assert loggers.get_many(['L1'])['L1'].location_id == 1
+    assert len(lookups) == 1
+    clock.now += 2
+    loggers.get('L1')
+    assert len(lookups) == 2
+
+
+def test_unknown_logger_cached_as_none(fleet, clock, lookups):
+    loggers = LoggerRegistry(ttl=300, unknown_ttl=60, check_every=1000)
+    assert loggers.get('L2') is None
+    fleet.session.execute("INSERT INTO logger (sn, tenant_id) VALUES ('L2', 1)")
+    fleet.session.commit()
+    assert loggers.get('L2') is None
+    assert len(lookups) == 1
+    clock.now += 61
+    assert loggers.get('L2').tenant_id == 1
+
+
+def test_logger_change_drops_entries(fleet, clock):
+    loggers = LoggerRegistry(ttl=300, unknown_ttl=60, check_every=30)
+    assert loggers.get('L1').tipp_fac is None
+    # diubah proses lain, terlihat dari Logger.modified_at
+    fleet.session.execute("UPDATE logger SET tipp_fac = 0.5, modified_at = :now WHERE sn = 'L1'",
+                          {'now': datetime.datetime.utcnow()})
+    fleet.session.commit()
+    assert loggers.get('L1').tipp_fac is None
+    clock.now += 31
+    assert loggers.get('L1').tipp_fac == 0.5
+
+
+def test_orm_update_invalidates_global_registry(fleet):
+    assert registry.loggers.get('L1').temp_cor is None
+    Logger.query.filter_by(sn='L1').one().temp_cor = 1.5
+    fleet.session.commit()
+    assert registry.loggers.get('L1').temp_cor == 1.5
@@ -0,0 +1,74 @@
+import datetime
+
+from apps import reportcache
+from apps.migrate import MIGRATIONS
+from apps.models import Location, PeriodikHourly, ReportCache, Tenant
+from apps.reportcache import cached_report
+from apps.rollup import update_rollup
+
+BUCKET = datetime.datetime(2024, 1, 1, 9)
+WINDOW = (datetime.datetime(2024, 1, 1, 7), BUCKET)
+
+
+class Build:
+    ''' report result, counts how often it was computed '''
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return [{'location_id': 1, 'rain': self.calls}]
+
+
+def sample(sampling):
+    return {'logger_sn': 'A', 'location_id': 1, 'tenant_id': 1, 'sampling': sampling,
+            'rain': 0.2, 'wlev': None, 'batt': None}
+
+
+def setup_tenant(database):
+    database.session.add(Tenant(id=1, nama='Tenant', slug='ten'))
+    database.session.add(Location(id=1, nama='Lokasi', tenant_id=1))
+    database.session.add(PeriodikHourly(logger_sn='A', location_id=1, tenant_id=1,
+                                        sampling=datetime.datetime(2024, 1, 1, 8),
+                                        modified_at=datetime.datetime.utcnow() - datetime.timedelta(hours=1)))
+    database.session.commit()
+
+
+def test_late_sample_invalidates(database):
+    setup_tenant(database)
+    build = Build()
+    assert cached_report(1, 'ch', BUCKET, WINDOW, build) == [{'location_id': 1, 'rain': 1}]
+    assert cached_report(1, 'ch', BUCKET, WINDOW, build) == [{'location_id': 1, 'rain': 1}]
+    assert build.calls == 1
+
+    # data di luar window tidak mengubah laporan
+    update_rollup([sample(datetime.datetime(2024, 1, 1, 12))])
+    database.session.commit()
+    assert cached_report(1, 'ch', BUCKET, WINDOW, build)[0]['rain'] == 1
+
+    # data terlambat di dalam window, laporan dihitung ulang
+    update_rollup([sample(datetime.datetime(2024, 1, 1, 7, 35))])
+    database.session.commit()
+    assert cached_report(1, 'ch', BUCKET, WINDOW, build)[0]['rain'] == 2
+    assert ReportCache.query.one().result == [{'location_id': 1, 'rain': 2}]
+
+
+def test_location_change_drops_tenant_entries(database):
+    setup_tenant(database)
+    build = Build()
+    cached_report(1, 'ch', BUCKET, WINDOW, build)
+    Location.query.get(1).nama = 'Lokasi Baru'
+    database.session.commit()
+    assert ReportCache.query.count() == 0
+
+
+def test_report_cache_migration(database):
+    ReportCache.__table__.drop(database.engine)
+    reportcache.cache_table = False
+    build = Build()
+    cached_report(1, 'ch', BUCKET, WINDOW, build)
+    assert not reportcache.has_cache_table()  # belum dimigrasi, selalu dihitung
+    MIGRATIONS['report-cache']()
+    assert reportcache.has_cache_table()
+    MIGRATIONS['report-cache']()  # tabel sudah ada
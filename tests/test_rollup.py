@@ -0,0 +1,69 @@
+import datetime
+
+from apps.migrate import MIGRATIONS
+from apps.models import Periodik, PeriodikDaily, PeriodikHourly
+from apps.rollup import HOUR, day_bucket, day_slot, hour_bucket, hour_slot, update_rollup
+
+
+def test_hour_bucket_is_end_of_hour():
+    assert hour_bucket(datetime.datetime(2024, 1, 1, 7, 5)) == datetime.datetime(2024, 1, 1, 8)
+    assert hour_bucket(datetime.datetime(2024, 1, 1, 8, 0)) == datetime.datetime(2024, 1, 1, 8)
+
+
+def test_hour_slot():
+    hour = datetime.datetime(2024, 1, 1, 7)
+    assert hour_slot(hour + datetime.timedelta(minutes=5)) == 0
+    assert hour_slot(hour + datetime.timedelta(minutes=7)) == 1
+    assert hour_slot(hour + datetime.timedelta(minutes=10)) == 1
+    assert hour_slot(hour + datetime.timedelta(minutes=1)) == 0
+    assert hour_slot(hour + datetime.timedelta(minutes=60)) == 11
+
+
+def test_day_slot():
+    day = datetime.datetime(2024, 1, 1)
+    assert day_bucket(day + datetime.timedelta(minutes=5)) == datetime.datetime(2024, 1, 2)
+    assert day_slot(day + datetime.timedelta(minutes=5)) == 0
+    assert day_slot(day + datetime.timedelta(hours=1)) == 0
+    assert day_slot(day + datetime.timedelta(hours=1, minutes=5)) == 1
+    assert day_slot(day + datetime.timedelta(days=1)) == 23
+
+
+def periodik(sn, sampling, rain=None, wlev=None, batt=None):
+    return {'logger_sn': sn, 'location_id': 1, 'tenant_id': 1, 'sampling': sampling,
+            'rain': rain, 'wlev': wlev, 'batt': batt}
+
+
+def test_update_rollup_upsert(database):
+    hour = datetime.datetime(2024, 1, 1, 7)
+    minute = datetime.timedelta(minutes=1)
+    update_rollup([periodik('A', hour + 5 * minute, rain=0.2, wlev=100, batt=12.5),
+                   periodik('A', hour + 10 * minute, rain=0.4, wlev=90)])
+    database.session.commit()
+    # data terlambat di jam yang sama ditambahkan ke baris yang ada
+    update_rollup([periodik('A', hour + 60 * minute, wlev=120, batt=12.1),
+                   periodik('A', hour + 30 * minute, rain=0.2, wlev=80)])
+    database.session.commit()
+
+    row = PeriodikHourly.query.one()
+    assert row.sampling == hour + HOUR
+    assert row.samples == 4
+    assert round(row.rain, 2) == 0.8 and row.rain_minute == 15
+    assert (row.wlev_min, row.wlev_max, row.batt_min) == (80, 120, 12.1)
+    # dibandingkan sebagai DateTime, bukan string
+    assert row.wlev_last == 120 and row.wlev_last_at == hour + HOUR
+    assert row.last_sampling == hour + HOUR
+    assert row.slots == 0b100000100011
+    daily = PeriodikDaily.query.one()
+    assert daily.sampling == datetime.datetime(2024, 1, 2) and daily.samples == 4
+
+
+def test_rollup_migration_creates_tables(database):
+    PeriodikDaily.__table__.drop(database.engine)
+    PeriodikHourly.__table__.drop(database.engine)
+    database.session.add(Periodik(logger_sn='A', sampling=datetime.datetime(2024, 1, 1, 7, 5), rain=0.2))
+    database.session.commit()
+    MIGRATIONS['rollup']()
+    assert PeriodikHourly.query.one().rain == 0.2
+    assert PeriodikDaily.query.one().samples == 1
+    MIGRATIONS['rollup']()  # tabel sudah ada
+    assert PeriodikHourly.query.count() == 1
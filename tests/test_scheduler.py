@@ -0,0 +1,69 @@
+import datetime
+
+from apps.metrics import metrics
+from apps.models import Tenant
+from apps.scheduler import Scheduler
+
+UTC = datetime.timezone.utc
+START = datetime.datetime(2024, 1, 1, 0, 30, tzinfo=UTC)
+HOUR = datetime.timedelta(hours=1)
+
+
+def counter(name):
+    return metrics.snapshot()['counters'].get(name, 0)
+
+
+def setup_tenants(database):
+    database.session.add(Tenant(id=1, nama='Jakarta', slug='jkt', timezone='Asia/Jakarta'))
+    database.session.add(Tenant(id=2, nama='Jayapura', slug='jyp', timezone='Asia/Jayapura'))
+    database.session.commit()
+
+
+def due(scheduler, now):
+    return dict(((job, at), [ten.id for ten in tenants]) for (job, at), tenants in scheduler.due(now).items())
+
+
+def test_due_per_tenant_timezone(database):
+    setup_tenants(database)
+    scheduler = Scheduler(schedule={'warning': '0 * * * *', 'count': '0 7 * * *'}, jobs={})
+    # jadwal mulai dari sekarang, yang sudah lewat tidak dikirim
+    assert due(scheduler, START) == {}
+    # 07:00 Jayapura (UTC+9) = 22:00 UTC, 07:00 Jakarta (UTC+7) = 00:00 UTC
+    hour = datetime.datetime(2024, 1, 1, 1, tzinfo=UTC)
+    assert due(scheduler, hour + datetime.timedelta(minutes=1)) == {('warning', hour): [1, 2]}
+    evening = datetime.datetime(2024, 1, 1, 22, tzinfo=UTC)
+    assert due(scheduler, evening) == {('count', evening): [2]}
+    assert due(scheduler, evening + 2 * HOUR) == {('count', evening + 2 * HOUR): [1]}
+
+
+def test_late_run_missed(database):
+    setup_tenants(database)
+    scheduler = Scheduler(schedule={'warning': '0 * * * *'}, jobs={}, grace=600)
+    due(scheduler, START)
+    missed = counter('job_warning_missed')
+    # 11 menit terlambat, dilewati; jadwal berikutnya tetap jalan
+    assert due(scheduler, START + datetime.timedelta(minutes=41)) == {}
+    assert counter('job_warning_missed') == missed + 2
+    hour = datetime.datetime(2024, 1, 1, 2, tzinfo=UTC)
+    assert due(scheduler, hour) == {('warning', hour): [1, 2]}
+
+
+def test_run_job_overrun_and_errors(database):
+    setup_tenants(database)
+    calls = []
+
+    def job(time, tenants):
+        calls.append((time, [ten.id for ten in tenants]))
+        if len(calls) > 1:
+            raise RuntimeError("telegram tidak tersedia")
+
+    scheduler = Scheduler(schedule={'warning': '0 * * * *'}, jobs={'warning': job})
+    tenants = Tenant.query.order_by(Tenant.id).all()
+    now = datetime.datetime.now(UTC).replace(minute=0, second=0, microsecond=0)
+    overrun = counter('job_warning_overrun')
+    scheduler.run_job('warning', now, tenants)
+    assert counter('job_warning_overrun') == overrun
+    # selesai setelah jadwal berikutnya (jam lalu), error tidak menghentikan scheduler
+    scheduler.run_job('warning', now - 2 * HOUR, tenants)
+    assert counter('job_warning_overrun') == overrun + 1
+    assert calls[0] == (now.astimezone().replace(tzinfo=None), [1, 2])
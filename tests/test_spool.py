@@ -0,0 +1,61 @@
+import datetime
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from apps import ingest
+from apps.models import Periodik
+from apps.spool import Spool
+from conftest import payload
+
+T0 = datetime.datetime(2024, 1, 1, 7, 5)
+MINUTE = datetime.timedelta(minutes=5)
+
+
+@pytest.fixture
+def database_down(monkeypatch):
+    ''' payloads whose temperature is in `down` fail with a database error '''
+    down = set()
+    update_rollup = ingest.update_rollup
+
+    def failing_rollup(rows):
+        if any(row['temp'] in down for row in rows):
+            raise OperationalError('UPDATE', {}, Exception('server closed the connection'))
+        update_rollup(rows)
+    monkeypatch.setattr(ingest, 'update_rollup', failing_rollup)
+    return down
+
+
+def test_checkpoint_stops_before_failed_payload(fleet, database_down, tmp_path):
+    spool = Spool(str(tmp_path), batch=10)
+    for i in range(5):
+        spool.append(payload('L1', T0 + i * MINUTE, temperature=i))
+    start = spool.read_checkpoint()
+
+    database_down.update(range(5))
+    assert spool.drain_once() == 0
+    assert spool.read_checkpoint() == start and Periodik.query.count() == 0
+
+    database_down.clear()
+    database_down.add(2)
+    assert spool.drain_once() == 2
+    payloads, ends, end = spool.read(*spool.read_checkpoint())
+    assert [raw['temperature'] for raw in payloads] == [2, 3, 4]
+
+    # database kembali, sisa batch diulang, yang sudah tercatat dilewati
+    database_down.clear()
+    assert spool.drain_once() == 3
+    assert sorted(p.temp for p in Periodik.query) == [0, 1, 2, 3, 4]
+    assert spool.backlog() == 0
+    spool.stop()
+
+
+def test_finished_segment_removed(fleet, tmp_path):
+    spool = Spool(str(tmp_path), segment_size=50)
+    for i in range(3):
+        spool.append(payload('L1', T0 + i * MINUTE))
+    assert len(spool.segments()) == 4
+    while spool.drain_once() or spool.read_checkpoint()[0] < spool.seq:
+        pass
+    assert spool.segments() == [spool.seq] and Periodik.query.count() == 3
+    spool.stop()